@@ -2,37 +2,51 @@ from aiogram import Bot, Dispatcher, types, F
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, WebAppInfo
 from aiogram.filters import CommandStart
 import os
+import sys
 from fastapi import FastAPI
 import asyncio
 import json
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv  # Добавляем импорт
 
-from calendar_utils import get_calendar_service, create_event, get_busy_slots_for_day
+# Запись и чтение — через API бэкенда, асинхронно: цикл бота не ждёт Google
+from booking_service import SlotTaken, booking_service
+
+# Общая с бэкендом настройка логов (JSON через очередь); каталог backend — в конце пути поиска,
+# чтобы не перекрыть модули бота с теми же именами
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+from log_config import setup_logging
+from schedule_rules import get_rules
+import catalog
 
 # Загружаем переменные из .env файла
 load_dotenv()
 
+setup_logging()
+logger = logging.getLogger("assistent_bot")
+
 API_TOKEN = os.getenv("BOT_TOKEN")
 CALENDAR_ID = os.getenv("CALENDAR_ID")
 ADMIN_ID = os.getenv("ADMIN_CHAT_ID")  # ID администратора для уведомлений
+MOSCOW_TZ = timezone(timedelta(hours=3))
 
 # Проверяем, что токен загружен
 if not API_TOKEN:
     raise ValueError("BOT_TOKEN не найден в .env файле!")
 
+def md(value) -> str:
+    """Экранировать текст для parse_mode='Markdown': имя с «_» или «*» иначе ломает всё сообщение."""
+    text = str(value)
+    for char in ("_", "*", "`", "["):
+        text = text.replace(char, "\\" + char)
+    return text
+
+
 bot = Bot(token=API_TOKEN)
 dp = Dispatcher()
 app = FastAPI()
 
-# Типы массажа
-MASSAGE_TYPES = {
-    'classic': {'name': 'Классический массаж', 'duration': 60, 'price': '2500 ₽'},
-    'therapeutic': {'name': 'Лечебный массаж', 'duration': 80, 'price': '3500 ₽'},
-    'fullbody': {'name': 'Массаж всего тела', 'duration': 90, 'price': '4000 ₽'},
-    'express': {'name': 'Экспресс массаж', 'duration': 40, 'price': '1800 ₽'},
-}
-
 
 @dp.message(CommandStart())
 async def send_welcome(message: types.Message):
@@ -46,59 +60,56 @@ async def handle_webapp_data(message: types.Message):
         data = json.loads(message.web_app_data.data)
         selected_time = datetime.fromisoformat(data['slot'])
         user_name = data.get('name', message.from_user.full_name)
-        massage_type_id = data.get('massageType', 'classic')
-        massage_name = data.get('massageName', 'Массаж')
-        price = data.get('price', '2500 ₽')
-        
-        # Получаем информацию о типе массажа
-        massage_info = MASSAGE_TYPES.get(massage_type_id, MASSAGE_TYPES['classic'])
-        duration = massage_info['duration']
+        # id записи, если WebApp уже записал клиента через /api/book
+        booking_id = data.get('eventId')
+        # Название, длительность и цену берём из общего с бэкендом каталога, а не из данных WebApp
+        massage = catalog.get(data.get('massageType')) or catalog.BY_ID[catalog.DEFAULT_TYPE]
+        massage_type_id = massage.id
+        massage_name = massage.name
+        duration = data.get('duration')
+        if duration not in massage.durations:
+            duration = massage.default_duration
+        price = catalog.format_price(massage.price_for(duration))
         
     except (json.JSONDecodeError, KeyError) as e:
         # Старый формат — только ISO-строка без JSON
         try:
             selected_time = datetime.fromisoformat(message.web_app_data.data)
             user_name = message.from_user.full_name
-            massage_type_id = 'classic'
-            massage_name = 'Классический массаж'
-            price = '2500 ₽'
-            duration = 60
+            booking_id = None
+            massage = catalog.BY_ID[catalog.DEFAULT_TYPE]
+            massage_type_id = massage.id
+            massage_name = massage.name
+            duration = massage.default_duration
+            price = catalog.format_price(massage.price_for(duration))
         except ValueError:
             await message.answer("❌ Ошибка в формате данных. Пожалуйста, попробуйте ещё раз.")
             return
 
     try:
-        # Создаем событие в Google Calendar
         end_time = selected_time + timedelta(minutes=duration)
-        
-        event_description = f"""
-📋 Детали записи:
-👤 Клиент: {user_name}
-💆‍♂️ Тип массажа: {massage_name}
-⏱️ Длительность: {duration} минут
-💰 Стоимость: {price}
-📱 Telegram: @{message.from_user.username or 'нет username'}
-🆔 ID: {message.from_user.id}
-📞 Номер: {message.from_user.phone_number or 'не указан'}
-        """.strip()
-        
-        # Создаем событие в календаре
-        event = create_event(
-            name=user_name,
-            start_time=selected_time,
-            end_time=end_time,
-            massage_type=massage_name,
-            description=event_description
-        )
-        
+        user_id = str(message.from_user.id)
+
+        # WebApp обычно уже записал клиента сам — тогда только подтверждаем запись, а не создаём вторую.
+        # Иначе записываем через бэкенд: он проверит пересечения так же, как для WebApp
+        booking = await booking_service.find_booking(user_name, user_id, selected_time, booking_id)
+        if booking is None:
+            try:
+                booking_id = await booking_service.book(user_name, selected_time, massage_type_id, duration, user_id)
+            except SlotTaken:
+                await message.answer("❌ Это время уже занято. Пожалуйста, выберите другое время.")
+                return
+        else:
+            booking_id = booking["eventId"]
+
         # Отправляем подтверждение клиенту
         confirmation_text = f"""
 ✅ **Запись подтверждена!**
 
-👤 Имя: {user_name}
+👤 Имя: {md(user_name)}
 📅 Дата: {selected_time.strftime('%d.%m.%Y')}
 🕐 Время: {selected_time.strftime('%H:%M')} - {end_time.strftime('%H:%M')}
-💆‍♂️ Услуга: {massage_name}
+💆‍♂️ Услуга: {md(massage_name)}
 💰 Стоимость: {price}
 
 📍 Адрес будет отправлен дополнительно.
@@ -111,29 +122,30 @@ async def handle_webapp_data(message: types.Message):
             admin_text = f"""
 🔔 **НОВАЯ ЗАПИСЬ**
 
-👤 Клиент: {user_name}
-📱 Username: @{message.from_user.username or 'отсутствует'}
+👤 Клиент: {md(user_name)}
+📱 Username: @{md(message.from_user.username or 'отсутствует')}
 🆔 ID: {message.from_user.id}
 📞 Телефон: {message.from_user.phone_number or 'не указан'}
 
 📅 Дата: {selected_time.strftime('%d.%m.%Y')}
 🕐 Время: {selected_time.strftime('%H:%M')} - {end_time.strftime('%H:%M')}
-💆‍♂️ Услуга: {massage_name}
+💆‍♂️ Услуга: {md(massage_name)}
 ⏱️ Длительность: {duration} минут
 💰 Стоимость: {price}
 
-📝 Событие создано в календаре.
+📝 Запись сохранена, в календарь она попадёт автоматически.
             """
             
             try:
                 await bot.send_message(ADMIN_ID, admin_text, parse_mode='Markdown')
             except Exception as e:
-                print(f"Ошибка отправки уведомления админу: {e}")
+                logger.warning("Ошибка отправки уведомления админу: %s", e)
         
-        print(f"✅ Создана запись: {user_name} на {selected_time} ({massage_name})")
+        logger.info("Создана запись", extra={"slot": selected_time.isoformat(), "massage_type": massage_type_id,
+                                             "booking_id": booking_id})
         
     except Exception as e:
-        print(f"❌ Ошибка при создании записи: {e}")
+        logger.exception("Ошибка при создании записи")
         await message.answer("❌ Произошла ошибка при создании записи. Пожалуйста, попробуйте позже или обратитесь к администратору.")
         
         # Уведомляем админа об ошибке
@@ -141,9 +153,9 @@ async def handle_webapp_data(message: types.Message):
             error_text = f"""
 ⚠️ **ОШИБКА ЗАПИСИ**
 
-👤 Пользователь: {user_name} (@{message.from_user.username})
+👤 Пользователь: {md(user_name)} (@{md(message.from_user.username)})
 🕐 Время: {selected_time.strftime('%d.%m.%Y %H:%M')}
-❌ Ошибка: {str(e)}
+❌ Ошибка: {md(e)}
             """
             try:
                 await bot.send_message(ADMIN_ID, error_text, parse_mode='Markdown')
@@ -203,21 +215,22 @@ async def show_today_bookings(message: types.Message):
         return
     
     try:
-        # Получаем записи на сегодня из календаря
-        service = get_calendar_service()
-        today = datetime.now().date()
-        busy_slots = get_busy_slots_for_day(service, today)
+        # Записи на сегодня из журнала бэкенда — без запроса к Google из цикла бота
+        today = datetime.now(MOSCOW_TZ).date()
+        bookings = await booking_service.day_bookings(today)
         
-        if not busy_slots:
+        if not bookings:
             await message.answer("📅 **Сегодняшние записи**\n\nНа сегодня записей нет.", parse_mode='Markdown')
             return
         
         bookings_text = "📅 **ЗАПИСИ НА СЕГОДНЯ**\n\n"
         
-        for i, slot_time in enumerate(sorted(busy_slots), 1):
-            bookings_text += f"{i}. 🕐 {slot_time.strftime('%H:%M')} - Запись\n"
+        for i, booking in enumerate(bookings, 1):
+            slot_time = datetime.fromisoformat(booking["slot"])
+            bookings_text += (f"{i}. 🕐 {slot_time.strftime('%H:%M')} - {md(booking['name'])},"
+                              f" {md(catalog.name_of(booking.get('massageType')))}\n")
         
-        bookings_text += f"\n📊 Всего записей: {len(busy_slots)}"
+        bookings_text += f"\n📊 Всего записей: {len(bookings)}"
         
         await message.answer(bookings_text, parse_mode='Markdown')
         
@@ -231,15 +244,20 @@ async def show_settings(message: types.Message):
         await message.answer("❌ У вас нет прав для выполнения этой команды.")
         return
     
-    settings_text = """
+    # Те же правила расписания, по которым бэкенд считает свободные слоты
+    rules = get_rules()
+    working_hours = "\n".join(f"  {line}" for line in rules.describe())
+    lead_hours = rules.lead_time.total_seconds() / 3600
+    settings_text = f"""
 ⚙️ **НАСТРОЙКИ СИСТЕМЫ**
 
 🔧 Текущие настройки:
-• Рабочие часы: 9:00 - 21:00
-• Длительность слота: 20 минут
-• Перерыв между сеансами: 20 минут
-• Предварительная запись: 4 часа
-• Максимум дней вперед: 14
+• Рабочие часы:
+{working_hours}
+• Длительность слота: {rules.slot_step} минут
+• Перерыв между сеансами: {rules.buffer_minutes} минут
+• Предварительная запись: {lead_hours:g} ч
+• Максимум дней вперед: {rules.horizon_days}
 
 📱 Для изменения настроек обратитесь к разработчику.
     """
@@ -248,7 +266,10 @@ async def show_settings(message: types.Message):
 
 
 async def main():
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await booking_service.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,27 @@
+"""Выполнение блокирующего ввода-вывода вне event loop.
+
+googleapiclient, requests и клиент Celery синхронные. Если вызывать их
+прямо в ``async def``-обработчике, один медленный ответ Google или Telegram
+останавливает все остальные запросы воркера uvicorn. Здесь такие вызовы
+уходят в ограниченный пул потоков, а каждый поток пула держит своё
+keep-alive соединение с Google (см. ``calendar_client``).
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", "32"))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Выполнить синхронную функцию в пуле и дождаться результата, не блокируя цикл."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,225 @@
+"""Предрассчитанный индекс свободных слотов по дням.
+
+Для каждого дня хранится битовая маска занятых минут (1440 бит в одном
+``int``), для пары (день, длительность) — отсортированный список минут,
+с которых можно начать сеанс. Кандидаты в начала берутся из шаблона
+расписания (``schedule_rules``), скомпилированного заранее для каждого дня
+недели, поэтому проверка слота сводится к одной операции ``&`` над маской,
+а запрос слотов — к ``bisect`` по готовому списку.
+Индекс подписан на источник занятых интервалов (``busy_provider``): любое
+изменение календаря (запись, отмена, удаление просроченного события,
+синхронизация) сбрасывает только затронутые дни, и они пересчитываются
+при следующем обращении.
+"""
+import threading
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from busy_provider import make_busy_source
+from catalog import DURATIONS, SLOT_VARIANTS
+from event_store import MOSCOW_TZ, get_store
+from schedule_rules import ScheduleTemplate, get_rules, get_template
+from single_flight import SingleFlight
+
+_rules = get_rules()
+SLOT_STEP = _rules.slot_step  # сетка слотов, минут
+BUFFER_MINUTES = _rules.buffer_minutes  # перерыв после каждого сеанса
+LEAD_TIME = _rules.lead_time  # запись не раньше чем за 4 часа (по умолчанию)
+HORIZON_DAYS = _rules.horizon_days
+KNOWN_DURATIONS = DURATIONS  # длительности услуг из каталога
+KNOWN_VARIANTS = SLOT_VARIANTS  # (длительность, перерыв) услуг из каталога, прогреваемые заранее
+
+
+def _range_mask(start: int, length: int) -> int:
+    return ((1 << length) - 1) << start
+
+
+class AvailabilityIndex:
+    def __init__(self, source, template: Optional[ScheduleTemplate] = None):
+        self._source = source
+        self._template = template or get_template()
+        self._lock = threading.Lock()
+        self._busy: Dict[date, int] = {}
+        self._starts: Dict[Tuple[date, int, int], List[int]] = {}
+        self._generation: Dict[date, int] = {}
+        # Промах по одному дню от многих запросов сразу считается (и запрашивает занятость) один раз
+        self._flight = SingleFlight("busy_mask")
+        # Растёт при любом изменении календаря — на нём строятся ETag ответов
+        self.version = 0
+        self._listeners: List[Callable[[Set[date]], None]] = []
+        self.hits = 0
+        self.misses = 0
+        source.add_listener(self.invalidate)
+
+    def add_listener(self, listener: Callable[[Set[date]], None]):
+        """Подписаться на сброс дней индекса (вызывается после инвалидации)."""
+        self._listeners.append(listener)
+
+    def invalidate(self, days: Set[date]):
+        with self._lock:
+            self.version += 1
+            for day in days:
+                self._busy.pop(day, None)
+                self._generation[day] = self._generation.get(day, 0) + 1
+            for key in [key for key in self._starts if key[0] in days]:
+                del self._starts[key]
+        for listener in list(self._listeners):
+            listener(days)
+
+    def busy_mask(self, day: date) -> int:
+        self._source.refresh_if_stale()
+        with self._lock:
+            mask = self._busy.get(day)
+            generation = self._generation.get(day, 0)
+        if mask is not None:
+            return mask
+        # В ключе и поколение дня: после инвалидации расчёт по старым данным уже не подхватывается
+        return self._flight.do((day, generation), self._compute_mask, day, generation)
+
+    def _compute_mask(self, day: date, generation: int) -> int:
+        mask = 0
+        day_start = datetime(day.year, day.month, day.day)
+        for start, end in self._source.busy_intervals(day):
+            first = max(0, int((start - day_start).total_seconds() // 60))
+            last = min(24 * 60, -int(-(end + timedelta(minutes=BUFFER_MINUTES) - day_start).total_seconds() // 60))
+            if last > first:
+                mask |= _range_mask(first, last - first)
+        with self._lock:
+            # Не кэшируем маску, если день успели инвалидировать во время расчёта
+            if self._generation.get(day, 0) == generation:
+                self._busy[day] = mask
+        return mask
+
+    def is_free(self, start: datetime, duration_minutes: int, buffer_minutes: int = BUFFER_MINUTES) -> bool:
+        """Можно ли начать сеанс в start: он в рабочем времени, а он сам, перерыв после него
+        и общий буфер не задевают существующие сеансы с их перерывами и буферами."""
+        minute = start.hour * 60 + start.minute
+        session = _range_mask(minute, min(duration_minutes, 24 * 60 - minute))
+        if self._template.open_mask(start.date()) & session != session:
+            return False
+        # Общий буфер — и после нового сеанса: запись перед уже занятым временем отстоит от него так же,
+        # как запись после него
+        with_buffer = _range_mask(minute, min(duration_minutes + buffer_minutes + BUFFER_MINUTES, 24 * 60 - minute))
+        return self.busy_mask(start.date()) & with_buffer == 0
+
+    def free_starts(self, day: date, duration_minutes: int, buffer_minutes: int = BUFFER_MINUTES) -> List[int]:
+        """Минуты от полуночи, с которых можно начать сеанс (без учёта текущего времени)."""
+        key = (day, duration_minutes, buffer_minutes)
+        # Кэш источника истёк — он обновится в фоне и сбросит изменившиеся дни
+        self._source.refresh_if_stale()
+        with self._lock:
+            starts = self._starts.get(key)
+        if starts is not None:
+            self.hits += 1
+            return starts
+        self.misses += 1
+        with self._lock:
+            generation = self._generation.get(day, 0)
+        busy = self.busy_mask(day)
+        starts = [minute for minute, mask in self._template.candidates(day, duration_minutes,
+                                                                     buffer_minutes + BUFFER_MINUTES)
+                  if busy & mask == 0]
+        with self._lock:
+            if self._generation.get(day, 0) == generation:
+                self._starts[key] = starts
+        return starts
+
+    def available_slots(self, day: date, duration_minutes: int, now: Optional[datetime] = None,
+                        buffer_minutes: int = BUFFER_MINUTES) -> List[str]:
+        now = now or datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+        if day < now.date() or day > now.date() + timedelta(days=HORIZON_DAYS):
+            return []
+        day_start = datetime(day.year, day.month, day.day)
+        starts = self.free_starts(day, duration_minutes, buffer_minutes)
+        # Слот должен начинаться строго позже now + LEAD_TIME
+        cutoff = (now + LEAD_TIME - day_start).total_seconds() // 60
+        if cutoff >= 0:
+            starts = starts[bisect_right(starts, cutoff):]
+        return [(day_start + timedelta(minutes=minute)).isoformat() for minute in starts]
+
+    def warm(self, days: Iterable[date], variants: Iterable[Tuple[int, int]] = KNOWN_VARIANTS):
+        for day in days:
+            for duration, buffer_minutes in variants:
+                self.free_starts(day, duration, buffer_minutes)
+
+
+class CombinedAvailability:
+    """Доступность «любого мастера»: слот свободен, если он свободен хотя бы в одном из календарей.
+
+    Повторяет интерфейс ``AvailabilityIndex`` для чтения (``free_starts``,
+    ``available_slots``, ``version``, подписка на сброс), объединяя уже
+    посчитанные списки начал индексов — отдельных обращений к Google нет.
+    """
+
+    def __init__(self, indexes: Iterable[AvailabilityIndex]):
+        self._indexes = list(indexes)
+
+    @property
+    def version(self) -> int:
+        return sum(index.version for index in self._indexes)
+
+    @property
+    def hits(self) -> int:
+        return sum(index.hits for index in self._indexes)
+
+    @property
+    def misses(self) -> int:
+        return sum(index.misses for index in self._indexes)
+
+    def add_listener(self, listener: Callable[[Set[date]], None]):
+        for index in self._indexes:
+            index.add_listener(listener)
+
+    def is_free(self, start: datetime, duration_minutes: int, buffer_minutes: int = BUFFER_MINUTES) -> bool:
+        return any(index.is_free(start, duration_minutes, buffer_minutes) for index in self._indexes)
+
+    def free_starts(self, day: date, duration_minutes: int, buffer_minutes: int = BUFFER_MINUTES) -> List[int]:
+        starts: Set[int] = set()
+        for index in self._indexes:
+            starts.update(index.free_starts(day, duration_minutes, buffer_minutes))
+        return sorted(starts)
+
+    def available_slots(self, day: date, duration_minutes: int, now: Optional[datetime] = None,
+                        buffer_minutes: int = BUFFER_MINUTES) -> List[str]:
+        slots: Set[str] = set()
+        for index in self._indexes:
+            slots.update(index.available_slots(day, duration_minutes, now, buffer_minutes))
+        return sorted(slots)
+
+    def warm(self, days: Iterable[date], variants: Iterable[Tuple[int, int]] = KNOWN_VARIANTS):
+        days, variants = list(days), list(variants)
+        for index in self._indexes:
+            index.warm(days, variants)
+
+
+def time_bucket(now: Optional[datetime] = None) -> Tuple[date, date, int]:
+    """Часть ключа кэша, зависящая от времени: сегодня и положение границы now + LEAD_TIME.
+
+    Список слотов меняется со временем только когда граница «не раньше чем за
+    4 часа» переходит через очередное возможное начало слота или наступает
+    новый день. Начала берутся из шаблона расписания: сетка отсчитывается от
+    начала каждого рабочего интервала, а не от полуночи.
+    """
+    now = now or datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+    cutoff = now + LEAD_TIME
+    cutoff_day = cutoff.date()
+    # Та же граница, что и в available_slots: начала не позже неё уже не предлагаются
+    minute = (cutoff - datetime(cutoff_day.year, cutoff_day.month, cutoff_day.day)).total_seconds() // 60
+    return now.date(), cutoff_day, bisect_right(get_template().grid(cutoff_day), minute)
+
+
+_indexes: Dict[str, AvailabilityIndex] = {}
+_index_lock = threading.Lock()
+
+
+def get_index(calendar_id: Optional[str] = None) -> AvailabilityIndex:
+    """Индекс свободных слотов календаря (по умолчанию основного)."""
+    store = get_store(calendar_id)
+    index = _indexes.get(store.calendar_id)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(store.calendar_id)
+            if index is None:
+                index = _indexes[store.calendar_id] = AvailabilityIndex(make_busy_source(store))
+    return index
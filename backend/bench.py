@@ -0,0 +1,236 @@
+"""Бенчмарк основных эндпоинтов на поддельном Google Calendar и Telegram.
+
+Поднимает приложение с ``CALENDAR_BACKEND=fake`` (календарь заполняется
+``--events`` событиями на горизонт записи, каждый вызов Google задерживается
+на ``--latency``), заглушку Telegram из ``loadtest`` и по очереди гоняет
+сценарии: ``/api/slots`` по одному дню и по всему горизонту, ``/api/slots/range``,
+``/api/book`` на заведомо свободные слоты (вместе с переносом журнала в Google), ``/api/user-bookings`` и
+``/api/records``. Для каждого печатает пропускную способность, p50/p99 и
+число вызовов Google (и Telegram) на сценарий.
+
+Запуск из каталога backend::
+
+    python bench.py --events 300 --latency 0.05 --concurrency 16
+
+``--json FILE`` сохраняет результаты, ``--baseline FILE`` сравнивает с
+сохранёнными: рост p99 больше ``--tolerance`` или новые вызовы Google дают
+код выхода 1, так что бенчмарк можно ставить в CI.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import loadtest  # noqa: E402
+
+Request = Tuple[str, str, Optional[dict]]
+
+SEED_WINDOW = 5 * 60  # минут от 10:00, занятых засеянными событиями
+SEED_STEP = 20
+
+
+def seed_calendar(count: int, days: int = 15) -> List[str]:
+    """Занять календарь ``count`` событиями, равномерно по ``days`` дням; вернуть имена клиентов.
+
+    События ставятся в первую половину рабочего дня (10:00–15:00, при большом
+    ``count`` — внахлёст), вторая половина остаётся свободной для сценария записи.
+    """
+    from calendar_client import CALENDAR_ID
+    from event_store import MOSCOW_TZ
+    from fake_calendar import get_fake_service
+
+    service = get_fake_service()
+    today = datetime.now(MOSCOW_TZ).replace(tzinfo=None, hour=10, minute=0, second=0, microsecond=0)
+    per_day = max(1, -(-count // days))
+    step = max(SEED_STEP, SEED_WINDOW // per_day)
+    names = []
+    for i in range(count):
+        start = today + timedelta(days=1 + i // per_day, minutes=(i % per_day) * step % SEED_WINDOW)
+        name = f"Клиент {i % max(1, count // 3)}"
+        service.add_event(CALENDAR_ID, start, start + timedelta(minutes=40), f"Массаж - {name}",
+                          extendedProperties={"private": {"userName": name, "massageType": "classic",
+                                                          "duration": "40"}})
+        names.append(name)
+    return sorted(set(names))
+
+
+def free_slots(limit: int, duration: int) -> List[str]:
+    """Непересекающиеся свободные слоты из индекса — чтобы каждая запись в сценарии прошла."""
+    from availability import BUFFER_MINUTES, HORIZON_DAYS, get_index
+    from event_store import MOSCOW_TZ, get_store
+
+    get_store().ensure_ready()
+    index = get_index()
+    today = datetime.now(MOSCOW_TZ).date()
+    slots = []
+    for offset in range(2, HORIZON_DAYS + 1):
+        last_end = None
+        for slot in index.available_slots(today + timedelta(days=offset), duration):
+            start = datetime.fromisoformat(slot)
+            if last_end is None or start >= last_end:
+                slots.append(slot)
+                # Событие записи уже длиннее сеанса на буфер (calendar_utils), и индекс добавляет свой
+                last_end = start + timedelta(minutes=duration + 2 * BUFFER_MINUTES)
+            if len(slots) >= limit:
+                return slots
+    return slots
+
+
+async def run_scenario(base_url: str, make_request: Callable[[int], Request], total: int,
+                       concurrency: int) -> Tuple[float, List[float], Dict[int, int]]:
+    import aiohttp
+
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    counter = iter(range(total))
+
+    async def worker(session):
+        for i in counter:
+            method, path, payload = make_request(i)
+            started = time.perf_counter()
+            async with session.request(method, base_url + path, json=payload) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency * 2)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return elapsed, latencies, statuses
+
+
+def _calls_delta(before: Dict[str, int], after: Dict[str, int]) -> Dict[str, int]:
+    return {key: after[key] - before.get(key, 0) for key in sorted(after) if after[key] != before.get(key, 0)}
+
+
+def scenarios(names: List[str], slots_to_book: List[str]) -> List[Tuple[str, Callable[[int], Request]]]:
+    from availability import HORIZON_DAYS, KNOWN_DURATIONS
+    from event_store import MOSCOW_TZ
+
+    today = datetime.now(MOSCOW_TZ).date()
+    days = [(today + timedelta(days=offset)).isoformat() for offset in range(1, HORIZON_DAYS + 1)]
+    last = days[-1]
+    return [
+        ("slots one day", lambda i: ("GET", f"/api/slots?day={days[1]}&duration=60", None)),
+        ("slots horizon", lambda i: ("GET", f"/api/slots?day={days[i % len(days)]}"
+                                            f"&duration={KNOWN_DURATIONS[i % len(KNOWN_DURATIONS)]}", None)),
+        ("slots range", lambda i: ("GET", f"/api/slots/range?from={days[0]}&to={last}", None)),
+        ("book", lambda i: ("POST", "/api/book", {"name": f"Бенчмарк {i}", "slot": slots_to_book[i % len(slots_to_book)],
+                                                  "massageType": "neck-shoulder", "duration": 30,
+                                                  "userId": str(i)})),
+        ("user bookings", lambda i: ("GET", f"/api/user-bookings/{names[i % len(names)]}", None)),
+        ("records", lambda i: ("GET", "/api/records", None)),
+    ]
+
+
+def run(args) -> Dict[str, dict]:
+    from calendar_client import CALENDAR_ID
+    from fake_calendar import get_fake_service
+
+    names = seed_calendar(args.events)
+    port = loadtest._free_port()
+    loadtest.start_app(port)
+    base_url = f"http://127.0.0.1:{port}"
+    service = get_fake_service()
+    # Прогрев: первая полная синхронизация и индекс не должны попасть в замер сценариев
+    slots_to_book = free_slots(args.requests, 30)
+
+    results = {}
+    for name, make_request in scenarios(names, slots_to_book):
+        total = min(args.requests, len(slots_to_book)) if name == "book" else args.requests
+        google_before, telegram_before = dict(service.calls), dict(loadtest.telegram_calls)
+        elapsed, latencies, statuses = asyncio.run(run_scenario(base_url, make_request, total, args.concurrency))
+        if name == "book":
+            # Уведомления и события Google уходят фоном — дожидаемся, чтобы посчитать их в этом сценарии
+            import mirror
+            import notifications
+            mirror.flush(timeout=30)
+            notifications.flush(timeout=30)
+        google = _calls_delta(google_before, service.calls)
+        results[name] = {
+            "requests": len(latencies),
+            "rps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": loadtest._ms(latencies, 50),
+            "p99_ms": loadtest._ms(latencies, 99),
+            "errors": sum(count for status, count in statuses.items() if status >= 400),
+            "google_calls": sum(google.values()),
+            "google": google,
+            "telegram_calls": sum(_calls_delta(telegram_before, loadtest.telegram_calls).values()),
+        }
+    results["_meta"] = {"events": len(service.all_events(CALENDAR_ID)), "latency": args.latency,
+                        "concurrency": args.concurrency}
+    return results
+
+
+def report(results: Dict[str, dict]):
+    print(f"{'scenario':<15} {'reqs':>5} {'rps':>8} {'p50':>9} {'p99':>9} {'err':>4} {'google':>7} {'tg':>4}  google calls")
+    for name, row in results.items():
+        if name.startswith("_"):
+            continue
+        calls = ", ".join(f"{method}={count}" for method, count in row["google"].items())
+        print(f"{name:<15} {row['requests']:>5} {row['rps']:>8.1f} {row['p50_ms']:>7.1f}ms {row['p99_ms']:>7.1f}ms"
+              f" {row['errors']:>4} {row['google_calls']:>7} {row['telegram_calls']:>4}  {calls}")
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    regressions = []
+    for name, row in results.items():
+        old = baseline.get(name)
+        if name.startswith("_") or not old:
+            continue
+        if row["p99_ms"] > old["p99_ms"] * (1 + tolerance) and row["p99_ms"] - old["p99_ms"] > 5.0:
+            regressions.append(f"{name}: p99 {old['p99_ms']:.1f}ms -> {row['p99_ms']:.1f}ms")
+        if row["google_calls"] > old["google_calls"]:
+            regressions.append(f"{name}: вызовов Google {old['google_calls']} -> {row['google_calls']}")
+        if row["errors"] > old["errors"]:
+            regressions.append(f"{name}: ошибок {old['errors']} -> {row['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=200, help="событий в календаре перед замером")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка каждого вызова Google, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.1, help="задержка ответа Telegram, с")
+    parser.add_argument("--concurrency", type=int, default=16, help="одновременных клиентов")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на сценарий")
+    parser.add_argument("--json", metavar="FILE", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="сравнить с сохранёнными результатами")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимый рост p99 (доля)")
+    args = parser.parse_args()
+    # start_app переходит во временный каталог — пути к файлам фиксируем заранее
+    args.json = args.json and os.path.abspath(args.json)
+    args.baseline = args.baseline and os.path.abspath(args.baseline)
+
+    os.environ["CALENDAR_BACKEND"] = "fake"
+    os.environ.setdefault("CALENDAR_ID", "bench@fake")
+    os.environ["FAKE_CALENDAR_LATENCY"] = str(args.latency)
+    os.environ["TELEGRAM_API_URL"] = loadtest.start_fake_telegram(args.telegram_latency)
+    # Фоновые синхронизация и очистка не должны добавлять вызовы Google в сценарии
+    os.environ.setdefault("EVENT_SYNC_INTERVAL", "3600")
+    os.environ.setdefault("SWEEP_INTERVAL", "3600")
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    results = run(args)
+    report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,235 +1,177 @@
-from datetime import datetime, timedelta
-import os
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import logging
+from datetime import date, datetime, timedelta
 from notifications import notify_admin, notify_admin_cancel
-from calendar_utils import create_event, get_calendar_service
+from event_store import MOSCOW_TZ, booking_metadata, get_store
+from ledger import get_ledger
+import masters
+import catalog
+import mirror
+from schedule_rules import get_rules
+from calendar_bulk import bulk_patch, summarize
+from single_flight import SingleFlight
+from resilience import call_with_timeout
+from rate_limit import BOOKING, CLEANUP, priority
 
-SCOPES = ["https://www.googleapis.com/auth/calendar"]
-SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-CALENDAR_ID = os.getenv("CALENDAR_ID")
+logger = logging.getLogger(__name__)
 
-def get_service():
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES
-    )
-    return build("calendar", "v3", credentials=creds)
+# Одинаковые одновременные запросы списков записей (всплеск открытий WebApp) читают журнал один раз
+_reads = SingleFlight("bookings")
 
-def book_slot(user_name: str, slot_iso: str, massage_type: str = "classic", duration_minutes: int = 60):
-    service = get_service()
-    start = datetime.fromisoformat(slot_iso)
+@priority(BOOKING)
+def book_slot(user_name: str, slot_iso: str, massage_type: str = "classic", duration_minutes: int = 60, user_id: str = None, master_id: str = None):
+    """Записать клиента: локальная транзакция в журнале, событие в Google создаст фоновый ``mirror``."""
+    start = datetime.fromisoformat(slot_iso).replace(tzinfo=None)
     end = start + timedelta(minutes=duration_minutes)
     
-    massage_names = {
-        "classic": "Классический массаж",
-        "neck-shoulder": "Массаж шейно-воротниковой зоны",
-        "back": "Массаж спины",
-        "back-neck": "Массаж спины и шейно-воротниковой зоны",
-        "stone": "Массаж горячими камнями (стоун-терапия)",
-        "lymphatic": "Лимфодренажный массаж",
-        "anticellulite": "Антицеллюлитный массаж",
-        "sports": "Спортивный массаж",
-        "cupping": "Баночный динамический массаж"
-    }
-    massage_name = massage_names.get(massage_type, "Массаж")
-    
-    # Проверяем пересечения с существующими событиями
-    time_min = datetime(start.year, start.month, start.day, 0, 0).isoformat() + "Z"
-    time_max = datetime(start.year, start.month, start.day, 23, 59).isoformat() + "Z"
-    events = service.events().list(
-        calendarId=CALENDAR_ID,
-        timeMin=time_min,
-        timeMax=time_max,
-        singleEvents=True
-    ).execute()
+    # Без master_id подходит любой мастер: сначала пробуем наименее занятого в этот день
+    if master_id:
+        master = masters.get_master(master_id)
+        if master is None:
+            logger.warning("Неизвестный мастер: %s", master_id)
+            return False, None
+        candidates = [master]
+    else:
+        candidates = masters.get_masters()
     
-    for event in events.get("items", []):
-        event_start_str = event.get("start", {}).get("dateTime")
-        event_end_str = event.get("end", {}).get("dateTime")
-        if not event_start_str or not event_end_str:
-            continue
-        try:
-            event_start = datetime.fromisoformat(event_start_str.replace("Z", "+00:00")).replace(tzinfo=None)
-            event_end = datetime.fromisoformat(event_end_str.replace("Z", "+00:00")).replace(tzinfo=None)
-            # Добавляем буферное время к существующим событиям
-            event_end_with_buffer = event_end + timedelta(minutes=20)
-            if start < event_end_with_buffer and end > event_start:
-                print(f"[book_slot] Найдено пересечение: новый слот {start}-{end}, существующий {event_start}-{event_end_with_buffer}")
-                return False, None
-        except Exception as e:
-            print("[book_slot] Ошибка парсинга:", e)
-            continue
+    # Занятость — из локальных копий календарей (их держит свежими фоновая синхронизация) и журнала
+    call_with_timeout(masters.ensure_ready, candidates)
+    buffer_minutes = get_rules().buffer_for(massage_type)
+    ledger = get_ledger()
+    for master in masters.by_load(start.date(), candidates):
+        # Проверка занятости и запись в журнал выполняются атомарно: параллельная запись
+        # на пересекающееся время к этому мастеру получит отказ
+        with master.reservations.hold(start, duration_minutes, buffer_minutes) as held:
+            if not held:
+                continue
+            booking = ledger.add(master.id, master.calendar_id, start, end, user_name, user_id, massage_type,
+                                 duration_minutes)
+        mirror.wake()
+        notify_admin(user_name, slot_iso)
+        logger.info("Запись создана", extra={"booking_id": booking["id"], "slot": slot_iso,
+                                              "duration": duration_minutes, "master": master.id})
+        return True, booking["id"]
     
-    # Создаем событие используя calendar_utils
-    try:
-        description = f"Клиент: {user_name}\nТип: {massage_name}\nДлительность: {duration_minutes} мин"
-        event_link = create_event(
-            name=user_name,
-            start_time=start,
-            end_time=end,
-            massage_type=massage_name,
-            description=description
-        )
-        
-        if event_link:
-            # Получаем ID события из ссылки
-            event_id = event_link.split('/')[-1]
-            notify_admin(user_name, slot_iso)
-            print(f"[book_slot] Событие создано успешно: {event_id}")
-            return True, event_id
-        else:
-            print("[book_slot] Ошибка создания события через calendar_utils")
-            return False, None
-            
-    except Exception as e:
-        print(f"[book_slot] Ошибка при создании события: {e}")
-        return False, None
+    logger.info("Слот занят: %s-%s", start, end)
+    return False, None
 
 def cancel_slot(event_id: str = None, user_name: str = None, slot_iso: str = None, massage_type: str = "classic") -> bool:
-    service = get_service()
+    """Отменить запись в журнале; событие из Google удалит фоновый ``mirror``.
+
+    ``event_id`` — id записи из ``/api/book`` или id события Google (у записей, созданных до журнала).
+    """
+    ledger = get_ledger()
     
-    # Приоритет: удаление по event_id
+    # Приоритет: отмена по id
     if event_id:
-        try:
-            service.events().delete(calendarId=CALENDAR_ID, eventId=event_id).execute()
-            notify_admin_cancel(user_name or "", slot_iso or "")
-            print(f"[cancel_slot] Событие удалено по id: {event_id}")
-            return True
-        except Exception as e:
-            print(f"[cancel_slot] Ошибка удаления по id: {e}")
+        booking = ledger.cancel(event_id)
+        if booking is None:
+            logger.info("Запись для отмены не найдена", extra={"event_id": event_id})
             return False
+        return _cancelled(booking, user_name or "", slot_iso or "")
     
     # Резервный способ: поиск по времени и имени
     if not slot_iso or not user_name:
         return False
         
-    start = datetime.fromisoformat(slot_iso)
-    time_min = datetime(start.year, start.month, start.day, 0, 0).isoformat() + "Z"
-    time_max = datetime(start.year, start.month, start.day, 23, 59).isoformat() + "Z"
-    
-    try:
-        events = service.events().list(
-            calendarId=CALENDAR_ID,
-            timeMin=time_min,
-            timeMax=time_max,
-            singleEvents=True
-        ).execute()
-        
-        for event in events.get("items", []):
-            summary = event.get("summary", "").lower()
-            event_start_str = event.get("start", {}).get("dateTime")
-            event_id = event.get("id")
-            
-            if not event_start_str or not event_id:
-                continue
-                
-            try:
-                event_start = datetime.fromisoformat(event_start_str.replace("Z", "+00:00"))
-                # Проверяем совпадение времени (с допуском в 1 минуту)
-                if abs((event_start.replace(tzinfo=None) - start).total_seconds()) < 60:
-                    # Проверяем, содержит ли название события имя пользователя
-                    if user_name.lower() in summary:
-                        service.events().delete(calendarId=CALENDAR_ID, eventId=event_id).execute()
-                        notify_admin_cancel(user_name, slot_iso)
-                        print(f"[cancel_slot] Событие удалено: {event_id}")
-                        return True
-            except Exception as e:
-                print("[cancel_slot] Ошибка парсинга времени:", e)
-                continue
-                
-    except Exception as e:
-        print(f"[cancel_slot] Ошибка: {e}")
-    
+    start = datetime.fromisoformat(slot_iso).replace(tzinfo=None)
+    for master in masters.get_masters():
+        for booking in ledger.active_on(master.calendar_id, start.date()):
+            # Проверяем совпадение времени (с допуском в 1 минуту)
+            if abs((datetime.fromisoformat(booking["start"]) - start).total_seconds()) < 60:
+                if user_name.lower() in booking["user_name"].lower():
+                    cancelled = ledger.cancel(booking["id"])
+                    if cancelled is not None:
+                        return _cancelled(cancelled, user_name, slot_iso)
     return False
 
-def get_all_bookings() -> list[dict]:
-    service = get_service()
-    now = datetime.utcnow()
-    future = now + timedelta(days=14)
-    try:
-        events = service.events().list(
-            calendarId=CALENDAR_ID,
-            timeMin=now.isoformat() + "Z",
-            timeMax=future.isoformat() + "Z",
-            singleEvents=True,
-            orderBy="startTime"
-        ).execute()
-        bookings = []
-        for event in events.get("items", []):
-            name = event.get("summary", "").replace("Запись на массаж — ", "").strip()
-            time_str = event.get("start", {}).get("dateTime")
-            event_id = event.get("id")
-            if name and time_str and event_id:
-                bookings.append({
-                    "name": name,
-                    "slot": time_str,
-                    "eventId": event_id
-                })
-        return bookings
-    except Exception as e:
-        print(f"[get_all_bookings] Ошибка: {e}")
-        return []
+def _cancelled(booking: dict, user_name: str, slot_iso: str) -> bool:
+    if booking["event_id"]:
+        # Слот освобождается сразу, не дожидаясь удаления события в Google
+        get_store(booking["calendar_id"]).remove(booking["event_id"])
+    mirror.wake()
+    notify_admin_cancel(user_name, slot_iso)
+    logger.info("Запись отменена", extra={"booking_id": booking["id"], "event_id": booking["event_id"],
+                                           "master": booking["master_id"]})
+    return True
+
+def _slot(booking: dict) -> str:
+    return datetime.fromisoformat(booking["start"]).replace(tzinfo=MOSCOW_TZ).isoformat()
+
+def get_all_bookings(day: date = None) -> list[dict]:
+    """Записи всех мастеров из журнала, по возрастанию начала: ближайшие 14 дней или весь день ``day``."""
+    return _reads.do(("all", day), _all_bookings, day)
+
+def _all_bookings(day: date = None) -> list[dict]:
+    if day is None:
+        time_min = datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+        time_max = time_min + timedelta(days=14)
+    else:
+        time_min = datetime(day.year, day.month, day.day)
+        time_max = time_min + timedelta(days=1)
+    return [{
+        "name": booking["user_name"],
+        "slot": _slot(booking),
+        "eventId": booking["id"],
+        "masterId": booking["master_id"],
+        "massageType": booking["massage_type"],
+        "duration": booking["duration"],
+    } for booking in get_ledger().active_between(time_min, time_max)]
+
+def get_user_bookings(user_name: str, user_id: str = None) -> list[dict]:
+    """Получить записи конкретного пользователя (точное совпадение имени или Telegram id)"""
+    return _reads.do(("user", user_name, user_id), _user_bookings, user_name, user_id)
 
-def get_user_bookings(user_name: str) -> list[dict]:
-    """Получить записи конкретного пользователя"""
-    service = get_service()
-    now = datetime.utcnow()
-    future = now + timedelta(days=14)
-    try:
-        events = service.events().list(
-            calendarId=CALENDAR_ID,
-            timeMin=now.isoformat() + "Z",
-            timeMax=future.isoformat() + "Z",
-            singleEvents=True,
-            orderBy="startTime"
-        ).execute()
-        bookings = []
-        for event in events.get("items", []):
+def _user_bookings(user_name: str, user_id: str = None) -> list[dict]:
+    now = datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+    return [{
+        "name": user_name,
+        "slot": _slot(booking),
+        "eventId": booking["id"],
+        "massageType": booking["massage_type"],
+        "duration": booking["duration"],
+        "masterId": booking["master_id"],
+    } for booking in get_ledger().for_user(user_name, user_id, now, now + timedelta(days=14))]
+
+def bulk_cancel(event_ids: list[str]) -> dict:
+    """Отменить несколько записей (для админки); события удаляются пакетами в фоне."""
+    results = {}
+    for event_id in event_ids:
+        booking = get_ledger().cancel(event_id)
+        if booking is not None and booking["event_id"]:
+            get_store(booking["calendar_id"]).remove(booking["event_id"])
+        results[event_id] = {"ok": booking is not None, "status": 200 if booking else 404,
+                             "error": None if booking else "not found"}
+    mirror.wake()
+    return {"summary": summarize(results), "results": results}
+
+@priority(CLEANUP)
+def migrate_legacy_bookings() -> dict:
+    """Дописать extendedProperties старым записям, созданным до появления метаданных."""
+    from sweeper import is_app_booking
+    from event_store import booking_owner
+    
+    masters.sync()
+    now = datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+    results = {}
+    for master in masters.get_masters():
+        store = master.store
+        patches = {}
+        for _start, _end, event in store.events_between(now - timedelta(days=1), now + timedelta(days=365)):
+            if booking_metadata(event) or not is_app_booking(event) or not booking_owner(event):
+                continue
+            massage_type, duration = catalog.parse_description(event.get("description", ""))
             summary = event.get("summary", "")
-            # Проверяем, содержит ли название события имя пользователя
-            if user_name.lower() in summary.lower():
-                time_str = event.get("start", {}).get("dateTime")
-                event_id = event.get("id")
-                description = event.get("description", "")
-                
-                # Извлекаем информацию о типе массажа и длительности из описания
-                massage_type = "classic"
-                duration = 60
-                if "Тип:" in description:
-                    type_line = [line for line in description.split('\n') if "Тип:" in line]
-                    if type_line:
-                        massage_name = type_line[0].split("Тип:")[1].strip()
-                        # Обратное преобразование названия в ID
-                        massage_name_to_id = {
-                            "Классический массаж": "classic",
-                            "Массаж шейно-воротниковой зоны": "neck-shoulder",
-                            "Массаж спины": "back",
-                            "Массаж спины и шейно-воротниковой зоны": "back-neck",
-                            "Массаж горячими камнями (стоун-терапия)": "stone",
-                            "Лимфодренажный массаж": "lymphatic",
-                            "Антицеллюлитный массаж": "anticellulite",
-                            "Спортивный массаж": "sports",
-                            "Баночный динамический массаж": "cupping"
-                        }
-                        massage_type = massage_name_to_id.get(massage_name, "classic")
-                if "Длительность:" in description:
-                    duration_line = [line for line in description.split('\n') if "Длительность:" in line]
-                    if duration_line:
-                        duration_str = duration_line[0].split("Длительность:")[1].strip().replace(" мин", "")
-                        try:
-                            duration = int(duration_str)
-                        except:
-                            duration = 60
-                
-                if time_str and event_id:
-                    bookings.append({
-                        "name": user_name,
-                        "slot": time_str,
-                        "eventId": event_id,
-                        "massageType": massage_type,
-                        "duration": duration
-                    })
-        return bookings
-    except Exception as e:
-        print(f"[get_user_bookings] Ошибка: {e}")
-        return []
+            user_name = summary.rsplit(" - ", 1)[-1].replace("Запись на массаж — ", "").strip()
+            patches[event["id"]] = {"extendedProperties": {"private": {
+                "userName": user_name,
+                "massageType": massage_type,
+                "duration": str(duration),
+                "masterId": master.id,
+            }}}
+        master_results = bulk_patch(patches, store.calendar_id) if patches else {}
+        for item in master_results.values():
+            if item["ok"] and item["result"]:
+                store.upsert(item["result"])
+        results.update(master_results)
+    return {"summary": summarize(results),
+            "failed": [event_id for event_id, item in results.items() if not item["ok"]]}
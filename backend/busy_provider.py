@@ -0,0 +1,314 @@
+"""Источники занятых интервалов для расчёта свободных слотов.
+
+Для доступности нужны только пары (начало, конец), а ``events().list``
+отдаёт полные ресурсы событий (описание, напоминания, участники).
+``freebusy().query()`` возвращает только занятые интервалы — одним
+вызовом на всё окно записи и сразу для нескольких календарей. Если
+FreeBusy по календарю вернул ошибку, используется ``events().list`` с
+маской ``fields=``, которая оставляет в ответе лишь время событий.
+
+Индекс доступности читает интервалы через один из источников:
+``StoreBusySource`` (локальная копия календаря, по умолчанию) или
+``FreeBusySource`` (``AVAILABILITY_SOURCE=freebusy``), который кэширует
+ответ FreeBusy на ``FREEBUSY_TTL`` секунд; истёкший кэш отдаётся сразу и
+обновляется в фоне, а при недоступном Google остаётся в работе. Индекс
+проверяет срок кэша при каждом обращении (``refresh_if_stale``), так что
+ручные правки в Google видны в слотах не позже чем через ``FREEBUSY_TTL``
+секунд плюс время одного запроса. Поверх любого из них
+``LedgerBusySource`` добавляет записи журнала, ещё не перенесённые в Google.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from calendar_client import get_service
+from event_store import MOSCOW_TZ, EventStore
+from ledger import BookingLedger, get_ledger
+from resilience import Freshness
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+Interval = Tuple[datetime, datetime]
+
+AVAILABILITY_SOURCE = os.getenv("AVAILABILITY_SOURCE", "store")
+FREEBUSY_TTL = float(os.getenv("FREEBUSY_TTL", "30"))
+WINDOW_DAYS = 15  # сегодня + 14 дней горизонта записи
+# Частичный ответ: только то, что нужно для занятых интервалов
+BUSY_EVENT_FIELDS = "items(status,start/dateTime,end/dateTime),nextPageToken"
+
+
+def _to_moscow(value: str) -> datetime:
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(MOSCOW_TZ).replace(tzinfo=None)
+    return dt
+
+
+def _utc(dt: datetime) -> str:
+    return dt.replace(tzinfo=MOSCOW_TZ).astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def list_busy_events(calendar_id: str, time_min: datetime, time_max: datetime) -> List[Interval]:
+    """Занятые интервалы через events().list с маской полей (запасной путь)."""
+    service = get_service()
+    intervals: List[Interval] = []
+    page_token = None
+    while True:
+        result = service.events().list(
+            calendarId=calendar_id, timeMin=_utc(time_min), timeMax=_utc(time_max),
+            singleEvents=True, pageToken=page_token, maxResults=2500, fields=BUSY_EVENT_FIELDS,
+        ).execute()
+        for event in result.get("items", []):
+            start, end = event.get("start", {}).get("dateTime"), event.get("end", {}).get("dateTime")
+            if start and end and event.get("status") != "cancelled":
+                intervals.append((_to_moscow(start), _to_moscow(end)))
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return sorted(intervals)
+
+
+def query_free_busy(calendar_ids: Iterable[str], time_min: datetime, time_max: datetime) -> Dict[str, List[Interval]]:
+    """Занятые интервалы (МСК) по каждому календарю одним запросом FreeBusy."""
+    calendar_ids = list(calendar_ids)
+    response = get_service().freebusy().query(body={
+        "timeMin": _utc(time_min),
+        "timeMax": _utc(time_max),
+        "timeZone": "Europe/Moscow",
+        "items": [{"id": calendar_id} for calendar_id in calendar_ids],
+    }).execute()
+    busy: Dict[str, List[Interval]] = {}
+    for calendar_id in calendar_ids:
+        info = response.get("calendars", {}).get(calendar_id, {})
+        if info.get("errors"):
+            logger.warning("FreeBusy вернул ошибку для %s: %s, читаю события", calendar_id, info["errors"])
+            busy[calendar_id] = list_busy_events(calendar_id, time_min, time_max)
+            continue
+        busy[calendar_id] = sorted(
+            (_to_moscow(item["start"]), _to_moscow(item["end"])) for item in info.get("busy", [])
+        )
+    return busy
+
+
+class StoreBusySource:
+    """Интервалы из локальной копии календаря (``EventStore``)."""
+
+    def __init__(self, store: EventStore):
+        self._store = store
+
+    def add_listener(self, listener: Callable[[Set[date]], None]):
+        self._store.add_listener(listener)
+
+    def refresh_if_stale(self):
+        # Копию календаря обновляет фоновая синхронизация EventStore, и изменения сами сбрасывают индекс
+        pass
+
+    def busy_intervals(self, day: date) -> List[Interval]:
+        return [(start, end) for start, end, _event in self._store.events_on(day)]
+
+
+class FreeBusySource:
+    """Интервалы из FreeBusy на всё окно записи, с кэшем на ``ttl`` секунд.
+
+    Локальные изменения (запись, отмена) сбрасывают кэш сразу — через
+    подписку на ``EventStore``. Источники календарей разных мастеров
+    состоят в общей ``FreeBusyGroup`` и обновляются одним запросом.
+    """
+
+    def __init__(self, calendar_id: str, store: Optional[EventStore] = None, ttl: float = FREEBUSY_TTL,
+                 group: Optional["FreeBusyGroup"] = None):
+        self.calendar_id = calendar_id
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._by_day: Dict[date, List[Interval]] = {}
+        self._window: Optional[Tuple[date, date]] = None
+        self._fetched_at = 0.0
+        self._listeners: List[Callable[[Set[date]], None]] = []
+        self._flight = SingleFlight("freebusy")
+        self._revalidating = threading.Lock()
+        # Кэш сброшен локальным изменением (а не просто истёк) — его нужно обновить до ответа
+        self._dirty = False
+        self.freshness = Freshness(f"freebusy:{calendar_id}")
+        self._group = group
+        if group is not None:
+            group.add(self)
+        if store is not None:
+            store.add_listener(self._on_local_change)
+
+    def add_listener(self, listener: Callable[[Set[date]], None]):
+        self._listeners.append(listener)
+
+    def _on_local_change(self, days: Set[date]):
+        with self._lock:
+            self._fetched_at = 0.0
+            self._dirty = True
+        self._notify(days)
+
+    def _notify(self, days: Set[date]):
+        for listener in list(self._listeners):
+            listener(days)
+
+    def is_fresh(self, today: date) -> bool:
+        with self._lock:
+            return (time.monotonic() - self._fetched_at <= self._ttl
+                    and self._window is not None and self._window[0] == today)
+
+    def _refresh(self):
+        try:
+            if self._group is not None:
+                self._group.refresh()
+            else:
+                self._flight.do("window", self._refresh_window)
+        except Exception:
+            self.freshness.failed()
+            raise
+
+    def _revalidate(self):
+        """Обновить кэш в фоновом потоке, не задерживая ответ (не больше одного потока на источник)."""
+        if not self._revalidating.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.warning("FreeBusy не обновлён, отдаём прежние интервалы: %s", e)
+            finally:
+                self._revalidating.release()
+
+        threading.Thread(target=run, name="freebusy-revalidate", daemon=True).start()
+
+    def _refresh_window(self):
+        today = datetime.now(MOSCOW_TZ).date()
+        start = datetime(today.year, today.month, today.day)
+        self.apply(query_free_busy([self.calendar_id], start, start + timedelta(days=WINDOW_DAYS))[self.calendar_id],
+                   today)
+
+    def apply(self, intervals: List[Interval], today: date):
+        """Принять занятые интервалы окна записи, начинающегося с ``today``."""
+        by_day: Dict[date, List[Interval]] = {}
+        for busy_start, busy_end in intervals:
+            day = busy_start.date()
+            while day <= busy_end.date():
+                by_day.setdefault(day, []).append((busy_start, busy_end))
+                day += timedelta(days=1)
+        with self._lock:
+            # Сбрасываем в индексе только дни, чья занятость действительно изменилась
+            changed = {day for day in set(self._by_day) | set(by_day) if self._by_day.get(day) != by_day.get(day)}
+            self._by_day = by_day
+            self._window = (today, today + timedelta(days=WINDOW_DAYS - 1))
+            self._fetched_at = time.monotonic()
+            self._dirty = False
+        self.freshness.ok()
+        self._notify(changed)
+
+    def refresh_if_stale(self):
+        """Индекс держит маски дней, пока их не сбросят, и ``busy_intervals`` для них не вызывает.
+
+        Поэтому он проверяет срок кэша здесь при каждом обращении: истёкший кэш
+        обновляется в фоне, а изменившиеся дни сбрасываются через ``apply``.
+        """
+        today = datetime.now(MOSCOW_TZ).date()
+        if self.is_fresh(today):
+            return
+        with self._lock:
+            # Без окна или после локального изменения кэш синхронно обновит busy_intervals
+            expired = self._window is not None and not self._dirty
+        if expired:
+            self._revalidate()
+
+    def busy_intervals(self, day: date) -> List[Interval]:
+        today = datetime.now(MOSCOW_TZ).date()
+        inside = today <= day <= today + timedelta(days=WINDOW_DAYS - 1)
+        if not inside:
+            # День вне окна записи — читаем его отдельно, без кэша
+            start = datetime(day.year, day.month, day.day)
+            return list(self._flight.do(day, list_busy_events, self.calendar_id, start, start + timedelta(days=1)))
+        if not self.is_fresh(today):
+            with self._lock:
+                has_window = self._window is not None and self._window[0] == today
+                dirty = self._dirty
+            if has_window and not dirty:
+                # Кэш просто истёк: отдаём его сразу, а обновляем в фоне (stale-while-revalidate)
+                self._revalidate()
+            else:
+                try:
+                    self._refresh()
+                except Exception:
+                    if not has_window:
+                        raise
+                    # Google недоступен — лучше прежние интервалы (ответ помечен устаревшим), чем ошибка
+                    logger.warning("FreeBusy не обновлён после локального изменения, отдаём прежние интервалы")
+        with self._lock:
+            return list(self._by_day.get(day, []))
+
+
+class FreeBusyGroup:
+    """Календари, чьи кэши FreeBusy обновляются одним общим запросом.
+
+    Устаревший кэш любого мастера перезапрашивает окно записи сразу для
+    всех календарей группы: число вызовов Google не растёт с числом мастеров.
+    """
+
+    def __init__(self):
+        self._sources: Dict[str, FreeBusySource] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def add(self, source: FreeBusySource):
+        with self._lock:
+            self._sources[source.calendar_id] = source
+
+    def refresh(self):
+        with self._refresh_lock:
+            today = datetime.now(MOSCOW_TZ).date()
+            with self._lock:
+                sources = list(self._sources.values())
+            stale = [source for source in sources if not source.is_fresh(today)]
+            if not stale:
+                # Пока ждали замок, кэш уже обновил другой поток
+                return
+            start = datetime(today.year, today.month, today.day)
+            try:
+                busy = query_free_busy([source.calendar_id for source in sources], start,
+                                       start + timedelta(days=WINDOW_DAYS))
+            except Exception:
+                for source in sources:
+                    source.freshness.failed()
+                raise
+            for source in sources:
+                source.apply(busy.get(source.calendar_id, []), today)
+
+
+class LedgerBusySource:
+    """Занятость календаря вместе с записями журнала, которых ещё нет в Google."""
+
+    def __init__(self, base, calendar_id: str, ledger: BookingLedger):
+        self._base = base
+        self._calendar_id = calendar_id
+        self._ledger = ledger
+
+    def add_listener(self, listener: Callable[[Set[date]], None]):
+        self._base.add_listener(listener)
+        self._ledger.add_listener(
+            lambda calendar_id, days: listener(days) if calendar_id == self._calendar_id else None)
+
+    def refresh_if_stale(self):
+        self._base.refresh_if_stale()
+
+    def busy_intervals(self, day: date) -> List[Interval]:
+        return sorted(self._base.busy_intervals(day) + self._ledger.unmirrored_busy(self._calendar_id, day))
+
+
+_freebusy_group = FreeBusyGroup()
+
+
+def make_busy_source(store: EventStore):
+    if AVAILABILITY_SOURCE == "freebusy":
+        base = FreeBusySource(store.calendar_id, store, group=_freebusy_group)
+    else:
+        base = StoreBusySource(store)
+    return LedgerBusySource(base, store.calendar_id, get_ledger())
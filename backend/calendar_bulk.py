@@ -0,0 +1,124 @@
+"""Пакетные операции с Calendar API.
+
+Вызовы группируются по ``BATCH_SIZE`` (лимит Google — 50) в один
+``new_batch_http_request``, то есть один HTTP round trip на пачку. Для
+каждой операции возвращается отдельный результат; операции, упавшие с
+временной ошибкой (429, 5xx, rateLimitExceeded), повторяются с
+экспоненциальной задержкой, успешные повторно не отправляются.
+"""
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from calendar_client import CALENDAR_ID, get_service
+from rate_limit import is_rate_limited, retry_after
+from resilience import CircuitOpenError, calendar_call
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+Operation = Tuple[str, Callable]  # (id операции, service -> HttpRequest)
+
+
+def _status(exception: Exception) -> Optional[int]:
+    return getattr(getattr(exception, "resp", None), "status", None)
+
+
+def _is_retryable(exception: Exception) -> bool:
+    status = _status(exception)
+    return status in RETRYABLE_STATUSES or is_rate_limited(exception)
+
+
+def execute_bulk(operations: Iterable[Operation], ok_statuses: Iterable[int] = ()) -> Dict[str, dict]:
+    """Выполнить операции пачками. Результат: ``{id: {"ok", "status", "result", "error"}}``.
+
+    ``ok_statuses`` — коды ошибок, которые считаются успехом (например, 404/410
+    при удалении уже удалённого события).
+    """
+    pending: List[Operation] = list(operations)
+    ok_statuses = set(ok_statuses)
+    results: Dict[str, dict] = {}
+    service = get_service()
+
+    for attempt in range(MAX_ATTEMPTS):
+        retry: List[Operation] = []
+        # Если Google прислал Retry-After для какой-то операции, ждём не меньше
+        delay = BACKOFF_BASE * (2 ** attempt)
+        for offset in range(0, len(pending), BATCH_SIZE):
+            chunk = pending[offset:offset + BATCH_SIZE]
+            by_id = dict(chunk)
+
+            def on_response(op_id, response, exception):
+                nonlocal delay
+                if exception is None:
+                    results[op_id] = {"ok": True, "status": 200, "result": response, "error": None}
+                elif _status(exception) in ok_statuses:
+                    results[op_id] = {"ok": True, "status": _status(exception), "result": None, "error": None}
+                elif _is_retryable(exception) and attempt + 1 < MAX_ATTEMPTS:
+                    retry.append((op_id, by_id[op_id]))
+                    delay = max(delay, retry_after(exception) or 0.0)
+                else:
+                    results[op_id] = {"ok": False, "status": _status(exception), "result": None, "error": str(exception)}
+
+            batch = service.new_batch_http_request(callback=on_response)
+            for op_id, build_request in chunk:
+                batch.add(build_request(service), request_id=op_id)
+            try:
+                # Каждая операция пачки расходует квоту как отдельный запрос
+                with calendar_call("batch", tokens=len(chunk)):
+                    batch.execute()
+            except Exception as e:
+                # Упал сам batch-запрос — все его операции повторяем целиком.
+                # При открытом предохранителе не повторяем: операции вернутся в очередь владельца
+                if attempt + 1 >= MAX_ATTEMPTS or isinstance(e, CircuitOpenError):
+                    for op_id, _ in chunk:
+                        results.setdefault(op_id, {"ok": False, "status": _status(e), "result": None, "error": str(e)})
+                    continue
+                # Часть колбэков могла отработать до ошибки и уже поставить свои операции в повтор
+                queued = {op_id for op_id, _ in retry}
+                retry.extend(op for op in chunk if op[0] not in results and op[0] not in queued)
+        if not retry:
+            break
+        logger.info("Пакетный запрос: повтор %d операций (попытка %d)", len(retry), attempt + 2)
+        time.sleep(delay)
+        pending = retry
+    return results
+
+
+def bulk_delete(event_ids: Iterable[str], calendar_id: str = CALENDAR_ID) -> Dict[str, dict]:
+    """Удалить события; уже удалённые (404/410) считаются успехом."""
+    operations = [
+        (event_id, lambda service, event_id=event_id: service.events().delete(calendarId=calendar_id, eventId=event_id))
+        for event_id in dict.fromkeys(event_ids)
+    ]
+    return execute_bulk(operations, ok_statuses=(404, 410))
+
+
+def bulk_insert(bodies: Dict[str, dict], calendar_id: str = CALENDAR_ID) -> Dict[str, dict]:
+    """Создать события. Ключи ``bodies`` — произвольные id операций для сопоставления результатов."""
+    operations = [
+        (op_id, lambda service, body=body: service.events().insert(calendarId=calendar_id, body=body))
+        for op_id, body in bodies.items()
+    ]
+    return execute_bulk(operations)
+
+
+def bulk_patch(patches: Dict[str, dict], calendar_id: str = CALENDAR_ID) -> Dict[str, dict]:
+    """Частично обновить события: ``{event_id: тело патча}``."""
+    operations = [
+        (event_id, lambda service, event_id=event_id, body=body: service.events().patch(calendarId=calendar_id, eventId=event_id, body=body))
+        for event_id, body in patches.items()
+    ]
+    return execute_bulk(operations)
+
+
+def summarize(results: Dict[str, dict]) -> Dict[str, int]:
+    return {
+        "total": len(results),
+        "ok": sum(1 for item in results.values() if item["ok"]),
+        "failed": sum(1 for item in results.values() if not item["ok"]),
+    }
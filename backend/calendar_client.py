@@ -0,0 +1,95 @@
+"""Общий клиент Google Calendar для всего процесса.
+
+Раньше каждый запрос заново читал JSON сервисного аккаунта и вызывал
+``build()`` — разбор discovery-документа, получение токена и новое
+HTTP-соединение. Здесь учётные данные загружаются один раз, а клиент
+создаётся один раз на поток: ``httplib2.Http`` не потокобезопасен, поэтому
+каждый поток держит своё keep-alive соединение, переиспользуемое между
+запросами. Токен обновляется автоматически через ``AuthorizedHttp``.
+
+При ``CALENDAR_BACKEND=fake`` вместо Google используется поддельный
+календарь из ``fake_calendar`` — для офлайн-проверок и нагрузочных тестов.
+"""
+import os
+import threading
+
+import rate_limit
+from resilience import calendar_call
+
+SCOPES = ["https://www.googleapis.com/auth/calendar"]
+SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "google_key.json")
+CALENDAR_ID = os.getenv("CALENDAR_ID")
+HTTP_TIMEOUT = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "10"))
+CALENDAR_BACKEND = os.getenv("CALENDAR_BACKEND", "google")
+
+_credentials = None
+_credentials_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_credentials():
+    """Учётные данные сервисного аккаунта, загруженные один раз на процесс."""
+    from google.oauth2 import service_account
+
+    global _credentials
+    if _credentials is None:
+        with _credentials_lock:
+            if _credentials is None:
+                _credentials = service_account.Credentials.from_service_account_file(
+                    SERVICE_ACCOUNT_FILE, scopes=SCOPES
+                )
+    return _credentials
+
+
+def _instrumented(request_class):
+    """Подкласс запроса: каждый ``execute()`` идёт через предохранитель и общую квоту, засекается для /metrics."""
+
+    class InstrumentedRequest(request_class):
+        def execute(self, *args, **kwargs):
+            method = getattr(self, "methodId", None)
+
+            def attempt():
+                with calendar_call(method):
+                    return super(InstrumentedRequest, self).execute(*args, **kwargs)
+
+            # 429 и 403 rateLimitExceeded повторяются с задержкой внутри квоты
+            return rate_limit.call(attempt, method)
+
+    return InstrumentedRequest
+
+
+def _build_service():
+    # Импорты здесь, чтобы fake-режим работал без google-библиотек
+    import httplib2
+    from google_auth_httplib2 import AuthorizedHttp
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest
+
+    http = AuthorizedHttp(get_credentials(), http=httplib2.Http(timeout=HTTP_TIMEOUT))
+    # static_discovery=True берёт discovery-документ из пакета, без сетевого запроса
+    return build("calendar", "v3", http=http, cache_discovery=False, static_discovery=True,
+                 requestBuilder=_instrumented(HttpRequest))
+
+
+def _fake_service():
+    from fake_calendar import FakeRequest, get_fake_service
+    service = get_fake_service()
+    if service.request_builder is FakeRequest:
+        service.request_builder = _instrumented(FakeRequest)
+    return service
+
+
+def get_service():
+    """Клиент Calendar API текущего потока (создаётся при первом обращении)."""
+    if CALENDAR_BACKEND == "fake":
+        return _fake_service()
+    service = getattr(_local, "service", None)
+    if service is None:
+        service = _build_service()
+        _local.service = service
+    return service
+
+
+def reset_service():
+    """Сбросить клиент текущего потока, например после обрыва соединения."""
+    _local.service = None
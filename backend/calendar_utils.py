@@ -1,27 +1,32 @@
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+import logging
 from datetime import datetime, timedelta
-import os
+from calendar_client import CALENDAR_ID, get_service
+from schedule_rules import get_rules
 
-SCOPES = ["https://www.googleapis.com/auth/calendar"]
-SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
-CALENDAR_ID = os.getenv("CALENDAR_ID")
+logger = logging.getLogger(__name__)
 
 def get_calendar_service():
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    service = build("calendar", "v3", credentials=credentials)
-    return service
+    return get_service()
 
-def create_event(name: str, start_time: datetime, end_time: datetime = None, massage_type: str = "Массаж", description: str = ""):
+def create_event(name: str, start_time: datetime, end_time: datetime = None, massage_type: str = "Массаж", description: str = "", metadata: dict = None):
+    created_event = create_calendar_event(name, start_time, end_time, massage_type, description, metadata)
+    return created_event.get("htmlLink")
+
+def create_calendar_event(name: str, start_time: datetime, end_time: datetime = None, massage_type: str = "Массаж", description: str = "", metadata: dict = None, calendar_id: str = None) -> dict:
+    """Создать событие и вернуть ресурс целиком (нужен id для локального хранилища).
+
+    ``metadata`` (имя/id клиента, id типа массажа, длительность) сохраняется в
+    ``extendedProperties.private`` — по нему записи ищутся без разбора описания.
+    ``calendar_id`` — календарь мастера, по умолчанию основной (CALENDAR_ID).
+    """
     service = get_calendar_service()
     
     # Если end_time не указано, используем стандартную длительность в 1 час
     if end_time is None:
         end_time = start_time + timedelta(hours=1)
     
-    # Добавляем буферное время (20 минут) после сеанса
-    end_time_with_buffer = end_time + timedelta(minutes=20)
+    # Добавляем буферное время после сеанса (по правилам расписания для этого типа массажа)
+    end_time_with_buffer = end_time + timedelta(minutes=get_rules().buffer_for((metadata or {}).get("massageType")))
     
     event = {
         "summary": f"{massage_type} - {name}",
@@ -43,35 +48,21 @@ def create_event(name: str, start_time: datetime, end_time: datetime = None, mas
         },
         "colorId": "2"  # Зеленый цвет для массажных сессий
     }
+    if metadata:
+        # Google хранит значения extendedProperties только строками
+        event["extendedProperties"] = {
+            "private": {key: str(value) for key, value in metadata.items() if value is not None}
+        }
     
     try:
-        created_event = service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
-        print(f"✅ Событие создано: {created_event.get('htmlLink')}")
-        print(f"📅 Время: {start_time.strftime('%H:%M')} - {end_time_with_buffer.strftime('%H:%M')}")
-        print(f"👤 Клиент: {name}")
-        print(f"💆 Тип: {massage_type}")
-        return created_event.get("htmlLink")
-    except Exception as e:
-        print(f"❌ Ошибка создания события в календаре: {e}")
-        raise e
-
-def get_busy_slots_for_day(service, day: datetime.date):
-    start = datetime.combine(day, datetime.min.time()).isoformat() + "Z"
-    end = (datetime.combine(day, datetime.min.time()) + timedelta(days=1)).isoformat() + "Z"
-
-    events_result = service.events().list(
-        calendarId=CALENDAR_ID, timeMin=start, timeMax=end,
-        singleEvents=True, orderBy="startTime"
-    ).execute()
-
-    busy_intervals = []
-    for e in events_result.get("items", []):
-        if "dateTime" in e["start"]:
-            start_time = datetime.fromisoformat(e["start"]["dateTime"].replace("Z", "+00:00")).replace(tzinfo=None)
-            end_time = datetime.fromisoformat(e["end"]["dateTime"].replace("Z", "+00:00")).replace(tzinfo=None)
-            # Учитываем буферное время (20 минут) после каждого сеанса
-            end_time_with_buffer = end_time + timedelta(minutes=20)
-            busy_intervals.append((start_time, end_time_with_buffer))
-            print(f"📅 Занятый интервал: {start_time.strftime('%H:%M')} - {end_time_with_buffer.strftime('%H:%M')}")
-    
-    return busy_intervals
\ No newline at end of file
+        created_event = service.events().insert(calendarId=calendar_id or CALENDAR_ID, body=event).execute()
+        logger.info("Событие создано", extra={
+            "event_id": created_event.get("id"),
+            "start": start_time.isoformat(),
+            "end": end_time_with_buffer.isoformat(),
+            "massage_type": massage_type,
+        })
+        return created_event
+    except Exception:
+        logger.exception("Ошибка создания события в календаре")
+        raise
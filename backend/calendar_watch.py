@@ -0,0 +1,204 @@
+"""Push-уведомления Google Calendar вместо частого опроса.
+
+Для календаря каждого мастера открывается канал ``events().watch()`` на
+адрес ``WATCH_WEBHOOK_URL`` (публичный HTTPS-адрес ``POST
+/api/calendar/notifications``). Google присылает на него пустой POST с
+заголовками ``X-Goog-*`` при любом изменении календаря — в том числе
+когда мастер правит события вручную. Приёмник только проверяет канал и
+отмечает календарь «изменённым»; фоновый поток подтягивает дельту
+инкрементальной синхронизацией (``syncToken`` — только изменённые события),
+после чего индекс слотов, SSE-лента и журнал записей (через сверку
+``mirror``) обновляются сами. Пачка уведомлений подряд даёт одну синхронизацию.
+
+Каналы живут ограниченное время (``WATCH_TTL``): за ``WATCH_RENEW_BEFORE``
+секунд до истечения открывается новый канал, и только потом закрывается
+старый, чтобы не пропустить изменения. Без ``WATCH_WEBHOOK_URL`` каналы не
+открываются и календари опрашиваются как раньше, раз в ``EVENT_SYNC_INTERVAL``;
+с каналами опрос остаётся страховкой раз в ``WATCH_FALLBACK_SYNC_INTERVAL``.
+"""
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+import masters
+import metrics
+import mirror
+from calendar_client import get_service
+from event_store import get_store
+from rate_limit import CLEANUP, priority
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL = os.getenv("WATCH_WEBHOOK_URL", "")
+WATCH_TOKEN = os.getenv("WATCH_TOKEN", "") or secrets.token_hex(16)
+WATCH_TTL = float(os.getenv("WATCH_TTL", str(7 * 24 * 3600)))
+RENEW_BEFORE = float(os.getenv("WATCH_RENEW_BEFORE", "3600"))
+FALLBACK_SYNC_INTERVAL = float(os.getenv("WATCH_FALLBACK_SYNC_INTERVAL", "600"))
+RETRY_INTERVAL = 60.0
+
+NOTIFICATIONS = metrics.counter("calendar_notifications_total",
+                                "Calendar push notifications received, by resource state and result.")
+
+
+@dataclass
+class Channel:
+    id: str
+    resource_id: str
+    calendar_id: str
+    expiration: float  # unix time, секунды
+
+
+class WatchManager:
+    def __init__(self, webhook_url: str = WEBHOOK_URL, token: str = WATCH_TOKEN):
+        self.webhook_url = webhook_url
+        self._token = token
+        self._lock = threading.Lock()
+        # Текущий канал каждого календаря и все открытые (при продлении старый живёт до открытия нового)
+        self._current: Dict[str, Channel] = {}
+        self._open: Dict[str, Channel] = {}
+        self._dirty: Set[str] = set()
+        self._retry_at: Dict[str, float] = {}
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.webhook_url)
+
+    # --- каналы ------------------------------------------------------------
+
+    def open_channel(self, calendar_id: str) -> Channel:
+        response = get_service().events().watch(calendarId=calendar_id, body={
+            "id": uuid.uuid4().hex,
+            "type": "web_hook",
+            "address": self.webhook_url,
+            "token": self._token,
+            "params": {"ttl": str(int(WATCH_TTL))},
+        }).execute()
+        channel = Channel(response["id"], response["resourceId"], calendar_id,
+                          int(response.get("expiration") or 0) / 1000 or time.time() + WATCH_TTL)
+        with self._lock:
+            previous = self._current.get(calendar_id)
+            self._current[calendar_id] = channel
+            self._open[channel.id] = channel
+        logger.info("Открыт канал уведомлений", extra={"calendar": calendar_id, "channel": channel.id,
+                                                        "expires_in": round(channel.expiration - time.time())})
+        if previous is not None:
+            self.close_channel(previous)
+        return channel
+
+    def close_channel(self, channel: Channel):
+        with self._lock:
+            self._open.pop(channel.id, None)
+            if self._current.get(channel.calendar_id) is channel:
+                del self._current[channel.calendar_id]
+        try:
+            get_service().channels().stop(body={"id": channel.id, "resourceId": channel.resource_id}).execute()
+        except Exception as e:
+            # Канал, который не удалось закрыть, просто истечёт сам
+            logger.warning("Не удалось закрыть канал %s: %s", channel.id, e)
+
+    def channels(self) -> List[Channel]:
+        with self._lock:
+            return list(self._current.values())
+
+    @priority(CLEANUP)
+    def renew_due(self, now: Optional[float] = None):
+        """Открыть каналы, которых нет, и продлить истекающие."""
+        now = now or time.time()
+        for master in masters.get_masters():
+            calendar_id = master.calendar_id
+            with self._lock:
+                channel = self._current.get(calendar_id)
+                retry_at = self._retry_at.get(calendar_id, 0.0)
+            if (channel is not None and channel.expiration - now > RENEW_BEFORE) or retry_at > now:
+                continue
+            try:
+                self.open_channel(calendar_id)
+                self._retry_at.pop(calendar_id, None)
+            except Exception as e:
+                self._retry_at[calendar_id] = now + RETRY_INTERVAL
+                logger.warning("Не удалось открыть канал уведомлений для %s: %s", calendar_id, e)
+
+    # --- уведомления -------------------------------------------------------
+
+    def handle(self, channel_id: str, resource_id: str, state: str, token: Optional[str]) -> bool:
+        """Принять уведомление. False — токен не совпал (уведомление не от нашего канала)."""
+        if not hmac.compare_digest(token or "", self._token):
+            NOTIFICATIONS.inc(state=state or "unknown", result="rejected")
+            return False
+        with self._lock:
+            channel = self._open.get(channel_id)
+        if channel is None or channel.resource_id != resource_id:
+            # Канал прошлого запуска или уже закрытый при продлении: отвечаем 200, иначе Google будет повторять
+            NOTIFICATIONS.inc(state=state or "unknown", result="ignored")
+            return True
+        NOTIFICATIONS.inc(state=state, result="accepted")
+        if state == "sync":
+            # Первое уведомление канала — подтверждение открытия, изменений ещё нет
+            return True
+        with self._lock:
+            self._dirty.add(channel.calendar_id)
+        self._wake.set()
+        return True
+
+    def sync_dirty(self) -> int:
+        """Подтянуть дельты календарей, о которых пришли уведомления."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        for calendar_id in dirty:
+            try:
+                get_store(calendar_id).sync()
+            except Exception:
+                logger.exception("Ошибка синхронизации по уведомлению")
+                with self._lock:
+                    self._dirty.add(calendar_id)
+        if dirty:
+            # Ручные правки мастера в календаре должны дойти и до журнала записей
+            mirror.request_reconcile()
+        return len(dirty)
+
+    # --- фоновый поток -----------------------------------------------------
+
+    def start(self):
+        if not self.enabled or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="calendar-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for channel in self.channels():
+            self.close_channel(channel)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self.sync_dirty()
+                self.renew_due()
+            except Exception:
+                logger.exception("Ошибка обслуживания каналов уведомлений")
+            self._wake.wait(RETRY_INTERVAL)
+
+
+_manager: Optional[WatchManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_manager() -> WatchManager:
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = WatchManager()
+    return _manager
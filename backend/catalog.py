@@ -0,0 +1,134 @@
+"""Каталог услуг: типы массажа, варианты длительности с ценами и перерыв после сеанса.
+
+Единственный источник этих данных для бэкенда (название в событии,
+проверка записи, прогреваемые длительности индекса слотов), бота и
+``GET /api/catalog``. Индексы строятся один раз при импорте модуля:
+тип по id, id по названию (для старых событий, где тип записан только
+текстом в описании) и общий набор длительностей всех услуг.
+
+Перерыв после сеанса берётся из правил расписания (``type_buffers`` в
+``schedule_rules``), чтобы у него не было второго места настройки.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from schedule_rules import get_rules
+
+DEFAULT_TYPE = "classic"
+
+
+@dataclass(frozen=True)
+class Option:
+    minutes: int
+    price: int  # рублей
+
+
+@dataclass(frozen=True)
+class MassageType:
+    id: str
+    name: str
+    description: str
+    icon: str
+    options: Tuple[Option, ...]
+
+    @property
+    def durations(self) -> Tuple[int, ...]:
+        return tuple(option.minutes for option in self.options)
+
+    @property
+    def default_duration(self) -> int:
+        return self.options[0].minutes
+
+    @property
+    def buffer_minutes(self) -> int:
+        return get_rules().buffer_for(self.id)
+
+    def price_for(self, duration_minutes: int) -> Optional[int]:
+        return next((option.price for option in self.options if option.minutes == duration_minutes), None)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "icon": self.icon,
+            "durations": [{"time": option.minutes, "price": option.price} for option in self.options],
+            "bufferMinutes": self.buffer_minutes,
+        }
+
+
+CATALOG: Tuple[MassageType, ...] = (
+    MassageType("classic", "Классический массаж", "Расслабляющий классический массаж", "💆‍♂️",
+                (Option(60, 2500), Option(90, 3500))),
+    MassageType("neck-shoulder", "Массаж шейно-воротниковой зоны", "Целенаправленный массаж шеи и плеч", "🦴",
+                (Option(30, 1500),)),
+    MassageType("back", "Массаж спины", "Расслабляющий массаж спины", "🔥",
+                (Option(30, 1800),)),
+    MassageType("back-neck", "Массаж спины и шейно-воротниковой зоны", "Комплексный массаж спины и шеи", "💪",
+                (Option(45, 2200),)),
+    MassageType("stone", "Массаж горячими камнями (стоун-терапия)", "Расслабляющий массаж с горячими камнями", "🪨",
+                (Option(60, 3500), Option(90, 4800))),
+    MassageType("lymphatic", "Лимфодренажный массаж", "Массаж для улучшения лимфотока", "💧",
+                (Option(60, 3000), Option(90, 4200))),
+    MassageType("anticellulite", "Антицеллюлитный массаж", "Интенсивный массаж против целлюлита", "🔥",
+                (Option(60, 3200), Option(90, 4500))),
+    MassageType("sports", "Спортивный массаж", "Массаж для спортсменов и активных людей", "⚽",
+                (Option(60, 2800), Option(90, 4000))),
+    MassageType("cupping", "Баночный динамический массаж", "Массаж с использованием банок", "🏺",
+                (Option(30, 2000),)),
+)
+
+BY_ID: Dict[str, MassageType] = {massage.id: massage for massage in CATALOG}
+ID_BY_NAME: Dict[str, str] = {massage.name: massage.id for massage in CATALOG}
+DURATIONS: Tuple[int, ...] = tuple(sorted({minutes for massage in CATALOG for minutes in massage.durations}))
+# Пары (длительность, перерыв после сеанса) всех услуг: слоты зависят от обоих
+SLOT_VARIANTS: Tuple[Tuple[int, int], ...] = tuple(sorted({(minutes, massage.buffer_minutes)
+                                                           for massage in CATALOG for minutes in massage.durations}))
+
+
+def get(massage_type: Optional[str]) -> Optional[MassageType]:
+    return BY_ID.get(massage_type or "")
+
+
+def name_of(massage_type: Optional[str], default: str = "Массаж") -> str:
+    massage = BY_ID.get(massage_type or "")
+    return massage.name if massage else default
+
+
+def id_by_name(name: str, default: str = DEFAULT_TYPE) -> str:
+    return ID_BY_NAME.get(name.strip(), default)
+
+
+def parse_description(description: str) -> Tuple[str, int]:
+    """Тип массажа и длительность из описания события старого формата («Тип: ...», «Длительность: N мин»)."""
+    massage_type = DEFAULT_TYPE
+    duration = None
+    for line in description.split("\n"):
+        if "Тип:" in line:
+            massage_type = id_by_name(line.split("Тип:")[1])
+        elif "Длительность:" in line:
+            try:
+                duration = int(line.split("Длительность:")[1].strip().replace(" мин", ""))
+            except ValueError:
+                duration = None
+    return massage_type, duration or BY_ID[massage_type].default_duration
+
+
+def validate(massage_type: str, duration_minutes: int) -> Optional[str]:
+    """Текст ошибки, если такой услуги или длительности нет в каталоге, иначе None."""
+    massage = BY_ID.get(massage_type)
+    if massage is None:
+        return f"Неизвестный тип массажа: {massage_type}"
+    if duration_minutes not in massage.durations:
+        allowed = ", ".join(str(minutes) for minutes in massage.durations)
+        return f"Для «{massage.name}» доступна длительность {allowed} мин"
+    return None
+
+
+def format_price(price: int) -> str:
+    return f"{price} ₽"
+
+
+def as_list() -> List[dict]:
+    """Каталог для ``GET /api/catalog``."""
+    return [massage.to_dict() for massage in CATALOG]
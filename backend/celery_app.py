@@ -1,4 +1,7 @@
 from celery import Celery
+from celery.signals import setup_logging as celery_setup_logging
+
+from log_config import setup_logging
 
 celery_app = Celery(
     'massage_master',
@@ -7,4 +10,17 @@ celery_app = Celery(
 )
 
 celery_app.conf.timezone = 'Europe/Moscow'
-celery_app.conf.enable_utc = False 
\ No newline at end of file
+celery_app.conf.enable_utc = False 
+
+
+def queue_depth(queue_name: str = None) -> int:
+    """Число задач, ожидающих в очереди брокера (для /metrics)."""
+    queue_name = queue_name or celery_app.conf.task_default_queue
+    with celery_app.connection_for_read() as connection:
+        connection.ensure_connection(max_retries=1)
+        return connection.default_channel.queue_declare(queue=queue_name, passive=True).message_count
+
+@celery_setup_logging.connect
+def _configure_logging(**_kwargs):
+    # Воркер пишет логи в том же JSON-формате через очередь, что и API
+    setup_logging()
@@ -0,0 +1,324 @@
+"""Локальное хранилище событий календаря с инкрементальной синхронизацией.
+
+Первый запуск делает полную выгрузку событий (начиная со вчерашнего дня),
+дальше Google отдаёт только изменения по ``syncToken``/``nextSyncToken``.
+Чтение (`/api/slots`, `/api/records`) идёт из памяти процесса, а фоновый
+поток периодически подтягивает дельты. Если Google отвечает 410 Gone
+(токен устарел), выполняется повторная полная синхронизация.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from calendar_client import CALENDAR_ID, get_service
+from resilience import Freshness, is_failure
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+MOSCOW_TZ = timezone(timedelta(hours=3))
+SYNC_INTERVAL = float(os.getenv("EVENT_SYNC_INTERVAL", "30"))
+LOOKBACK_DAYS = 1
+# Частичный ответ: только поля, которые нужны записи, слотам и индексам клиентов
+EVENT_FIELDS = ("items(id,status,summary,description,colorId,start,end,extendedProperties),"
+                "nextPageToken,nextSyncToken")
+
+
+def parse_event_times(event: dict) -> Optional[Tuple[datetime, datetime]]:
+    """Начало и конец события в московском времени (naive) или None для событий на весь день."""
+    start_str = event.get("start", {}).get("dateTime")
+    end_str = event.get("end", {}).get("dateTime")
+    if not start_str or not end_str:
+        return None
+    try:
+        start = datetime.fromisoformat(start_str.replace("Z", "+00:00"))
+        end = datetime.fromisoformat(end_str.replace("Z", "+00:00"))
+    except ValueError:
+        logger.warning("Не удалось разобрать время события %s", event.get("id"))
+        return None
+    if start.tzinfo is not None:
+        start = start.astimezone(MOSCOW_TZ).replace(tzinfo=None)
+    if end.tzinfo is not None:
+        end = end.astimezone(MOSCOW_TZ).replace(tzinfo=None)
+    return start, end
+
+
+def user_key(name: str) -> str:
+    """Нормализованное имя клиента для точного (не подстрочного) сравнения."""
+    return " ".join(name.split()).casefold()
+
+
+def booking_metadata(event: dict) -> dict:
+    """Структурированные данные записи из ``extendedProperties.private``."""
+    return event.get("extendedProperties", {}).get("private", {})
+
+
+def booking_owner(event: dict) -> Optional[str]:
+    """Имя клиента записи: из метаданных, а для старых событий — из названия «Тип - Имя»."""
+    name = booking_metadata(event).get("userName")
+    if not name:
+        summary = event.get("summary", "")
+        if " - " in summary:
+            name = summary.rsplit(" - ", 1)[1]
+        elif "Запись на массаж — " in summary:
+            name = summary.split("Запись на массаж — ", 1)[1]
+    return user_key(name) if name and name.strip() else None
+
+
+def _is_gone(error: Exception) -> bool:
+    return getattr(getattr(error, "resp", None), "status", None) == 410
+
+
+class EventStore:
+    """Копия событий одного календаря в памяти процесса."""
+
+    def __init__(self, calendar_id: str, service_factory: Callable = get_service):
+        self.calendar_id = calendar_id
+        self._service_factory = service_factory
+        self._events: Dict[str, dict] = {}
+        self._times: Dict[str, Tuple[datetime, datetime]] = {}
+        # Индексы записей: нормализованное имя клиента / Telegram id -> id событий
+        self._by_user: Dict[str, Set[str]] = {}
+        self._by_user_id: Dict[str, Set[str]] = {}
+        self._sync_token: Optional[str] = None
+        self._lock = threading.RLock()
+        # Параллельные sync() (холодный старт под нагрузкой, уведомление и фоновый опрос) делят один запрос
+        self._flight = SingleFlight("calendar_sync")
+        self._listeners: List[Callable[[Set[date]], None]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.version = 0
+        self.last_sync: Optional[float] = None
+        # Пока Google недоступен, копия продолжает отдаваться, но ответы помечаются устаревшими
+        self.freshness = Freshness(f"calendar:{calendar_id}")
+
+    # --- синхронизация -------------------------------------------------
+
+    @property
+    def is_ready(self) -> bool:
+        return self._sync_token is not None
+
+    def ensure_ready(self):
+        if not self.is_ready:
+            self.sync()
+
+    def sync(self) -> int:
+        """Подтянуть изменения из Google. Возвращает число изменённых событий."""
+        try:
+            changed = self._flight.do("sync", self._sync)
+        except Exception:
+            self.freshness.failed()
+            raise
+        self.freshness.ok()
+        return changed
+
+    def _sync(self) -> int:
+        if self._sync_token is None:
+            return self._full_sync()
+        try:
+            return self._incremental_sync()
+        except Exception as e:
+            if not _is_gone(e):
+                raise
+            logger.info("syncToken устарел, выполняю полную синхронизацию")
+            self._sync_token = None
+            return self._full_sync()
+
+    def _list_pages(self, **params) -> Tuple[List[dict], Optional[str]]:
+        service = self._service_factory()
+        items: List[dict] = []
+        page_token = None
+        while True:
+            result = service.events().list(
+                calendarId=self.calendar_id, singleEvents=True,
+                pageToken=page_token, fields=EVENT_FIELDS, **params
+            ).execute()
+            items.extend(result.get("items", []))
+            page_token = result.get("nextPageToken")
+            if not page_token:
+                return items, result.get("nextSyncToken")
+
+    def _full_sync(self) -> int:
+        time_min = datetime.now(timezone.utc) - timedelta(days=LOOKBACK_DAYS)
+        items, token = self._list_pages(timeMin=time_min.isoformat(), maxResults=2500)
+        with self._lock:
+            changed = self._days_of(self._times.keys())
+            self._events.clear()
+            self._times.clear()
+            self._by_user.clear()
+            self._by_user_id.clear()
+            for event in items:
+                if event.get("status") != "cancelled":
+                    changed |= self._put(event)
+            self._sync_token = token
+            self._after_change(changed)
+        logger.info("Полная синхронизация календаря: %d событий", len(items))
+        return len(items)
+
+    def _incremental_sync(self) -> int:
+        items, token = self._list_pages(syncToken=self._sync_token)
+        with self._lock:
+            changed: Set[date] = set()
+            for event in items:
+                if event.get("status") == "cancelled":
+                    changed |= self._drop(event.get("id"))
+                else:
+                    changed |= self._put(event)
+            self._sync_token = token
+            changed |= self._prune()
+            self._after_change(changed)
+        if items:
+            logger.info("Инкрементальная синхронизация: %d изменений", len(items))
+        return len(items)
+
+    # --- локальные изменения (write-through после записи в Google) ------
+
+    def upsert(self, event: dict):
+        with self._lock:
+            self._after_change(self._put(event))
+
+    def remove(self, event_id: str):
+        with self._lock:
+            self._after_change(self._drop(event_id))
+
+    def _put(self, event: dict) -> Set[date]:
+        event_id = event.get("id")
+        if not event_id:
+            return set()
+        changed = self._drop(event_id)
+        self._events[event_id] = event
+        self._index_owner(event_id, event, add=True)
+        times = parse_event_times(event)
+        if times:
+            self._times[event_id] = times
+            changed.add(times[0].date())
+        return changed
+
+    def _drop(self, event_id: Optional[str]) -> Set[date]:
+        event = self._events.pop(event_id, None)
+        if event is not None:
+            self._index_owner(event_id, event, add=False)
+        times = self._times.pop(event_id, None)
+        return {times[0].date()} if times else set()
+
+    def _index_owner(self, event_id: str, event: dict, add: bool):
+        keys = [(self._by_user, booking_owner(event)), (self._by_user_id, booking_metadata(event).get("userId"))]
+        for index, key in keys:
+            if not key:
+                continue
+            if add:
+                index.setdefault(key, set()).add(event_id)
+            else:
+                ids = index.get(key)
+                if ids is not None:
+                    ids.discard(event_id)
+                    if not ids:
+                        del index[key]
+
+    def _prune(self) -> Set[date]:
+        border = datetime.now(MOSCOW_TZ).replace(tzinfo=None) - timedelta(days=LOOKBACK_DAYS)
+        stale = [event_id for event_id, (_, end) in self._times.items() if end < border]
+        changed: Set[date] = set()
+        for event_id in stale:
+            changed |= self._drop(event_id)
+        return changed
+
+    def _days_of(self, event_ids: Iterable[str]) -> Set[date]:
+        return {self._times[event_id][0].date() for event_id in event_ids if event_id in self._times}
+
+    def _after_change(self, changed: Set[date]):
+        self.last_sync = time.time()
+        if not changed:
+            return
+        self.version += 1
+        for listener in list(self._listeners):
+            try:
+                listener(changed)
+            except Exception:
+                logger.exception("Ошибка в подписчике EventStore")
+
+    def add_listener(self, listener: Callable[[Set[date]], None]):
+        """Подписаться на изменения: listener получает множество затронутых дней."""
+        self._listeners.append(listener)
+
+    # --- чтение ---------------------------------------------------------
+
+    def get(self, event_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._events.get(event_id)
+
+    def events_between(self, time_min: datetime, time_max: datetime) -> List[Tuple[datetime, datetime, dict]]:
+        """События (начало, конец, ресурс), пересекающие интервал, по возрастанию начала."""
+        with self._lock:
+            found = [
+                (start, end, self._events[event_id])
+                for event_id, (start, end) in self._times.items()
+                if start < time_max and end > time_min
+            ]
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def events_for_user(self, user_name: Optional[str] = None, user_id: Optional[str] = None,
+                        time_min: Optional[datetime] = None) -> List[Tuple[datetime, datetime, dict]]:
+        """Записи клиента (по точному имени или Telegram id), по возрастанию начала."""
+        with self._lock:
+            if user_id:
+                ids = self._by_user_id.get(str(user_id), set())
+            else:
+                ids = self._by_user.get(user_key(user_name or ""), set())
+            found = [
+                (self._times[event_id][0], self._times[event_id][1], self._events[event_id])
+                for event_id in ids if event_id in self._times
+            ]
+        if time_min is not None:
+            found = [item for item in found if item[1] > time_min]
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def events_on(self, day: date) -> List[Tuple[datetime, datetime, dict]]:
+        start = datetime(day.year, day.month, day.day)
+        return self.events_between(start, start + timedelta(days=1))
+
+    # --- фоновое обновление --------------------------------------------
+
+    def start_background_refresh(self, interval: float = SYNC_INTERVAL):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._refresh_loop, args=(interval,),
+                                        name="event-store-refresh", daemon=True)
+        self._thread.start()
+
+    def stop_background_refresh(self):
+        self._stop.set()
+
+    def _refresh_loop(self, interval: float):
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                if is_failure(e):
+                    # Google недоступен: копия продолжает отдаваться с пометкой устаревшей
+                    logger.warning("Календарь не синхронизирован, отдаём локальную копию: %s", e)
+                else:
+                    logger.exception("Ошибка фоновой синхронизации календаря")
+            self._stop.wait(interval)
+
+
+_stores: Dict[str, EventStore] = {}
+_store_lock = threading.Lock()
+
+
+def get_store(calendar_id: Optional[str] = None) -> EventStore:
+    """Хранилище событий календаря (по умолчанию основного, CALENDAR_ID), одно на процесс."""
+    calendar_id = calendar_id or CALENDAR_ID
+    store = _stores.get(calendar_id)
+    if store is None:
+        with _store_lock:
+            store = _stores.get(calendar_id)
+            if store is None:
+                store = _stores[calendar_id] = EventStore(calendar_id)
+    return store
@@ -0,0 +1,396 @@
+"""Поддельный Google Calendar для офлайн-проверок.
+
+Повторяет ту часть API ``googleapiclient``, которой пользуется бэкенд:
+``service.events().list/get/insert/patch/delete(...).execute()`` с пагинацией и
+инкрементальной синхронизацией через ``syncToken``, а также пакетные
+запросы ``new_batch_http_request``, ``freebusy().query`` и push-каналы
+``events().watch``/``channels().stop``: после каждого изменения календаря
+на адрес канала уходит POST с заголовками ``X-Goog-*``, как от Google.
+Включается переменной окружения ``CALENDAR_BACKEND=fake`` (см. ``calendar_client.get_service``).
+``FAKE_CALENDAR_LATENCY`` (секунды) добавляет задержку к каждому вызову,
+чтобы имитировать сетевой round trip до Google, а флаг ``outage`` сервиса —
+сбой, при котором все вызовы отвечают 503.
+"""
+import itertools
+import os
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+MOSCOW_TZ = timezone(timedelta(hours=3))
+
+
+class FakeResponse(dict):
+    def __init__(self, status: int):
+        super().__init__(status=str(status))
+        self.status = status
+        self.reason = "fake"
+
+
+class FakeHttpError(Exception):
+    """Аналог ``googleapiclient.errors.HttpError`` с атрибутом ``resp.status``."""
+
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(f"{status} {message}".strip())
+        self.resp = FakeResponse(status)
+
+
+class FakeRequest:
+    def __init__(self, method_id: str, func, *args, latency: float = 0.0,
+                 backend: Optional["FakeCalendarService"] = None, **kwargs):
+        self.methodId = method_id
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._latency = latency
+        self._backend = backend
+
+    def execute(self, num_retries: int = 0):
+        if self._latency:
+            time.sleep(self._latency)
+        if self._backend is not None:
+            self._backend.check_outage()
+        return self._func(*self._args, **self._kwargs)
+
+
+def _normalize_time(value: dict) -> dict:
+    """Google возвращает dateTime со смещением; наивное время трактуем как московское."""
+    value = dict(value)
+    if "dateTime" in value:
+        dt = datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=MOSCOW_TZ)
+        value["dateTime"] = dt.isoformat()
+    return value
+
+
+def _parse(value: str) -> datetime:
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+class FakeCalendar:
+    """Состояние одного календаря: события и журнал изменений для syncToken."""
+
+    def __init__(self):
+        self.events: Dict[str, dict] = {}
+        self._seq = itertools.count(1)
+        self._changed_at: Dict[str, int] = {}
+        self.last_seq = 0
+        self.token_epoch = 0
+
+    def touch(self, event_id: str):
+        self.last_seq = next(self._seq)
+        self._changed_at[event_id] = self.last_seq
+
+
+class FakeEvents:
+    def __init__(self, backend: "FakeCalendarService"):
+        self._backend = backend
+
+    def list(self, calendarId: str, syncToken: Optional[str] = None, timeMin: Optional[str] = None,
+             timeMax: Optional[str] = None, pageToken: Optional[str] = None, maxResults: int = 250,
+             **_ignored):
+        return self._backend.request("calendar.events.list", self._backend._list, calendarId, syncToken, timeMin, timeMax, pageToken, maxResults)
+
+    def get(self, calendarId: str, eventId: str, **_ignored):
+        return self._backend.request("calendar.events.get", self._backend._get, calendarId, eventId)
+
+    def insert(self, calendarId: str, body: dict, **_ignored):
+        return self._backend.request("calendar.events.insert", self._backend._insert, calendarId, body)
+
+    def delete(self, calendarId: str, eventId: str, **_ignored):
+        return self._backend.request("calendar.events.delete", self._backend._delete, calendarId, eventId)
+
+    def patch(self, calendarId: str, eventId: str, body: dict, **_ignored):
+        return self._backend.request("calendar.events.patch", self._backend._patch, calendarId, eventId, body)
+
+    def watch(self, calendarId: str, body: dict, **_ignored):
+        return self._backend.request("calendar.events.watch", self._backend._watch, calendarId, body)
+
+
+class FakeChannels:
+    def __init__(self, backend: "FakeCalendarService"):
+        self._backend = backend
+
+    def stop(self, body: dict, **_ignored):
+        return self._backend.request("calendar.channels.stop", self._backend._stop_channel, body)
+
+
+class FakeFreeBusy:
+    def __init__(self, backend: "FakeCalendarService"):
+        self._backend = backend
+
+    def query(self, body: dict, **_ignored):
+        return self._backend.request("calendar.freebusy.query", self._backend._freebusy, body)
+
+
+class FakeBatch:
+    """Аналог ``BatchHttpRequest``: несколько вызовов за один round trip."""
+
+    def __init__(self, backend: "FakeCalendarService", callback=None):
+        self._backend = backend
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request: FakeRequest, callback=None, request_id: Optional[str] = None):
+        request_id = request_id or str(len(self._requests) + 1)
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self):
+        self._backend._count("batch")
+        if self._backend.latency:
+            time.sleep(self._backend.latency)
+        self._backend.check_outage()
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request._func(*request._args, **request._kwargs), None
+            except FakeHttpError as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class FakeCalendarService:
+    """Заменитель объекта, который возвращает ``googleapiclient.discovery.build``."""
+
+    def __init__(self, latency: float = 0.0):
+        self._calendars: Dict[str, FakeCalendar] = {}
+        self._lock = threading.RLock()
+        self.calls: Dict[str, int] = {}
+        self.latency = latency
+        self.outage = False
+        self._channels: Dict[str, dict] = {}
+        self._message_numbers = itertools.count(1)
+        # Как requestBuilder в googleapiclient.discovery.build: класс объектов-запросов
+        self.request_builder = FakeRequest
+
+    def request(self, method_id: str, func, *args) -> FakeRequest:
+        return self.request_builder(method_id, func, *args, latency=self.latency, backend=self)
+
+    def check_outage(self):
+        """При ``outage = True`` каждый вызов отвечает 503, как Google во время сбоя."""
+        if self.outage:
+            raise FakeHttpError(503, "backendError")
+
+    def events(self):
+        return FakeEvents(self)
+
+    def freebusy(self):
+        return FakeFreeBusy(self)
+
+    def channels(self):
+        return FakeChannels(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def calendar(self, calendar_id: str) -> FakeCalendar:
+        with self._lock:
+            return self._calendars.setdefault(calendar_id, FakeCalendar())
+
+    def _count(self, name: str):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def invalidate_sync_tokens(self, calendar_id: str):
+        """Следующий запрос со старым syncToken получит 410 Gone."""
+        self.calendar(calendar_id).token_epoch += 1
+
+    # --- реализация методов ---------------------------------------------
+
+    def _list(self, calendar_id, sync_token, time_min, time_max, page_token, max_results):
+        self._count("events.list")
+        with self._lock:
+            cal = self.calendar(calendar_id)
+            if sync_token is not None:
+                epoch, _, seq = sync_token.partition(":")
+                if int(epoch) != cal.token_epoch:
+                    raise FakeHttpError(410, "Sync token is no longer valid")
+                since = int(seq)
+                items = [
+                    cal.events.get(event_id) or {"id": event_id, "status": "cancelled"}
+                    for event_id, changed in cal._changed_at.items() if changed > since
+                ]
+            else:
+                low = _parse(time_min) if time_min else None
+                high = _parse(time_max) if time_max else None
+                items = []
+                for event in cal.events.values():
+                    start = _parse(event["start"]["dateTime"]) if "dateTime" in event["start"] else None
+                    end = _parse(event["end"]["dateTime"]) if "dateTime" in event["end"] else None
+                    if start and ((high and start >= high) or (low and end <= low)):
+                        continue
+                    items.append(event)
+                items.sort(key=lambda e: e["start"].get("dateTime", ""))
+            offset = int(page_token or 0)
+            page = [dict(e) for e in items[offset:offset + max_results]]
+            result = {"items": page}
+            if offset + max_results < len(items):
+                result["nextPageToken"] = str(offset + max_results)
+            else:
+                result["nextSyncToken"] = f"{cal.token_epoch}:{cal.last_seq}"
+            return result
+
+    def _freebusy(self, body):
+        self._count("freebusy.query")
+        low, high = _parse(body["timeMin"]), _parse(body["timeMax"])
+        calendars = {}
+        with self._lock:
+            for item in body.get("items", []):
+                intervals = []
+                for event in self.calendar(item["id"]).events.values():
+                    if "dateTime" not in event["start"]:
+                        continue
+                    start, end = _parse(event["start"]["dateTime"]), _parse(event["end"]["dateTime"])
+                    if start < high and end > low:
+                        intervals.append((max(start, low), min(end, high)))
+                merged = []
+                for start, end in sorted(intervals):
+                    if merged and start <= merged[-1][1]:
+                        merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                    else:
+                        merged.append((start, end))
+                calendars[item["id"]] = {"busy": [
+                    {"start": start.astimezone(timezone.utc).isoformat().replace("+00:00", "Z"),
+                     "end": end.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")}
+                    for start, end in merged
+                ]}
+        return {"kind": "calendar#freeBusy", "timeMin": body["timeMin"], "timeMax": body["timeMax"], "calendars": calendars}
+
+    def _get(self, calendar_id, event_id):
+        self._count("events.get")
+        with self._lock:
+            event = self.calendar(calendar_id).events.get(event_id)
+            if event is None:
+                raise FakeHttpError(404, "Not Found")
+            return dict(event)
+
+    def _insert(self, calendar_id, body):
+        self._count("events.insert")
+        with self._lock:
+            cal = self.calendar(calendar_id)
+            event = dict(body)
+            event["id"] = event.get("id") or uuid.uuid4().hex
+            event["status"] = "confirmed"
+            event["start"] = _normalize_time(body["start"])
+            event["end"] = _normalize_time(body["end"])
+            event["htmlLink"] = f"https://calendar.fake/event?eid={event['id']}"
+            event["updated"] = datetime.now(timezone.utc).isoformat()
+            cal.events[event["id"]] = event
+            cal.touch(event["id"])
+        self.notify_watchers(calendar_id)
+        return dict(event)
+
+    def _delete(self, calendar_id, event_id):
+        self._count("events.delete")
+        with self._lock:
+            cal = self.calendar(calendar_id)
+            if cal.events.pop(event_id, None) is None:
+                raise FakeHttpError(410 if event_id in cal._changed_at else 404, "Deleted")
+            cal.touch(event_id)
+        self.notify_watchers(calendar_id)
+        return ""
+
+    def _patch(self, calendar_id, event_id, body):
+        self._count("events.patch")
+        with self._lock:
+            cal = self.calendar(calendar_id)
+            event = cal.events.get(event_id)
+            if event is None:
+                raise FakeHttpError(404, "Not Found")
+            event.update(body)
+            event["updated"] = datetime.now(timezone.utc).isoformat()
+            cal.touch(event_id)
+            event = dict(event)
+        self.notify_watchers(calendar_id)
+        return event
+
+    def _watch(self, calendar_id, body):
+        self._count("events.watch")
+        ttl = float(body.get("params", {}).get("ttl", 7 * 24 * 3600))
+        channel = {
+            "kind": "api#channel",
+            "id": body["id"],
+            "resourceId": uuid.uuid4().hex,
+            "resourceUri": f"https://calendar.fake/calendars/{calendar_id}/events",
+            "token": body.get("token"),
+            "expiration": str(int((time.time() + ttl) * 1000)),
+        }
+        with self._lock:
+            self._channels[body["id"]] = dict(channel, address=body["address"], calendar_id=calendar_id)
+        # Google сразу присылает уведомление resource-state=sync о том, что канал открыт
+        self._post(self._channels[body["id"]], "sync")
+        return channel
+
+    def _stop_channel(self, body):
+        self._count("channels.stop")
+        with self._lock:
+            channel = self._channels.get(body["id"])
+            if channel is None or channel["resourceId"] != body.get("resourceId"):
+                raise FakeHttpError(404, "Channel not found")
+            del self._channels[body["id"]]
+        return ""
+
+    def notify_watchers(self, calendar_id: str, state: str = "exists"):
+        """Отправить push-уведомление всем открытым каналам календаря (как Google после изменения)."""
+        now_ms = time.time() * 1000
+        with self._lock:
+            channels = [dict(channel) for channel in self._channels.values()
+                        if channel["calendar_id"] == calendar_id and int(channel["expiration"]) > now_ms]
+        for channel in channels:
+            self._post(channel, state)
+
+    def _post(self, channel: dict, state: str):
+        headers = {
+            "X-Goog-Channel-ID": channel["id"],
+            "X-Goog-Channel-Expiration": datetime.fromtimestamp(int(channel["expiration"]) / 1000, timezone.utc)
+                                                 .strftime("%a, %d %b %Y %H:%M:%S GMT"),
+            "X-Goog-Resource-ID": channel["resourceId"],
+            "X-Goog-Resource-URI": channel["resourceUri"],
+            "X-Goog-Resource-State": state,
+            "X-Goog-Message-Number": str(next(self._message_numbers)),
+        }
+        if channel.get("token"):
+            headers["X-Goog-Channel-Token"] = channel["token"]
+        # Доставка фоном: запрос к API не ждёт приёмника уведомлений
+        threading.Thread(target=_deliver, args=(channel["address"], headers), name="fake-push", daemon=True).start()
+
+    # --- удобства для сценариев -------------------------------------------
+
+    def add_event(self, calendar_id: str, start: datetime, end: datetime, summary: str = "Занято",
+                  **extra) -> dict:
+        body = {
+            "summary": summary,
+            "start": {"dateTime": start.isoformat(), "timeZone": "Europe/Moscow"},
+            "end": {"dateTime": end.isoformat(), "timeZone": "Europe/Moscow"},
+        }
+        body.update(extra)
+        return self._insert(calendar_id, body)
+
+    def all_events(self, calendar_id: str) -> List[dict]:
+        with self._lock:
+            return [dict(e) for e in self.calendar(calendar_id).events.values()]
+
+
+def _deliver(address: str, headers: Dict[str, str]):
+    try:
+        urllib.request.urlopen(urllib.request.Request(address, data=b"", headers=headers, method="POST"), timeout=5)
+    except OSError:
+        pass
+
+
+_fake_service: Optional[FakeCalendarService] = None
+_fake_lock = threading.Lock()
+
+
+def get_fake_service() -> FakeCalendarService:
+    """Один поддельный календарь на процесс, общий для всех потоков."""
+    global _fake_service
+    with _fake_lock:
+        if _fake_service is None:
+            _fake_service = FakeCalendarService(float(os.getenv("FAKE_CALENDAR_LATENCY", "0")))
+        return _fake_service
@@ -1,106 +1,72 @@
+import logging
 from datetime import datetime, timedelta, timezone
-from typing import List
-import os
-import google.auth
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from typing import Dict, Iterable, List
+from calendar_client import get_service
+from availability import HORIZON_DAYS, KNOWN_DURATIONS
+import masters
+from log_config import sampled
+from schedule_rules import get_rules
+from resilience import call_with_timeout
 
-# Настройки
-SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
-SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "google_key.json")
-CALENDAR_ID = os.getenv("CALENDAR_ID")
+logger = logging.getLogger(__name__)
 
-def get_available_slots(date: datetime, massage_type: str = "classic", duration_minutes: int = 60) -> List[str]:
-    print(f"[get_available_slots] Начало выполнения функции")
-    print(f"[get_available_slots] Дата: {date}, тип: {massage_type}, длительность: {duration_minutes}")
-    
+def get_available_slots(date: datetime, massage_type: str = "classic", duration_minutes: int = 60, master_id: str = None) -> List[str]:
     # Используем московское время (явно)
     MOSCOW_TZ = timezone(timedelta(hours=3))
     now = datetime.now(MOSCOW_TZ)
-    print(f"[get_available_slots] Текущее время (МСК): {now}")
     
-    if date.date() < now.date() or date.date() > now.date() + timedelta(days=14):
-        print(f"[get_available_slots] Дата вне диапазона, возвращаем пустой список")
+    if date.date() < now.date() or date.date() > now.date() + timedelta(days=HORIZON_DAYS):
+        logger.debug("Дата %s вне горизонта записи", date.date())
         return []
 
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES
-    )
-    service = build("calendar", "v3", credentials=creds)
+    # Вместе с сеансом должен помещаться и перерыв после него, своя длина для каждого типа массажа.
+    # Google (холодный старт, FreeBusy) ждём не дольше CALENDAR_READ_TIMEOUT — дальше 503, а не зависание
+    available = call_with_timeout(_available_slots, date.date(), duration_minutes, now.replace(tzinfo=None),
+                                  get_rules().buffer_for(massage_type), master_id)
+    logger.debug("Свободные слоты", extra=sampled(day=date.date().isoformat(), massage_type=massage_type,
+                                                 duration=duration_minutes, slots=len(available)))
+    return available
 
-    # Время в UTC для Google Calendar API
-    time_min = datetime(date.year, date.month, date.day, 0, 0, tzinfo=timezone.utc).isoformat()
-    time_max = datetime(date.year, date.month, date.day, 23, 59, tzinfo=timezone.utc).isoformat()
+def _available_slots(day, duration_minutes: int, now: datetime, buffer_minutes: int, master_id: str = None) -> List[str]:
+    # События берём из локальных хранилищ — Google запрашивается только за дельтами,
+    # календари всех мастеров загружаются одновременно.
+    # Без master_id — слоты, свободные хотя бы у одного мастера
+    masters.ensure_ready()
+    return masters.get_availability(master_id).available_slots(day, duration_minutes, now, buffer_minutes)
 
-    events_result = (
-        service.events()
-        .list(
-            calendarId=CALENDAR_ID,
-            timeMin=time_min,
-            timeMax=time_max,
-            singleEvents=True,
-            orderBy="startTime",
-        )
-        .execute()
-    )
-    events = events_result.get("items", [])
-    
-    # Получаем информацию о занятых интервалах
-    busy_intervals = []
-    for event in events:
-        start_str = event["start"].get("dateTime")
-        end_str = event["end"].get("dateTime") 
-        if start_str and end_str:
-            try:
-                # Всегда парсим как UTC, потом переводим в МСК
-                start_dt_utc = datetime.fromisoformat(start_str.replace("Z", "+00:00")).astimezone(timezone.utc)
-                end_dt_utc = datetime.fromisoformat(end_str.replace("Z", "+00:00")).astimezone(timezone.utc)
-                start_dt_moscow = start_dt_utc.astimezone(MOSCOW_TZ).replace(tzinfo=None)
-                end_dt_moscow = end_dt_utc.astimezone(MOSCOW_TZ).replace(tzinfo=None)
-                # Добавляем буферное время (20 минут) после каждого сеанса
-                end_dt_with_buffer = end_dt_moscow + timedelta(minutes=20)
-                busy_intervals.append((start_dt_moscow, end_dt_with_buffer))
-                print(f"[get_available_slots] Занятый интервал (МСК): {start_dt_moscow} - {end_dt_with_buffer}")
-            except Exception as e:
-                print(f"[get_available_slots] Ошибка парсинга события: {e}")
-                continue
+def get_available_slots_range(date_from: datetime, date_to: datetime, durations: Iterable[int] = KNOWN_DURATIONS, master_id: str = None,
+                              massage_type: str = "classic") -> Dict[str, Dict[str, List[str]]]:
+    """Свободные слоты на каждый день диапазона и каждую длительность за один проход.
 
-    available = []
-    # Проверяем слоты с 10:00 до 21:00 с интервалом в 20 минут
-    for hour in range(10, 21):
-        for minute in [0, 20, 40]:  # Слоты каждые 20 минут
-            slot_start = datetime(date.year, date.month, date.day, hour, minute, tzinfo=MOSCOW_TZ).replace(tzinfo=None)
-            slot_end = slot_start + timedelta(minutes=duration_minutes)
-            # Проверяем, что слот начинается не раньше чем через 4 часа от текущего времени
-            if slot_start <= now.replace(tzinfo=None) + timedelta(hours=4):
-                continue
-            # Проверяем, что слот не выходит за рамки рабочего дня (до 21:00)
-            if slot_end.hour > 21 or (slot_end.hour == 21 and slot_end.minute > 0):
-                continue
-            # Проверяем пересечения с занятыми интервалами
-            is_available = True
-            for busy_start, busy_end in busy_intervals:
-                # Пересечение есть, если: начало_слота < конец_занятого И конец_слота > начало_занятого
-                if slot_start < busy_end and slot_end > busy_start:
-                    print(f"[get_available_slots] Слот {slot_start} - {slot_end} пересекается с занятым {busy_start} - {busy_end}")
-                    is_available = False
-                    break
-            if is_available:
-                available.append(slot_start.isoformat())
-                print(f"[get_available_slots] Доступный слот: {slot_start}")
-    print(f"[get_available_slots] Всего доступных слотов: {len(available)}")
-    print(f"[get_available_slots] Возвращаемые слоты: {available}")
-    return available
+    Ответ компактный: ``{"2025-04-10": {"60": ["10:00", "10:20"]}}``. Дни вне
+    горизонта записи (сегодня + 14 дней) отбрасываются. Перерыв после сеанса —
+    тот же, что для ``massage_type`` в ``get_available_slots`` и ``book_slot``.
+    """
+    MOSCOW_TZ = timezone(timedelta(hours=3))
+    now = datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+    first = max(date_from.date(), now.date())
+    last = min(date_to.date(), now.date() + timedelta(days=HORIZON_DAYS))
+
+    return call_with_timeout(_slots_range, first, last, sorted(set(durations)), now, get_rules().buffer_for(massage_type),
+                             master_id)
+
+def _slots_range(first, last, durations: List[int], now: datetime, buffer_minutes: int,
+                 master_id: str = None) -> Dict[str, Dict[str, List[str]]]:
+    # Одна синхронизация покрывает всё окно — отдельных запросов на каждый день нет
+    masters.ensure_ready()
+    index = masters.get_availability(master_id)
+    result = {}
+    day = first
+    while day <= last:
+        result[day.isoformat()] = {
+            str(duration): [slot[11:16] for slot in index.available_slots(day, duration, now, buffer_minutes)]
+            for duration in durations
+        }
+        day += timedelta(days=1)
+    return result
 
 def delete_event(event_id: str):
-    from google.oauth2 import service_account
-    from googleapiclient.discovery import build
-    import os
-    SCOPES = ["https://www.googleapis.com/auth/calendar"]
-    SERVICE_ACCOUNT_FILE = os.getenv("GOOGLE_APPLICATION_CREDENTIALS", "google_key.json")
-    CALENDAR_ID = os.getenv("CALENDAR_ID")
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES
-    )
-    service = build("calendar", "v3", credentials=creds)
-    service.events().delete(calendarId=CALENDAR_ID, eventId=event_id).execute()
+    master = masters.find_event(event_id) or masters.get_master(None)
+    service = get_service()
+    service.events().delete(calendarId=master.calendar_id, eventId=event_id).execute()
+    master.store.remove(event_id)
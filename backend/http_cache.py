@@ -0,0 +1,68 @@
+"""Кэш HTTP-ответов с ETag для часто опрашиваемых эндпоинтов.
+
+Ответ хранится готовыми байтами по ключу (например, день + длительность)
+вместе со строгим ETag. ETag строится из счётчика версий данных, который
+растёт при каждой записи, отмене или синхронизации календаря, — пока
+версия не изменилась, ответ отдаётся из кэша без пересчёта, а клиент с
+совпадающим ``If-None-Match`` получает 304 без тела. Короткий
+``Cache-Control`` позволяет Cloudflare перед нами гасить повторные чтения.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.sha1("|".join(str(part) for part in parts).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 512):
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key: Hashable, etag: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, etag: str, body: bytes):
+        with self._lock:
+            self._entries[key] = (etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    async def respond(self, request: Request, key: Hashable, etag: str,
+                      compute: Callable[[], Awaitable[Any]], cache_control: str) -> Response:
+        """Отдать 304, закэшированный ответ или посчитать и закэшировать новый."""
+        headers = {"ETag": etag, "Cache-Control": cache_control}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        body = self.get(key, etag)
+        if body is None:
+            body = json.dumps(await compute(), ensure_ascii=False).encode()
+            self.put(key, etag, body)
+        return Response(content=body, media_type="application/json", headers=headers)
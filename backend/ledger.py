@@ -0,0 +1,274 @@
+"""Локальный журнал записей (SQLite) — основное хранилище записей клиентов.
+
+Запись и отмена — это одна локальная транзакция: строка в журнале
+появляется (или помечается отменённой) сразу, а в Google Calendar её
+переносит фоновый поток ``mirror``. Пока событие не создано в Google,
+занятое время добавляется к занятости календаря из журнала
+(``busy_provider``), поэтому слот не выдаётся второй раз и при
+недоступности Google запись продолжает работать.
+
+База открывается в режиме WAL: читатели (слоты, записи клиента, список
+записей) не ждут писателя. Соединение — своё у каждого потока, запись
+сериализуется замком процесса. Путь — ``LEDGER_PATH`` (по умолчанию
+``ledger.db`` рядом с модулем).
+
+``busy_end`` у любой строки — конец сеанса плюс перерыв его типа массажа,
+как и конец события, которое пишет ``create_calendar_event``: так время
+записи занято одинаково до переноса в Google, после него и у записей,
+подтянутых из календаря.
+
+Состояние синхронизации строки (``sync_state``):
+
+- ``pending_create`` — создать событие в Google;
+- ``pending_delete`` — отменена локально, удалить событие в Google;
+- ``synced`` — Google совпадает с журналом.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from event_store import user_key
+from schedule_rules import get_rules
+
+logger = logging.getLogger(__name__)
+
+LEDGER_PATH = os.getenv("LEDGER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ledger.db"))
+MAX_BACKOFF = 300.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bookings (
+    id TEXT PRIMARY KEY,
+    event_id TEXT UNIQUE,
+    master_id TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL,
+    busy_end TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    user_key TEXT NOT NULL,
+    user_id TEXT,
+    massage_type TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'active',
+    sync_state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS bookings_calendar_day ON bookings (calendar_id, day) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS bookings_start ON bookings (start) WHERE status = 'active';
+CREATE INDEX IF NOT EXISTS bookings_user_key ON bookings (user_key, start);
+CREATE INDEX IF NOT EXISTS bookings_user_id ON bookings (user_id, start) WHERE user_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS bookings_unsynced ON bookings (next_attempt_at) WHERE sync_state != 'synced';
+"""
+
+Booking = Dict[str, object]
+
+
+def _iso(dt: datetime) -> str:
+    return dt.replace(tzinfo=None, microsecond=0).isoformat()
+
+
+def _busy_end(start: datetime, duration: int, massage_type: str) -> datetime:
+    """Конец занятости записи: сеанс и перерыв его типа массажа — как конец события в Google."""
+    return start + timedelta(minutes=duration + get_rules().buffer_for(massage_type))
+
+
+class BookingLedger:
+    def __init__(self, path: str = LEDGER_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._listeners: List[Callable[[str, Set[date]], None]] = []
+        # Растёт при любом изменении журнала — на нём строится ETag /api/records
+        self.version = 0
+        with self._write_lock:
+            connection = self._connection()
+            connection.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _query(self, sql: str, params: Iterable = ()) -> List[Booking]:
+        return [dict(row) for row in self._connection().execute(sql, tuple(params))]
+
+    def _write(self, sql: str, params: Iterable = ()) -> int:
+        with self._write_lock:
+            cursor = self._connection().execute(sql, tuple(params))
+            self.version += 1
+            return cursor.rowcount
+
+    def add_listener(self, listener: Callable[[str, Set[date]], None]):
+        """Подписаться на изменения занятости: ``listener(calendar_id, дни)``."""
+        self._listeners.append(listener)
+
+    def _notify(self, booking: Optional[Booking]):
+        if not booking:
+            return
+        days = {date.fromisoformat(booking["day"])}
+        for listener in list(self._listeners):
+            listener(booking["calendar_id"], days)
+
+    # --- запись ------------------------------------------------------------
+
+    def add(self, master_id: str, calendar_id: str, start: datetime, end: datetime,
+            user_name: str, user_id: Optional[str], massage_type: str, duration: int) -> Booking:
+        """Новая запись, ещё не перенесённая в Google."""
+        now = time.time()
+        booking_id = uuid.uuid4().hex
+        self._write(
+            "INSERT INTO bookings (id, master_id, calendar_id, day, start, end, busy_end, user_name, user_key,"
+            " user_id, massage_type, duration, sync_state, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending_create', ?, ?)",
+            (booking_id, master_id, calendar_id, start.date().isoformat(), _iso(start), _iso(end),
+             _iso(_busy_end(start, duration, massage_type)), user_name, user_key(user_name), user_id, massage_type,
+             duration, now, now),
+        )
+        booking = self.get(booking_id)
+        self._notify(booking)
+        return booking
+
+    def import_event(self, event_id: str, master_id: str, calendar_id: str, start: datetime,
+                     user_name: str, user_id: Optional[str], massage_type: str, duration: int) -> bool:
+        """Запись, найденная в Google, но отсутствующая в журнале (создана до журнала или вне приложения)."""
+        now = time.time()
+        return bool(self._write(
+            "INSERT OR IGNORE INTO bookings (id, event_id, master_id, calendar_id, day, start, end, busy_end,"
+            " user_name, user_key, user_id, massage_type, duration, sync_state, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'synced', ?, ?)",
+            (event_id, event_id, master_id, calendar_id, start.date().isoformat(), _iso(start),
+             _iso(start + timedelta(minutes=duration)), _iso(_busy_end(start, duration, massage_type)), user_name,
+             user_key(user_name), user_id, massage_type, duration, now, now),
+        ))
+
+    def cancel(self, booking_id: str) -> Optional[Booking]:
+        """Отменить запись локально; событие в Google (если уже создано) удалит ``mirror``."""
+        booking = self.get(booking_id)
+        if not booking:
+            return None
+        # Проверка статуса — в самом UPDATE: из одновременных отмен срабатывает только одна
+        if not self._write(
+            "UPDATE bookings SET status = 'cancelled', updated_at = ?, attempts = 0, next_attempt_at = 0,"
+            " sync_state = CASE WHEN event_id IS NULL THEN sync_state ELSE 'pending_delete' END"
+            " WHERE id = ? AND status = 'active'",
+            (time.time(), booking["id"]),
+        ):
+            return None
+        self._notify(booking)
+        return self.get(booking["id"])
+
+    def mark_created(self, booking_id: str, event_id: str):
+        """Событие создано в Google. Если запись успели отменить — событие нужно удалить."""
+        self._write(
+            "UPDATE bookings SET event_id = ?, attempts = 0, next_attempt_at = 0, last_error = NULL, updated_at = ?,"
+            " sync_state = CASE WHEN status = 'active' THEN 'synced' ELSE 'pending_delete' END WHERE id = ?",
+            (event_id, time.time(), booking_id),
+        )
+        self._notify(self.get(booking_id))
+
+    def mark_synced(self, booking_id: str):
+        self._write("UPDATE bookings SET sync_state = 'synced', attempts = 0, last_error = NULL, updated_at = ?"
+                    " WHERE id = ?", (time.time(), booking_id))
+
+    def mark_failed(self, booking_id: str, error: str):
+        """Неудачная попытка синхронизации: повтор с экспоненциальной задержкой."""
+        booking = self.get(booking_id)
+        if not booking:
+            return
+        delay = min(MAX_BACKOFF, 2.0 ** booking["attempts"])
+        self._write("UPDATE bookings SET attempts = attempts + 1, next_attempt_at = ?, last_error = ?, updated_at = ?"
+                    " WHERE id = ?", (time.time() + delay, error[:500], time.time(), booking_id))
+
+    def mark_removed(self, booking_id: str):
+        """Событие удалили прямо в Google — запись больше не действует."""
+        booking = self.get(booking_id)
+        self._write("UPDATE bookings SET status = 'cancelled', sync_state = 'synced', updated_at = ? WHERE id = ?",
+                    (time.time(), booking_id))
+        self._notify(booking)
+
+    def move(self, booking_id: str, start: datetime):
+        """Событие перенесли в Google — переносим и запись (длительность и тип массажа прежние)."""
+        booking = self.get(booking_id)
+        if not booking:
+            return
+        end = start + timedelta(minutes=booking["duration"])
+        busy_end = _busy_end(start, booking["duration"], booking["massage_type"])
+        self._write("UPDATE bookings SET day = ?, start = ?, end = ?, busy_end = ?, updated_at = ? WHERE id = ?",
+                    (start.date().isoformat(), _iso(start), _iso(end), _iso(busy_end), time.time(), booking_id))
+        self._notify(booking)
+        self._notify(self.get(booking_id))
+
+    # --- чтение ------------------------------------------------------------
+
+    def get(self, booking_id: str) -> Optional[Booking]:
+        """Запись по id журнала или по id события Google."""
+        rows = self._query("SELECT * FROM bookings WHERE id = ? OR event_id = ? LIMIT 1", (booking_id, booking_id))
+        return rows[0] if rows else None
+
+    def active_between(self, time_min: datetime, time_max: datetime) -> List[Booking]:
+        return self._query("SELECT * FROM bookings WHERE status = 'active' AND start >= ? AND start < ? ORDER BY start",
+                           (_iso(time_min), _iso(time_max)))
+
+    def for_user(self, user_name: Optional[str], user_id: Optional[str], time_min: datetime,
+                 time_max: datetime) -> List[Booking]:
+        """Записи клиента: точное совпадение нормализованного имени или Telegram id."""
+        return self._query(
+            "SELECT * FROM bookings WHERE status = 'active' AND start >= ? AND start < ?"
+            " AND (user_key = ? OR (? IS NOT NULL AND user_id = ?)) ORDER BY start",
+            (_iso(time_min), _iso(time_max), user_key(user_name or ""), user_id, user_id),
+        )
+
+    def active_on(self, calendar_id: str, day: date) -> List[Booking]:
+        return self._query("SELECT * FROM bookings WHERE calendar_id = ? AND day = ? AND status = 'active'",
+                           (calendar_id, day.isoformat()))
+
+    def unmirrored_busy(self, calendar_id: str, day: date) -> List[Tuple[datetime, datetime]]:
+        """Занятость записей, которых ещё нет в Google.
+
+        Как и у событий календаря, конец — ``busy_end``: сеанс вместе с перерывом
+        его типа массажа. Общий буфер поверх добавляет индекс доступности.
+        """
+        rows = self._query("SELECT start, busy_end FROM bookings WHERE calendar_id = ? AND day = ?"
+                           " AND status = 'active' AND event_id IS NULL", (calendar_id, day.isoformat()))
+        return [(datetime.fromisoformat(row["start"]), datetime.fromisoformat(row["busy_end"])) for row in rows]
+
+    def synced_since(self, calendar_id: str, time_min: datetime) -> List[Booking]:
+        return self._query("SELECT * FROM bookings WHERE calendar_id = ? AND status = 'active' AND event_id IS NOT NULL"
+                           " AND sync_state = 'synced' AND start >= ?", (calendar_id, _iso(time_min)))
+
+    def due(self, limit: int = 100) -> List[Booking]:
+        """Строки, которые пора перенести в Google."""
+        return self._query("SELECT * FROM bookings WHERE sync_state != 'synced' AND next_attempt_at <= ?"
+                           " ORDER BY next_attempt_at, created_at LIMIT ?", (time.time(), limit))
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._query("SELECT sync_state, COUNT(*) AS n FROM bookings GROUP BY sync_state")
+        return {row["sync_state"]: row["n"] for row in rows}
+
+
+_ledger: Optional[BookingLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger() -> BookingLedger:
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = BookingLedger()
+    return _ledger
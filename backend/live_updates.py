@@ -0,0 +1,182 @@
+"""Рассылка изменений свободных слотов подписчикам (Server-Sent Events).
+
+Индекс слотов сообщает, какие дни сброшены (запись, отмена, очистка
+просроченных, синхронизация с Google). ``SlotFeed`` собирает эти дни,
+один раз пересчитывает для них слоты по всем парам (длительность,
+перерыв после сеанса) услуг каталога, сравнивает с предыдущим снимком
+и раздаёт одинаковую дельту всем подписчикам. Сколько бы клиентов ни было подключено, на одно изменение
+приходится один пересчёт, а не запрос к Google от каждого клиента.
+"""
+import asyncio
+import json
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from async_io import run_blocking
+from availability import HORIZON_DAYS, KNOWN_VARIANTS, AvailabilityIndex
+from event_store import MOSCOW_TZ
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 100
+KEEPALIVE_INTERVAL = 15.0
+RETRY_INTERVAL = 5.0
+
+
+def _format(minutes: Iterable[int]) -> List[str]:
+    return [f"{minute // 60:02d}:{minute % 60:02d}" for minute in minutes]
+
+
+class SlotFeed:
+    """Единая лента изменений доступности с раздачей многим подписчикам."""
+
+    def __init__(self, index: AvailabilityIndex, variants: Iterable[Tuple[int, int]] = KNOWN_VARIANTS):
+        self._index = index
+        # Перерыв после сеанса у типов массажа разный — слоты считаются так же, как их проверит book_slot
+        self._variants = tuple(variants)
+        self._snapshot: Dict[Tuple[date, int, int], List[int]] = {}
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._pending: Set[date] = set()
+        self._pending_lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        index.add_listener(self._on_change)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def start(self):
+        """Запустить рассылку в текущем event loop (вызывать из startup-обработчика)."""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = self._loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _on_change(self, days: Set[date]):
+        # Вызывается из потока, изменившего календарь; сам пересчёт — в цикле рассылки
+        with self._pending_lock:
+            self._pending |= days
+        if self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self):
+        # Первый проход по всему горизонту только снимает исходный снимок — дельт в нём нет
+        today = datetime.now(MOSCOW_TZ).date()
+        with self._pending_lock:
+            self._pending |= {today + timedelta(days=offset) for offset in range(HORIZON_DAYS + 1)}
+        self._wakeup.set()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            with self._pending_lock:
+                days, self._pending = self._pending, set()
+            try:
+                deltas = await run_blocking(self._diff, sorted(days))
+            except Exception:
+                # Например, Google недоступен, пока индекс ещё не прогрет: дни не теряем, повторяем позже
+                logger.exception("Не удалось пересчитать слоты для рассылки")
+                with self._pending_lock:
+                    self._pending |= days
+                await asyncio.sleep(RETRY_INTERVAL)
+                self._wakeup.set()
+                continue
+            for delta in deltas:
+                self._publish(delta)
+
+    def _diff(self, days: Iterable[date]) -> List[dict]:
+        """Пересчитать слоты дней и вернуть изменения относительно прошлого снимка."""
+        today = datetime.now(MOSCOW_TZ).date()
+        # Сначала считаем всё: при ошибке посередине снимок не должен обогнать разосланные дельты
+        current = {
+            (day, duration, buffer_minutes): self._index.free_starts(day, duration, buffer_minutes)
+            for day in days if today <= day <= today + timedelta(days=HORIZON_DAYS)
+            for duration, buffer_minutes in self._variants
+        }
+        deltas = []
+        for key, starts in current.items():
+            day, duration, buffer_minutes = key
+            previous = self._snapshot.get(key)
+            self._snapshot[key] = starts
+            if previous is None or previous == starts:
+                continue
+            old, new = set(previous), set(starts)
+            deltas.append({
+                "day": day.isoformat(),
+                "duration": duration,
+                "bufferMinutes": buffer_minutes,
+                "slots": _format(starts),
+                "added": _format(sorted(new - old)),
+                "removed": _format(sorted(old - new)),
+            })
+        for key in [key for key in self._snapshot if key[0] < today]:
+            del self._snapshot[key]
+        return deltas
+
+    def _publish(self, delta: dict):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(delta)
+            except asyncio.QueueFull:
+                # Медленный клиент: пусть перезапросит слоты целиком
+                self._subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+                logger.warning("Подписчик не успевает читать изменения слотов, отключаю")
+
+
+async def event_stream(feed: "SlotFeed", duration: Optional[int] = None, buffer_minutes: Optional[int] = None):
+    """Тело ответа ``text/event-stream``: дельты слотов и периодический keep-alive.
+
+    ``buffer_minutes`` — перерыв после сеанса выбранного типа массажа: дельты для других перерывов не нужны.
+    """
+    queue = feed.subscribe()
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                delta = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if delta is None:
+                yield "event: resync\ndata: {}\n\n"
+                return
+            if duration is not None and delta["duration"] != duration:
+                continue
+            if buffer_minutes is not None and delta["bufferMinutes"] != buffer_minutes:
+                continue
+            yield f"event: slots\ndata: {json.dumps(delta, ensure_ascii=False)}\n\n"
+    finally:
+        feed.unsubscribe(queue)
+
+
+_feed: Optional[SlotFeed] = None
+
+
+def get_feed() -> SlotFeed:
+    global _feed
+    if _feed is None:
+        from masters import get_availability
+
+        # Лента «любого мастера»: слот появляется, когда освобождается хотя бы у одного
+        _feed = SlotFeed(get_availability())
+    return _feed
@@ -0,0 +1,226 @@
+"""Нагрузочная проверка: медленный Google/Telegram не должен блокировать остальные запросы.
+
+Поднимает приложение на поддельном календаре (``CALENDAR_BACKEND=fake``) с
+искусственной задержкой каждого вызова Google и локальную заглушку Telegram
+с задержкой ответа. Затем при разной конкурентности параллельно гоняет
+``/api/slots`` и отмены записей (каждая — удаление в Google + сообщение в
+Telegram) и печатает пропускную способность и задержки.
+
+Запуск из каталога backend::
+
+    python loadtest.py --latency 0.2 --telegram-latency 0.3
+
+Режим ``--stress-book N`` проверяет защиту от двойной записи: N потоков
+одновременно вызывают ``book_slot`` на небольшой набор пересекающихся
+слотов, после чего на пересечения проверяются записи журнала и события,
+перенесённые из него в календарь.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# Сколько запросов получила заглушка Telegram (по методам Bot API)
+telegram_calls = {}
+_telegram_lock = threading.Lock()
+
+
+def start_fake_telegram(latency: float) -> str:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            method = self.path.rsplit("/", 1)[-1]
+            with _telegram_lock:
+                telegram_calls[method] = telegram_calls.get(method, 0) + 1
+            time.sleep(latency)
+            body = b'{"ok": true, "result": {}}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    ThreadingHTTPServer.request_queue_size = 128
+    server = ThreadingHTTPServer(("127.0.0.1", _free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def start_app(port: int):
+    import uvicorn
+
+    # main.py монтирует ./static, поэтому запускаем из временного каталога
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.makedirs(os.path.join(workdir, "static"))
+    os.chdir(workdir)
+    # Свой журнал записей на каждый прогон — без записей прошлых запусков
+    os.environ.setdefault("LEDGER_PATH", os.path.join(workdir, "ledger.db"))
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def seed_bookings(count: int):
+    """Записи для отмен: через ``book_slot``, как их создаёт ``/api/book``, чтобы отмена нашла их в журнале."""
+    from booking import book_slot
+
+    base = (datetime.now() + timedelta(days=2)).replace(hour=10, minute=0, second=0, microsecond=0)
+    ids = []
+    for i in range(count):
+        # 30 минут сеанса, перерыв и общий буфер индекса укладываются в 80 минут
+        start = base + timedelta(days=i // 8, minutes=(i % 8) * 80)
+        success, booking_id = book_slot(f"Клиент {i}", start.isoformat(), "classic", 30)
+        if not success:
+            raise RuntimeError(f"Не удалось создать запись на {start}")
+        ids.append(booking_id)
+    return ids
+
+
+async def _worker(session, make_request, count: int, latencies: list):
+    for _ in range(count):
+        started = time.perf_counter()
+        method, url, payload = make_request()
+        async with session.request(method, url, json=payload) as response:
+            await response.read()
+        latencies.append(time.perf_counter() - started)
+
+
+async def run_level(base_url: str, concurrency: int, per_worker: int, event_ids: list):
+    import aiohttp
+
+    day = (datetime.now() + timedelta(days=2)).strftime("%Y-%m-%d")
+    slot_latencies, cancel_latencies = [], []
+
+    def slots_request():
+        return "GET", f"{base_url}/api/slots?day={day}&duration=60", None
+
+    def cancel_request():
+        return "POST", f"{base_url}/api/cancel", {"name": "loadtest", "slot": "", "eventId": event_ids.pop()}
+
+    connector = aiohttp.TCPConnector(limit=concurrency * 2)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(_worker(session, slots_request, per_worker, slot_latencies) for _ in range(concurrency)),
+            *(_worker(session, cancel_request, 1, cancel_latencies) for _ in range(concurrency)),
+        )
+        elapsed = time.perf_counter() - started
+    return elapsed, slot_latencies, cancel_latencies
+
+
+def _overlaps(intervals, gap: timedelta) -> int:
+    """Соседние интервалы, между которыми меньше ``gap`` (общего буфера индекса доступности)."""
+    intervals = sorted(intervals)
+    return sum(1 for prev, nxt in zip(intervals, intervals[1:]) if nxt[0] < prev[1] + gap)
+
+
+def stress_book(attempts: int) -> int:
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Свой журнал на прогон: занятость считается по нему, а не по календарю
+    os.environ.setdefault("LEDGER_PATH", os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "ledger.db"))
+    import masters
+    import mirror
+    from availability import BUFFER_MINUTES
+    from booking import book_slot
+    from event_store import parse_event_times
+    from fake_calendar import get_fake_service
+    from ledger import get_ledger
+
+    day = (datetime.now() + timedelta(days=3)).replace(hour=10, minute=0, second=0, microsecond=0)
+    candidates = [day + timedelta(minutes=20 * step) for step in range(12)]
+    random.seed(7)
+    jobs = [(f"Клиент {i}", random.choice(candidates).isoformat(), random.choice(("classic", "stone")),
+             random.choice((30, 60, 90))) for i in range(attempts)]
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(attempts, 200)) as pool:
+        results = list(pool.map(lambda job: book_slot(*job), jobs))
+    elapsed = time.perf_counter() - started
+    booked = sum(1 for success, _ in results if success)
+
+    # book_slot пишет только журнал: пересечения ищем в нём (busy_end — сеанс с перерывом его типа)...
+    gap = timedelta(minutes=BUFFER_MINUTES)
+    calendar_ids = [master.calendar_id for master in masters.get_masters()]
+    ledger_overlaps = sum(
+        _overlaps([(datetime.fromisoformat(row["start"]), datetime.fromisoformat(row["busy_end"]))
+                   for row in get_ledger().active_on(calendar_id, day.date())], gap)
+        for calendar_id in calendar_ids
+    )
+    # ...и в календаре, после того как mirror перенёс туда все записи
+    while mirror.push_pending()["created"]:
+        pass
+    calendar_overlaps = sum(
+        _overlaps([parse_event_times(event) for event in get_fake_service().all_events(calendar_id)], gap)
+        for calendar_id in calendar_ids
+    )
+    print(f"{attempts} параллельных попыток за {elapsed:.2f} с: создано {booked} записей, "
+          f"пересечений в журнале {ledger_overlaps}, в календаре {calendar_overlaps}")
+    return ledger_overlaps + calendar_overlaps
+
+
+def _ms(values, q):
+    if not values:
+        return 0.0
+    if q == 50:
+        return statistics.median(values) * 1000
+    return sorted(values)[min(len(values) - 1, int(len(values) * q / 100))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка каждого вызова Google, с")
+    parser.add_argument("--telegram-latency", type=float, default=0.3, help="задержка ответа Telegram, с")
+    parser.add_argument("--levels", default="1,8,32", help="уровни конкурентности через запятую")
+    parser.add_argument("--requests", type=int, default=20, help="запросов /api/slots на одного клиента")
+    parser.add_argument("--stress-book", type=int, default=0, metavar="N",
+                        help="вместо замера пропускной способности проверить N параллельных записей")
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.levels.split(",")]
+    os.environ["CALENDAR_BACKEND"] = "fake"
+    os.environ.setdefault("CALENDAR_ID", "loadtest@fake")
+    os.environ["FAKE_CALENDAR_LATENCY"] = str(args.latency)
+    os.environ["TELEGRAM_API_URL"] = start_fake_telegram(args.telegram_latency)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if args.stress_book:
+        sys.exit(1 if stress_book(args.stress_book) else 0)
+
+    port = _free_port()
+    start_app(port)
+    event_ids = seed_bookings(sum(levels))
+    base_url = f"http://127.0.0.1:{port}"
+
+    print(f"Google latency {args.latency * 1000:.0f} ms, Telegram latency {args.telegram_latency * 1000:.0f} ms")
+    print(f"{'clients':>7} {'slots rps':>10} {'slots p50':>10} {'slots p99':>10} {'cancel p50':>11} {'cancel rps':>11}")
+    for level in levels:
+        elapsed, slot_lat, cancel_lat = asyncio.run(run_level(base_url, level, args.requests, event_ids))
+        print(f"{level:>7} {len(slot_lat) / elapsed:>10.1f} {_ms(slot_lat, 50):>8.1f}ms {_ms(slot_lat, 99):>8.1f}ms"
+              f" {_ms(cancel_lat, 50):>9.1f}ms {len(cancel_lat) / elapsed:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Настройка логирования бэкенда и бота.
+
+Записи пишутся одной строкой JSON (``LOG_FORMAT=json``, по умолчанию) или
+обычным текстом (``LOG_FORMAT=text``). Обработчик на корневом логгере —
+``QueueHandler``: поток запроса только кладёт запись в очередь, а вывод в
+stdout делает отдельный поток ``QueueListener``. Уровни задаются общим
+``LOG_LEVEL`` и по модулям через ``LOG_LEVELS="booking=DEBUG,httpx=WARNING"``.
+
+Подробности на горячих путях (по записи на каждый слот или интервал)
+пишутся с ``extra=sampled()`` и проходят только с долей ``LOG_SAMPLE_RATE``.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Стандартные атрибуты LogRecord; всё остальное пришло через extra=
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_rate"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def sampled(rate: Optional[float] = None, **fields) -> dict:
+    """``extra`` для записи, которую нужно пропускать лишь с долей ``rate``."""
+    return {"sample_rate": LOG_SAMPLE_RATE if rate is None else rate, **fields}
+
+
+class SamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, "sample_rate", None)
+        return rate is None or random.random() < rate
+
+
+class _MessageOnly(logging.Formatter):
+    """Форматтер ``QueueHandler``: текст сообщения, трассировка — отдельным полем ``exc``."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        if record.exc_info:
+            record.exc = self.formatException(record.exc_info)
+        return record.getMessage()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _module_levels(spec: str):
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            yield name.strip(), level.strip().upper()
+
+
+def setup_logging():
+    """Настроить логирование процесса; повторные вызовы ничего не делают."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    handler = logging.handlers.QueueHandler(records)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(_MessageOnly())
+    # Отбор по выборке до постановки в очередь, чтобы не тратить на отброшенные записи форматирование
+    handler.addFilter(SamplingFilter())
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in _module_levels(LOG_LEVELS):
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Дописать оставшиеся в очереди записи и остановить поток вывода."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -1,21 +1,58 @@
-from fastapi import FastAPI, Query, HTTPException, Body
+from fastapi import FastAPI, Query, HTTPException, Body, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from datetime import datetime
-from google_calendar import get_available_slots
-from booking import book_slot, cancel_slot, get_all_bookings, get_user_bookings
+from typing import List, Optional
+from datetime import datetime, timedelta
+from google_calendar import get_available_slots, get_available_slots_range
+from booking import book_slot, cancel_slot, get_all_bookings, get_user_bookings, bulk_cancel, migrate_legacy_bookings
+from event_store import MOSCOW_TZ
+from async_io import run_blocking, shutdown as shutdown_blocking_io
+import notifications
+import sweeper
+import mirror
+import calendar_watch
+import resilience
+from resilience import CalendarUnavailable
+from ledger import get_ledger
+from availability import HORIZON_DAYS, KNOWN_DURATIONS, time_bucket
+import masters
+import catalog
+from http_cache import ResponseCache, make_etag
+from schedule_rules import get_rules
+import threading
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from live_updates import event_stream, get_feed
 import logging
+import time
+import metrics
+from celery_app import queue_depth
+from log_config import sampled, setup_logging
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования: JSON-записи через очередь, уровни из LOG_LEVEL/LOG_LEVELS
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
 app = FastAPI()
 
-from fastapi.middleware.cors import CORSMiddleware
+# Кэш готовых ответов; ключ — параметры запроса, ETag — версия данных
+slots_cache = ResponseCache()
+records_cache = ResponseCache(max_entries=16)
+SLOTS_CACHE_CONTROL = "public, max-age=5, s-maxage=10"
+RECORDS_CACHE_CONTROL = "private, max-age=5"
+CATALOG_CACHE_CONTROL = "public, max-age=3600"
+CATALOG = catalog.as_list()
+# Сеанс должен помещаться в сутки: длительность за пределами 1..1440 минут — ошибка запроса (422)
+MAX_DURATION = 24 * 60
+
+def _slots_etag(*parts):
+    # Версия объединённого индекса меняется при изменении календаря любого мастера
+    return make_etag("slots", masters.get_availability().version, *time_bucket(), *parts)
+
+def _require_master(master_id: Optional[str]):
+    if master_id and masters.get_master(master_id) is None:
+        raise HTTPException(status_code=404, detail="Мастер не найден")
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,68 +62,278 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Метка — шаблон маршрута, а не путь: /api/user-bookings/{user_name}, без имён клиентов
+        route = getattr(request.scope.get("route"), "path", None) or "unmatched"
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - started, method=request.method, route=route)
+        metrics.HTTP_REQUESTS.inc(method=request.method, route=route, status=status)
+
+def _cache_samples():
+    index = masters.get_availability()
+    for name, hits, misses in (("slots_response", slots_cache.hits, slots_cache.misses),
+                               ("records_response", records_cache.hits, records_cache.misses),
+                               ("availability_index", index.hits, index.misses)):
+        yield {"cache": name, "result": "hit"}, hits
+        yield {"cache": name, "result": "miss"}, misses
+    yield {"cache": "slots_response", "result": "not_modified"}, slots_cache.not_modified
+    yield {"cache": "records_response", "result": "not_modified"}, records_cache.not_modified
+
+metrics.add_collector("cache_requests_total", "counter", "Cache lookups by cache and result.", _cache_samples)
+metrics.add_collector("celery_queue_depth", "gauge", "Tasks waiting in the Celery broker queue.",
+                      lambda: [({"queue": "celery"}, queue_depth())])
+metrics.add_collector("notification_queue_depth", "gauge", "Telegram notifications not yet delivered.",
+                      lambda: [({}, notifications.pending())])
+metrics.add_collector("calendar_sync_age_seconds", "gauge", "Seconds since the last calendar sync, by master.",
+                      lambda: [({"master": master.id}, time.time() - master.store.last_sync)
+                               for master in masters.get_masters() if master.store.last_sync])
+metrics.add_collector("ledger_bookings", "gauge", "Booking ledger rows by Google sync state.",
+                      lambda: [({"sync_state": state}, count) for state, count in get_ledger().counts().items()])
+metrics.add_collector("slot_stream_subscribers", "gauge", "Connected /api/slots/stream clients.",
+                      lambda: [({}, get_feed().subscriber_count)])
+
+@app.on_event("startup")
+def start_event_sync():
+    # Держим локальные копии календарей мастеров свежими: Google опрашивается только за дельтами.
+    # С push-уведомлениями дельта приходит по вебхуку, а опрос остаётся редкой страховкой
+    watch = calendar_watch.get_manager()
+    for master in masters.get_masters():
+        if watch.enabled:
+            master.store.start_background_refresh(calendar_watch.FALLBACK_SYNC_INTERVAL)
+        else:
+            master.store.start_background_refresh()
+    watch.start()
+    threading.Thread(target=_warm_availability, name="availability-warmup", daemon=True).start()
+    sweeper.start()
+    # Перенос журнала записей в Google и сверка с календарями
+    mirror.start()
+
+def _warm_availability():
+    # Строим индекс свободных слотов на весь горизонт записи заранее
+    try:
+        masters.ensure_ready()
+        today = datetime.now(MOSCOW_TZ).date()
+        masters.get_availability().warm(today + timedelta(days=offset) for offset in range(HORIZON_DAYS + 1))
+    except Exception as e:
+        logger.error("Не удалось прогреть индекс слотов: %s", e)
+
+@app.on_event("startup")
+async def start_slot_feed():
+    # Одна лента изменений слотов на процесс, раздаётся всем SSE-подписчикам
+    get_feed().start()
+
+@app.on_event("shutdown")
+def stop_event_sync():
+    get_feed().stop()
+    for master in masters.get_masters():
+        master.store.stop_background_refresh()
+    sweeper.stop()
+    mirror.stop()
+    calendar_watch.get_manager().stop()
+    shutdown_blocking_io()
+    # Дать очереди уведомлений дослать накопленное
+    notifications.flush(timeout=5)
+
+@app.exception_handler(CalendarUnavailable)
+async def calendar_unavailable(request: Request, exc: CalendarUnavailable):
+    # Google не ответил вовремя или предохранитель открыт: клиент повторит позже, а не ждёт таймаута
+    logger.warning("Google Calendar недоступен: %s", exc, extra={"path": request.url.path})
+    return JSONResponse(status_code=503, content={"detail": "Календарь временно недоступен, попробуйте позже"},
+                        headers={"Retry-After": str(max(1, round(exc.retry_after)))})
+
+def _mark_stale(response: Response) -> Response:
+    # Данные из локальной копии, которую сейчас не удаётся обновить из Google
+    response.headers.update(resilience.stale_headers())
+    return response
+
 @app.get("/api/slots")
 async def slots(
+    request: Request,
     day: str = Query(..., example="2025-04-10"),
     massageType: str = Query("classic", description="Тип массажа"),
-    duration: int = Query(60, description="Длительность в минутах")
+    duration: Optional[int] = Query(None, ge=1, le=MAX_DURATION, description="Длительность в минутах; по умолчанию основная длительность услуги"),
+    masterId: Optional[str] = Query(None, description="Мастер; по умолчанию — любой свободный")
 ):
-    logger.info(f"🔍 [BACKEND] Slots request: day={day}, massageType={massageType}, duration={duration}")
     try:
         date_obj = datetime.strptime(day, "%Y-%m-%d")
-        logger.info(f"🔍 [BACKEND] Parsed date: {date_obj}")
     except ValueError:
-        logger.error(f"🔍 [BACKEND] Invalid date format: {day}")
+        logger.warning("Неверный формат даты: %s", day)
         raise HTTPException(status_code=400, detail="Invalid date format")
+    _require_master(masterId)
+    massage = catalog.get(massageType)
+    duration = duration or (massage.default_duration if massage else 60)
     
-    logger.info(f"🔍 [BACKEND] Calling get_available_slots...")
-    slots = get_available_slots(date_obj, massageType, duration)
-    logger.info(f"🔍 [BACKEND] Available slots count: {len(slots)}")
-    logger.info(f"🔍 [BACKEND] Available slots: {slots}")
-    return slots
+    async def compute():
+        slots = await run_blocking(get_available_slots, date_obj, massageType, duration, masterId)
+        logger.debug("Запрос слотов", extra=sampled(day=day, massage_type=massageType, duration=duration, slots=len(slots)))
+        return slots
+
+    # Список слотов зависит от дня, длительности и перерыва после сеанса этого типа массажа
+    key = (day, duration, get_rules().buffer_for(massageType), masterId)
+    return _mark_stale(await slots_cache.respond(request, key, _slots_etag(*key), compute, SLOTS_CACHE_CONTROL))
+
+@app.get("/api/slots/range")
+async def slots_range(
+    request: Request,
+    date_from: str = Query(..., alias="from", example="2025-04-10"),
+    date_to: str = Query(..., alias="to", example="2025-04-24"),
+    massageType: str = Query("classic", description="Тип массажа: от него зависит перерыв после сеанса"),
+    duration: Optional[int] = Query(None, ge=1, le=MAX_DURATION, description="Длительность в минутах; по умолчанию все длительности услуг"),
+    masterId: Optional[str] = Query(None, description="Мастер; по умолчанию — любой свободный")
+):
+    try:
+        start = datetime.strptime(date_from, "%Y-%m-%d")
+        end = datetime.strptime(date_to, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' must not be earlier than 'from'")
+    _require_master(masterId)
+    durations = [duration] if duration else KNOWN_DURATIONS
+
+    async def compute():
+        return {
+            "from": date_from,
+            "to": date_to,
+            "slots": await run_blocking(get_available_slots_range, start, end, durations, masterId, massageType),
+        }
+
+    key = ("range", date_from, date_to, duration, get_rules().buffer_for(massageType), masterId)
+    return _mark_stale(await slots_cache.respond(request, key, _slots_etag(*key), compute, SLOTS_CACHE_CONTROL))
+
+@app.get("/api/slots/stream")
+async def slots_stream(duration: Optional[int] = Query(None, ge=1, le=MAX_DURATION, description="Только изменения для этой длительности"),
+                       massageType: Optional[str] = Query(None, description="Только изменения с перерывом после сеанса этого типа массажа")):
+    # Server-Sent Events: клиент получает дельты слотов вместо периодического опроса /api/slots
+    buffer_minutes = get_rules().buffer_for(massageType) if massageType else None
+    return StreamingResponse(
+        event_stream(get_feed(), duration, buffer_minutes),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 class BookingRequest(BaseModel):
     name: str
     slot: str  # ISO format
     massageType: str = "classic"  # тип массажа
-    duration: int = 60  # длительность в минутах
+    duration: Optional[int] = None  # длительность в минутах; по умолчанию основная длительность услуги
     eventId: str = None  # ID события в Google Calendar
+    userId: Optional[str] = None  # Telegram id клиента, сохраняется в событии
+    masterId: Optional[str] = None  # мастер; без него запись уходит любому свободному
 
 @app.post("/api/book")
 async def book(request: BookingRequest = Body(...)):
-    success, event_id = book_slot(request.name, request.slot, request.massageType, request.duration)
+    # Запись в Google блокирующая, уводим её из event loop.
+    # Прошедшие записи удаляет периодический sweeper, а не отдельная задача на каждую запись
+    _require_master(request.masterId)
+    # Бронируется ровно та длительность, для которой считались слоты, — только из каталога услуг
+    massage = catalog.get(request.massageType)
+    duration = request.duration or (massage.default_duration if massage else 0)
+    error = catalog.validate(request.massageType, duration)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    success, event_id = await run_blocking(book_slot, request.name, request.slot, request.massageType, duration, request.userId, request.masterId)
     if not success:
         raise HTTPException(status_code=409, detail="Слот уже занят. Выберите другое время.")
-    # Планируем автоматическое удаление события через Celery
-    from tasks import delete_booking_task
-    import pytz
-    from datetime import datetime
-    massage_time = datetime.fromisoformat(request.slot)
-    moscow_tz = pytz.timezone("Europe/Moscow")
-    if massage_time.tzinfo is None:
-        massage_time = moscow_tz.localize(massage_time)
-    delete_booking_task.apply_async(
-        args=[event_id],
-        eta=massage_time
-    )
     return {"success": True, "eventId": event_id}
 
 @app.post("/api/cancel")
 async def cancel(request: BookingRequest = Body(...)):
     # eventId теперь может быть в теле запроса
     event_id = getattr(request, 'eventId', None) or (request.dict().get('eventId'))
-    success = cancel_slot(event_id, request.name, request.slot, request.massageType)
+    success = await run_blocking(cancel_slot, event_id, request.name, request.slot, request.massageType)
     if not success:
         raise HTTPException(status_code=404, detail="Событие не найдено или уже отменено")
     return {"success": True}
 
 @app.get("/api/records")
-async def get_records():
-    return get_all_bookings()
+async def get_records(request: Request, day: Optional[str] = Query(None, example="2025-04-10",
+                                                                   description="Только записи этого дня, включая прошедшие")):
+    try:
+        day_obj = datetime.strptime(day, "%Y-%m-%d").date() if day else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+
+    async def compute():
+        return await run_blocking(get_all_bookings, day_obj)
+
+    etag = make_etag("records", day, get_ledger().version, datetime.now(MOSCOW_TZ).strftime("%Y-%m-%dT%H:%M"))
+    return _mark_stale(await records_cache.respond(request, ("records", day), etag, compute, RECORDS_CACHE_CONTROL))
+
+@app.get("/api/catalog")
+async def get_catalog(response: Response):
+    # Каталог меняется только с выкладкой — клиенты и бот могут держать его в кэше
+    response.headers["Cache-Control"] = CATALOG_CACHE_CONTROL
+    return CATALOG
+
+@app.get("/api/masters")
+async def list_masters():
+    return [master.to_dict() for master in masters.get_masters()]
 
 @app.get("/api/user-bookings/{user_name}")
-async def get_user_records(user_name: str):
-    return get_user_bookings(user_name)
+async def get_user_records(response: Response, user_name: str,
+                           userId: Optional[str] = Query(None, description="Telegram id клиента")):
+    _mark_stale(response)
+    return await run_blocking(get_user_bookings, user_name, userId)
+
+@app.get("/api/admin/sweeper")
+async def sweeper_stats():
+    return sweeper.get_stats()
+
+@app.get("/api/admin/mirror")
+async def mirror_stats():
+    return await run_blocking(mirror.get_stats)
+
+@app.get("/api/admin/resilience")
+async def resilience_stats():
+    return resilience.get_stats()
+
+@app.post("/api/calendar/notifications")
+async def calendar_notification(request: Request):
+    """Вебхук push-уведомлений Google Calendar: отвечаем сразу, дельту подтянет фоновый поток."""
+    headers = request.headers
+    accepted = calendar_watch.get_manager().handle(
+        headers.get("X-Goog-Channel-ID", ""),
+        headers.get("X-Goog-Resource-ID", ""),
+        headers.get("X-Goog-Resource-State", ""),
+        headers.get("X-Goog-Channel-Token"),
+    )
+    if not accepted:
+        raise HTTPException(status_code=403, detail="Неверный токен канала уведомлений")
+    return Response(status_code=200)
+
+@app.get("/api/admin/watch")
+async def watch_stats():
+    watch = calendar_watch.get_manager()
+    return {
+        "enabled": watch.enabled,
+        "channels": [{"calendarId": channel.calendar_id, "id": channel.id,
+                      "expiresIn": round(channel.expiration - time.time())} for channel in watch.channels()],
+    }
+
+class BulkCancelRequest(BaseModel):
+    eventIds: List[str]
+
+@app.post("/api/admin/bulk-cancel")
+async def admin_bulk_cancel(request: BulkCancelRequest = Body(...)):
+    # До 50 удалений в одном HTTP-запросе к Google, с повтором упавших
+    return await run_blocking(bulk_cancel, request.eventIds)
+
+@app.post("/api/admin/migrate-events")
+async def admin_migrate_events():
+    return await run_blocking(migrate_legacy_bookings)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Опрос брокера Celery — сетевой вызов, поэтому рендер вне event loop
+    return PlainTextResponse(await run_blocking(metrics.render), media_type="text/plain; version=0.0.4")
 
 app.mount("/", StaticFiles(directory="static", html=True), name="static")
 
@@ -0,0 +1,156 @@
+"""Мастера салона и их календари.
+
+Каждый мастер ведёт свой Google-календарь; у каждого календаря своё
+локальное хранилище событий, индекс свободных слотов и брони. Список
+мастеров читается из JSON-файла ``MASTERS_FILE`` (по умолчанию
+``masters.json`` рядом с модулем)::
+
+    [
+      {"id": "anna", "name": "Анна", "calendarId": "anna@group.calendar.google.com"},
+      {"id": "oleg", "name": "Олег", "calendarId": "oleg@group.calendar.google.com"}
+    ]
+
+Без файла работает один мастер с календарём ``CALENDAR_ID`` — как раньше.
+
+Слоты «любого мастера» — объединение слотов всех календарей
+(``CombinedAvailability``). Синхронизация календарей идёт параллельно в
+общем пуле потоков, а в режиме ``AVAILABILITY_SOURCE=freebusy`` занятость
+всех мастеров приходит одним запросом FreeBusy, так что время ответа не
+растёт линейно с числом мастеров.
+"""
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date
+from typing import Callable, Dict, List, Optional, TypeVar, Union
+
+from availability import AvailabilityIndex, CombinedAvailability, get_index
+from calendar_client import CALENDAR_ID
+from event_store import EventStore, get_store
+from ledger import get_ledger
+from reservations import SlotReservations, get_reservations
+
+MASTERS_FILE = os.getenv("MASTERS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "masters.json"))
+SYNC_WORKERS = int(os.getenv("MASTERS_SYNC_WORKERS", "8"))
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class Master:
+    id: str
+    name: str
+    calendar_id: str
+
+    @property
+    def store(self) -> EventStore:
+        return get_store(self.calendar_id)
+
+    @property
+    def index(self) -> AvailabilityIndex:
+        return get_index(self.calendar_id)
+
+    @property
+    def reservations(self) -> SlotReservations:
+        return get_reservations(self.calendar_id)
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "name": self.name}
+
+
+def load_masters(path: str = MASTERS_FILE) -> List[Master]:
+    if not os.path.exists(path):
+        return [Master("default", "Мастер", CALENDAR_ID)]
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    masters = [Master(str(item["id"]), item.get("name") or str(item["id"]), item["calendarId"]) for item in items]
+    if not masters:
+        raise ValueError(f"В {path} не указано ни одного мастера")
+    if len({master.id for master in masters}) != len(masters):
+        raise ValueError(f"В {path} повторяются id мастеров")
+    return masters
+
+
+_masters: Optional[List[Master]] = None
+_combined: Optional[CombinedAvailability] = None
+_pool: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def get_masters() -> List[Master]:
+    global _masters
+    if _masters is None:
+        with _lock:
+            if _masters is None:
+                _masters = load_masters()
+    return _masters
+
+
+def get_master(master_id: Optional[str]) -> Optional[Master]:
+    """Мастер по id; без id — первый (основной) мастер."""
+    masters = get_masters()
+    if not master_id:
+        return masters[0]
+    return next((master for master in masters if master.id == master_id), None)
+
+
+def get_availability(master_id: Optional[str] = None) -> Union[AvailabilityIndex, CombinedAvailability]:
+    """Индекс слотов мастера или, без ``master_id``, объединённый по всем мастерам."""
+    global _combined
+    if master_id:
+        master = get_master(master_id)
+        if master is None:
+            raise KeyError(master_id)
+        return master.index
+    masters = get_masters()
+    if len(masters) == 1:
+        return masters[0].index
+    if _combined is None:
+        with _lock:
+            if _combined is None:
+                _combined = CombinedAvailability(master.index for master in masters)
+    return _combined
+
+
+def for_each(func: Callable[[Master], T], masters: Optional[List[Master]] = None) -> List[T]:
+    """Выполнить ``func`` для каждого мастера параллельно (по одному — без пула)."""
+    global _pool
+    masters = get_masters() if masters is None else masters
+    if len(masters) <= 1:
+        return [func(master) for master in masters]
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=SYNC_WORKERS, thread_name_prefix="masters")
+    # Потоки пула выполняют работу с приоритетом квоты Google (rate_limit) вызывающего
+    context = contextvars.copy_context()
+    return list(_pool.map(lambda master: context.copy().run(func, master), masters))
+
+
+def ensure_ready(masters: Optional[List[Master]] = None):
+    """Первая синхронизация календарей, которые ещё не загружены, — одновременно."""
+    for_each(lambda master: master.store.ensure_ready(), masters)
+
+
+def sync(masters: Optional[List[Master]] = None):
+    for_each(lambda master: master.store.sync(), masters)
+
+
+def by_load(day: date, masters: Optional[List[Master]] = None) -> List[Master]:
+    """Мастера в порядке возрастания числа событий в этот день — запись уходит менее занятому."""
+    masters = get_masters() if masters is None else masters
+    ledger = get_ledger()
+    return sorted(masters, key=lambda master: len(master.store.events_on(day))
+                  + len(ledger.unmirrored_busy(master.calendar_id, day)))
+
+
+def find_event(event_id: str) -> Optional[Master]:
+    """Мастер, в чьём календаре лежит событие (по локальным копиям)."""
+    return next((master for master in get_masters() if master.store.get(event_id)), None)
+
+
+def store_versions() -> Dict[str, int]:
+    return {master.id: master.store.version for master in get_masters()}
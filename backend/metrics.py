@@ -0,0 +1,164 @@
+"""Метрики процесса в текстовом формате Prometheus (``GET /metrics``).
+
+Счётчики и гистограммы живут в памяти процесса и обновляются из любых
+потоков: middleware FastAPI (запросы и их длительность), клиент Calendar
+API (каждый ``execute()`` с именем метода и статусом), отправка в Telegram.
+Значения, которые дешевле прочитать в момент опроса (попадания в кэши,
+глубина очереди Celery, подписчики SSE), собираются зарегистрированными
+коллбэками ``add_collector``.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(values: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in values.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    items = [f'{key}="{_escape(value)}"' for key, value in labels]
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_labels(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in values]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self._buckets = tuple(sorted(buckets))
+        # labels -> (счётчики по корзинам, сумма, количество)
+        self._values: Dict[Labels, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self._buckets), 0.0, 0)
+            for i, bound in enumerate(self._buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in values:
+            for bound, bucket_count in zip(self._buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', repr(bound)),))} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+_metrics: List[object] = []
+_collectors: List[Tuple[str, str, str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]]] = []
+
+
+def counter(name: str, documentation: str) -> Counter:
+    metric = Counter(name, documentation)
+    _metrics.append(metric)
+    return metric
+
+
+def histogram(name: str, documentation: str, buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, documentation, buckets)
+    _metrics.append(metric)
+    return metric
+
+
+def add_collector(name: str, kind: str, documentation: str,
+                  collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+    """Метрика, значения которой считаются при каждом опросе: ``collect() -> [(labels, value)]``."""
+    _collectors.append((name, kind, documentation, collect))
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _metrics:
+        lines += metric.render()
+    for name, kind, documentation, collect in _collectors:
+        try:
+            samples = list(collect())
+        except Exception:
+            continue
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+        lines += [f"{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+
+# --- общие метрики ---------------------------------------------------------
+
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests by route and status.")
+HTTP_LATENCY = histogram("http_request_duration_seconds", "HTTP handler latency by route.")
+GOOGLE_CALLS = counter("google_api_calls_total", "Google Calendar API calls by method and outcome.")
+GOOGLE_LATENCY = histogram("google_api_call_duration_seconds", "Google Calendar API call latency by method.")
+TELEGRAM_CALLS = counter("telegram_api_calls_total", "Telegram Bot API calls by method and outcome.")
+TELEGRAM_LATENCY = histogram("telegram_api_call_duration_seconds", "Telegram Bot API call latency by method.")
+
+
+def _status_of(error: Exception) -> str:
+    status = getattr(getattr(error, "resp", None), "status", None)
+    return str(status) if status is not None else "error"
+
+
+@contextmanager
+def google_call(method: Optional[str]):
+    """Засечь один вызов Calendar API (``execute()`` запроса или пакета)."""
+    method = method or "unknown"
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception as e:
+        outcome = _status_of(e)
+        raise
+    finally:
+        GOOGLE_LATENCY.observe(time.perf_counter() - started, method=method)
+        GOOGLE_CALLS.inc(method=method, outcome=outcome)
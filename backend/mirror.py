@@ -0,0 +1,265 @@
+"""Перенос журнала записей (``ledger``) в Google Calendar и сверка с ним.
+
+Фоновый поток забирает строки журнала, ожидающие синхронизации: создаёт
+события новых записей в календаре мастера и пакетно удаляет события
+отменённых. Неудачная попытка повторяется с экспоненциальной задержкой —
+Google может быть недоступен сколько угодно, запись и отмена от этого не
+зависят. Поток просыпается сразу после каждой записи или отмены (``wake``)
+и не реже чем раз в ``MIRROR_INTERVAL`` секунд.
+
+Раз в ``RECONCILE_INTERVAL`` секунд (и сразу после push-уведомления об
+изменении календаря, см. ``calendar_watch``) журнал сверяется с календарями:
+записи, созданные в Google вне журнала (до его появления), импортируются;
+события, удалённые или перенесённые мастером прямо в календаре, отменяют
+или переносят запись в журнале. Событие, созданное перед падением
+процесса, но не отмеченное в журнале, находится по ``ledgerId`` в
+``extendedProperties`` и не создаётся второй раз.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import catalog
+import masters
+from calendar_bulk import bulk_delete
+from calendar_utils import create_calendar_event
+from event_store import LOOKBACK_DAYS, MOSCOW_TZ, booking_metadata, booking_owner, get_store
+from ledger import Booking, get_ledger
+from rate_limit import BOOKING, CLEANUP, priority
+from sweeper import is_app_booking
+
+logger = logging.getLogger(__name__)
+
+MIRROR_INTERVAL = float(os.getenv("MIRROR_INTERVAL", "5"))
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "300"))
+BATCH_SIZE = 100
+
+MIRROR_STATS: Dict[str, Optional[float]] = {
+    "created_total": 0,
+    "deleted_total": 0,
+    "failed_total": 0,
+    "imported_total": 0,
+    "removed_total": 0,
+    "moved_total": 0,
+    "last_run_at": None,
+    "last_reconcile_at": None,
+}
+_stats_lock = threading.Lock()
+_stop = threading.Event()
+_wake = threading.Event()
+_reconcile_requested = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            MIRROR_STATS[key] += value
+
+
+def wake():
+    """Перенести изменения журнала в Google, не дожидаясь очередного интервала."""
+    _wake.set()
+
+
+def request_reconcile():
+    """Сверить журнал с календарями при ближайшем пробуждении (календарь изменили в Google)."""
+    _reconcile_requested.set()
+    _wake.set()
+
+
+def flush(timeout: float = 30.0) -> bool:
+    """Дождаться, пока журнал целиком перенесён в Google (для бенчмарков и остановки)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        counts = get_ledger().counts()
+        if not any(count for state, count in counts.items() if state != "synced"):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        wake()
+        time.sleep(0.05)
+
+
+def _client_name(event: dict) -> str:
+    """Имя клиента как его записали (``booking_owner`` отдаёт нормализованный ключ)."""
+    name = booking_metadata(event).get("userName")
+    if not name:
+        summary = event.get("summary", "")
+        name = summary.rsplit(" - ", 1)[-1].replace("Запись на массаж — ", "")
+    return name.strip()
+
+
+def _find_created(store, booking: Booking) -> Optional[dict]:
+    for _start, _end, event in store.events_on(datetime.fromisoformat(booking["start"]).date()):
+        if booking_metadata(event).get("ledgerId") == booking["id"]:
+            return event
+    return None
+
+
+def _create(booking: Booking):
+    store = get_store(booking["calendar_id"])
+    event = _find_created(store, booking)
+    if event is None:
+        massage_name = catalog.name_of(booking["massage_type"])
+        event = create_calendar_event(
+            name=booking["user_name"],
+            start_time=datetime.fromisoformat(booking["start"]),
+            end_time=datetime.fromisoformat(booking["end"]),
+            massage_type=massage_name,
+            description=f"Клиент: {booking['user_name']}\nТип: {massage_name}\nДлительность: {booking['duration']} мин",
+            metadata={
+                "userName": booking["user_name"],
+                "userId": booking["user_id"],
+                "massageType": booking["massage_type"],
+                "duration": booking["duration"],
+                "masterId": booking["master_id"],
+                "ledgerId": booking["id"],
+            },
+            calendar_id=booking["calendar_id"],
+        )
+    store.upsert(event)
+    get_ledger().mark_created(booking["id"], event["id"])
+
+
+@priority(BOOKING)
+def push_pending() -> Dict[str, int]:
+    """Одна порция: создать события новых записей и удалить события отменённых."""
+    ledger = get_ledger()
+    due = ledger.due(BATCH_SIZE)
+    result = {"created": 0, "deleted": 0, "failed": 0}
+
+    for booking in due:
+        if booking["sync_state"] != "pending_create":
+            continue
+        if booking["status"] != "active":
+            # Отменена раньше, чем дошла до Google, — удалять нечего
+            ledger.mark_synced(booking["id"])
+            continue
+        try:
+            _create(booking)
+            result["created"] += 1
+        except Exception as e:
+            result["failed"] += 1
+            ledger.mark_failed(booking["id"], str(e))
+
+    deletes: Dict[str, List[Booking]] = {}
+    for booking in due:
+        if booking["sync_state"] == "pending_delete":
+            deletes.setdefault(booking["calendar_id"], []).append(booking)
+    for calendar_id, bookings in deletes.items():
+        by_event = {booking["event_id"]: booking for booking in bookings}
+        try:
+            results = bulk_delete(list(by_event), calendar_id)
+        except Exception as e:
+            results = {event_id: {"ok": False, "error": str(e)} for event_id in by_event}
+        for event_id, item in results.items():
+            if item["ok"]:
+                get_store(calendar_id).remove(event_id)
+                ledger.mark_synced(by_event[event_id]["id"])
+                result["deleted"] += 1
+            else:
+                ledger.mark_failed(by_event[event_id]["id"], str(item["error"]))
+                result["failed"] += 1
+
+    if result["failed"]:
+        logger.warning("Не удалось перенести в Google часть записей", extra={"result": result})
+    _count(created_total=result["created"], deleted_total=result["deleted"], failed_total=result["failed"])
+    with _stats_lock:
+        MIRROR_STATS["last_run_at"] = time.time()
+    if len(due) == BATCH_SIZE:
+        wake()
+    return result
+
+
+@priority(CLEANUP)
+def reconcile(sync: bool = True) -> Dict[str, int]:
+    """Сверить журнал с календарями всех мастеров (``sync=False`` — по уже подтянутым локальным копиям)."""
+    ledger = get_ledger()
+    if sync:
+        masters.sync()
+    now = datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+    result = {"imported": 0, "adopted": 0, "removed": 0, "moved": 0}
+
+    for master in masters.get_masters():
+        store = master.store
+        for start, end, event in store.events_between(now - timedelta(days=LOOKBACK_DAYS), now + timedelta(days=365)):
+            if not is_app_booking(event) or not booking_owner(event):
+                continue
+            metadata = booking_metadata(event)
+            booking = ledger.get(event["id"])
+            if booking is None:
+                pending = ledger.get(metadata["ledgerId"]) if metadata.get("ledgerId") else None
+                if pending is not None:
+                    if not pending["event_id"]:
+                        ledger.mark_created(pending["id"], event["id"])
+                        result["adopted"] += 1
+                    continue
+                if metadata.get("massageType"):
+                    massage_type, duration = metadata["massageType"], int(metadata.get("duration") or 60)
+                else:
+                    massage_type, duration = catalog.parse_description(event.get("description", ""))
+                if ledger.import_event(event["id"], master.id, store.calendar_id, start, _client_name(event),
+                                       metadata.get("userId"), massage_type, duration):
+                    result["imported"] += 1
+            elif (booking["status"] == "active" and booking["sync_state"] == "synced"
+                  and booking["start"] != start.isoformat()):
+                ledger.move(booking["id"], start)
+                result["moved"] += 1
+
+        # Событие пропало из календаря — его удалил мастер; в журнале запись тоже больше не действует
+        for booking in ledger.synced_since(store.calendar_id, now):
+            if store.get(booking["event_id"]) is None:
+                ledger.mark_removed(booking["id"])
+                result["removed"] += 1
+
+    _count(imported_total=result["imported"], removed_total=result["removed"], moved_total=result["moved"])
+    with _stats_lock:
+        MIRROR_STATS["last_reconcile_at"] = time.time()
+    if any(result.values()):
+        logger.info("Сверка журнала с Google", extra=result)
+    return result
+
+
+def get_stats() -> Dict[str, object]:
+    with _stats_lock:
+        stats: Dict[str, object] = dict(MIRROR_STATS)
+    stats["ledger"] = get_ledger().counts()
+    return stats
+
+
+def start(interval: float = MIRROR_INTERVAL, reconcile_interval: float = RECONCILE_INTERVAL):
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, args=(interval, reconcile_interval), name="ledger-mirror", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+    _wake.set()
+
+
+def _loop(interval: float, reconcile_interval: float):
+    last_reconcile = None
+    while not _stop.is_set():
+        _wake.clear()
+        try:
+            push_pending()
+        except Exception:
+            logger.exception("Ошибка переноса журнала в Google")
+        due = last_reconcile is None or time.monotonic() - last_reconcile >= reconcile_interval
+        if due or _reconcile_requested.is_set():
+            _reconcile_requested.clear()
+            try:
+                # По уведомлению календарь уже синхронизирован — повторно Google не опрашиваем
+                reconcile(sync=due)
+            except Exception:
+                logger.exception("Ошибка сверки журнала с Google")
+            last_reconcile = time.monotonic()
+        _wake.wait(interval)
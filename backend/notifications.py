@@ -1,37 +1,162 @@
-import requests
+"""Уведомления администратору в Telegram.
+
+``notify_admin``/``notify_admin_cancel`` только ставят сообщение в очередь и
+сразу возвращаются — запись/отмена не ждут ответа Telegram. Фоновый поток
+забирает сообщения, склеивает пачку, пришедшую за ``NOTIFY_COALESCE_WINDOW``
+секунд, в один дайджест и отправляет через общий ``requests.Session`` с
+повторами и экспоненциальной задержкой (с учётом ``retry_after`` от Telegram).
+"""
+import html
+import logging
 import os
+import re
+import queue
+import threading
+import time
+from typing import List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import TELEGRAM_CALLS, TELEGRAM_LATENCY
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", "2"))
+MAX_BATCH = 20
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+logger = logging.getLogger(__name__)
+
+_queue: "queue.Queue[str]" = queue.Queue()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        _session = session
+    return _session
+
 
 def notify_admin(name: str, slot: str):
-    message = f"📅 <b>Новая запись</b>\n👤 {name}\n🕒 {slot}"
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": ADMIN_CHAT_ID,
-        "text": message,
-        "parse_mode": "HTML"
-    }
+    # Имя вводит клиент: «<» или «&» в нём иначе ломают HTML-разметку всего сообщения
+    message = f"📅 <b>Новая запись</b>\n👤 {html.escape(name)}\n🕒 {html.escape(slot)}"
+    return _enqueue(message)
 
-    try:
-        response = requests.post(url, json=payload, timeout=5)
-        return response.ok
-    except Exception as e:
-        print(f"[notify_admin] Ошибка: {e}")
-        return False
 
 def notify_admin_cancel(name: str, slot: str):
-    message = f"❌ <b>Запись отменена</b>\n👤 {name}\n🕒 {slot}"
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    message = f"❌ <b>Запись отменена</b>\n👤 {html.escape(name)}\n🕒 {html.escape(slot)}"
+    return _enqueue(message)
+
+
+def _enqueue(message: str) -> bool:
+    _ensure_worker()
+    _queue.put(message)
+    return True
+
+
+def _ensure_worker():
+    global _worker
+    if _worker is not None and _worker.is_alive():
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_run, name="telegram-notifier", daemon=True)
+            _worker.start()
+
+
+def _run():
+    while True:
+        batch = [_queue.get()]
+        # Собираем всё, что пришло за окно склейки, чтобы всплеск записей дал одно сообщение
+        deadline = time.monotonic() + COALESCE_WINDOW
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        try:
+            for text in _compose(batch):
+                _deliver(text)
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+def _compose(batch: List[str]) -> List[str]:
+    """Дайджест пачки; если он длиннее лимита Telegram — несколько сообщений, разрезанных по строкам.
+
+    Резать текст посередине нельзя: обрезанный тег или сущность HTML Telegram отклонит целиком.
+    """
+    text = batch[0] if len(batch) == 1 else f"🗂 <b>Изменения в записи ({len(batch)})</b>\n\n" + "\n\n".join(batch)
+    messages: List[str] = []
+    current = ""
+    for line in text.split("\n"):
+        if len(line) > TELEGRAM_MESSAGE_LIMIT:
+            # Строка длиннее лимита бывает только у текста клиента (без тегов): режем, не разрывая сущность
+            line = re.sub(r"&[^;\s]*$", "", line[:TELEGRAM_MESSAGE_LIMIT])
+        if current and len(current) + 1 + len(line) > TELEGRAM_MESSAGE_LIMIT:
+            messages.append(current.strip("\n"))
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current.strip("\n"):
+        messages.append(current.strip("\n"))
+    return messages
+
+
+def _deliver(text: str) -> bool:
+    url = f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/sendMessage"
     payload = {
         "chat_id": ADMIN_CHAT_ID,
-        "text": message,
+        "text": text,
         "parse_mode": "HTML"
     }
 
-    try:
-        response = requests.post(url, json=payload, timeout=5)
-        return response.ok
-    except Exception as e:
-        print(f"[notify_admin_cancel] Ошибка: {e}")
-        return False
\ No newline at end of file
+    for attempt in range(MAX_ATTEMPTS):
+        delay = BACKOFF_BASE * (2 ** attempt)
+        try:
+            with TELEGRAM_LATENCY.time(method="sendMessage"):
+                response = _get_session().post(url, json=payload, timeout=5)
+            TELEGRAM_CALLS.inc(method="sendMessage", outcome="ok" if response.ok else str(response.status_code))
+            if response.ok:
+                return True
+            if response.status_code == 429:
+                retry_after = response.json().get("parameters", {}).get("retry_after")
+                delay = max(delay, float(retry_after or 0))
+            elif response.status_code < 500:
+                logger.error("Telegram отклонил сообщение: %s %s", response.status_code, response.text)
+                return False
+        except Exception as e:
+            TELEGRAM_CALLS.inc(method="sendMessage", outcome="error")
+            logger.warning("Ошибка отправки (попытка %d): %s", attempt + 1, e)
+        time.sleep(delay)
+    logger.error("Сообщение не доставлено после всех попыток")
+    return False
+
+
+def pending() -> int:
+    """Сколько сообщений ещё не отправлено (в очереди и в текущей пачке)."""
+    return _queue.unfinished_tasks
+
+
+def flush(timeout: float = 10.0) -> bool:
+    """Дождаться отправки всех сообщений из очереди (например, при остановке)."""
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+    return True
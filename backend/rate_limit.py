@@ -0,0 +1,179 @@
+"""Общая квота Calendar API с приоритетами.
+
+Все вызовы Google из процесса (синхронизация календарей для слотов,
+перенос записей журнала, очистка прошедших записей, сверка, Celery-задачи)
+расходуют одну квоту проекта. Раньше они шли вперемешку, и всплеск фоновой
+работы получал 403 ``rateLimitExceeded`` наравне с записью клиента.
+
+Здесь перед каждым HTTP-запросом к Google берётся токен из общего ведра
+(``GOOGLE_QPS`` токенов в секунду, запас ``GOOGLE_BURST``). Пока кто-то с
+более высоким приоритетом ждёт токен, более низкие не получают ни одного,
+а ``cleanup`` не трогает последние ``GOOGLE_CLEANUP_RESERVE`` токенов —
+запись клиента не встаёт в очередь за фоновой работой. Приоритеты:
+
+- ``booking`` — запись и отмена (перенос журнала в Google);
+- ``read`` — чтение для слотов и записей (по умолчанию);
+- ``cleanup`` — очистка, сверка, миграции, продление каналов.
+
+Приоритет задаётся для текущего потока или задачи ``with priority(...)``.
+Ответ 429 или 403 ``rateLimitExceeded`` повторяется с экспоненциальной
+задержкой (или через ``Retry-After``, если Google его прислал, — тогда
+паузу выдерживают все вызовы процесса).
+"""
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Iterator, Optional, TypeVar
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QPS = float(os.getenv("GOOGLE_QPS", "10"))
+BURST = float(os.getenv("GOOGLE_BURST", "20"))
+CLEANUP_RESERVE = float(os.getenv("GOOGLE_CLEANUP_RESERVE", "5"))
+MAX_RETRIES = int(os.getenv("GOOGLE_RATE_LIMIT_RETRIES", "4"))
+BACKOFF_BASE = 0.5
+MAX_BACKOFF = 32.0
+
+BOOKING, READ, CLEANUP = "booking", "read", "cleanup"
+LEVELS = {BOOKING: 0, READ: 1, CLEANUP: 2}
+
+THROTTLED = metrics.counter("google_throttled_total",
+                            "Calendar API calls delayed by the local token bucket or rate limited by Google, by priority.")
+WAIT = metrics.histogram("google_throttle_wait_seconds", "Time spent waiting for a Calendar API token, by priority.")
+
+_priority: ContextVar[str] = ContextVar("google_priority", default=READ)
+
+T = TypeVar("T")
+
+
+@contextmanager
+def priority(name: str) -> Iterator[None]:
+    """Вызовы Google внутри блока идут с приоритетом ``name``."""
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+class TokenBucket:
+    def __init__(self, rate: float = QPS, burst: float = BURST, reserve: float = CLEANUP_RESERVE):
+        self.rate = rate
+        self.burst = burst
+        self.reserve = min(reserve, burst - 1)
+        self._cond = threading.Condition()
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting = [0] * len(LEVELS)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, name: str = READ, tokens: float = 1.0) -> float:
+        """Взять ``tokens`` токенов, дождавшись своей очереди. Возвращает время ожидания."""
+        level = LEVELS[name]
+        floor = self.reserve if name == CLEANUP else 0.0
+        # Пачка больше ведра ждёт полного ведра, а не бесконечно
+        tokens = min(tokens, self.burst - floor)
+        started = time.monotonic()
+        with self._cond:
+            self._waiting[level] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    higher_waiting = any(self._waiting[:level])
+                    if not higher_waiting and now >= self._paused_until and self._tokens - tokens >= floor:
+                        self._tokens -= tokens
+                        return now - started
+                    if higher_waiting:
+                        delay = 0.05
+                    else:
+                        delay = max(self._paused_until - now, (tokens + floor - self._tokens) / self.rate)
+                    self._cond.wait(min(max(delay, 0.001), 1.0))
+            finally:
+                self._waiting[level] -= 1
+                self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """Google попросил подождать (``Retry-After``): новых вызовов нет ни у кого."""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def tokens(self) -> float:
+        with self._cond:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+BUCKET = TokenBucket()
+
+
+def take(tokens: float = 1.0):
+    """Дождаться токенов на очередной запрос к Google с приоритетом текущего потока."""
+    name = current_priority()
+    waited = BUCKET.acquire(name, tokens)
+    if waited > 0.001:
+        THROTTLED.inc(priority=name, reason="bucket")
+        WAIT.observe(waited, priority=name)
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status == 429:
+        return True
+    # Google отвечает 403 и на превышение квоты — такие ошибки временные
+    return status == 403 and "ateLimitExceeded" in str(error)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Значение ``Retry-After`` из ответа Google в секундах, если оно есть."""
+    resp = getattr(error, "resp", None)
+    value = resp.get("retry-after") if hasattr(resp, "get") else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(error: BaseException, attempt: int) -> float:
+    delay = retry_after(error)
+    if delay is not None:
+        BUCKET.pause(delay)
+        return delay
+    return min(MAX_BACKOFF, BACKOFF_BASE * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+
+def call(func: Callable[[], T], method: Optional[str] = None) -> T:
+    """Повторять запрос к Google при 429/403 rateLimitExceeded.
+
+    Токен на каждую попытку берёт сам ``func`` (через ``resilience.calendar_call``).
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return func()
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == MAX_RETRIES:
+                raise
+            delay = backoff_delay(e, attempt)
+            THROTTLED.inc(priority=current_priority(), reason="rate_limited")
+            logger.info("Google ограничил частоту запросов, повтор через %.1f с", delay,
+                        extra={"method": method, "attempt": attempt + 1})
+            time.sleep(delay)
+
+
+metrics.add_collector("google_rate_tokens", "gauge", "Calendar API tokens currently available in the local bucket.",
+                      lambda: [({}, round(BUCKET.tokens, 2))])
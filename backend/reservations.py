@@ -0,0 +1,79 @@
+"""Локальные брони слотов на время записи.
+
+``book_slot`` раньше делал check-then-insert: два параллельных запроса на
+один слот оба проходили проверку и создавали два события. Теперь проверка
+и постановка брони выполняются атомарно под коротким локальным замком.
+Пересекающиеся записи отсекаются сразу, непересекающиеся (даже в тот же
+день) идут параллельно. Бронь снимается сразу после ``ledger.add``: строка
+журнала, ещё не перенесённая в Google, уже входит в занятость индекса
+доступности (``busy_provider``), а после переноса время держит событие
+в ``EventStore``.
+
+Замок действует в пределах процесса: backend запускается одним воркером
+uvicorn (см. Dockerfile).
+"""
+import itertools
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+from availability import BUFFER_MINUTES
+
+Hold = Tuple[datetime, datetime]
+
+
+class SlotReservations:
+    def __init__(self, is_free: Callable[[datetime, int], bool]):
+        self._is_free = is_free
+        self._lock = threading.Lock()
+        self._holds: Dict[date, Dict[int, Hold]] = {}
+        self._ids = itertools.count(1)
+
+    def _conflicts(self, start: datetime, end: datetime) -> bool:
+        buffer = timedelta(minutes=BUFFER_MINUTES)
+        for hold_start, hold_end in self._holds.get(start.date(), {}).values():
+            # Та же логика, что и для событий календаря: бронь — сеанс со своим перерывом, и между
+            # соседними сеансами (в любом порядке) ещё общий буфер
+            if start < hold_end + buffer and end + buffer > hold_start:
+                return True
+        return False
+
+    @contextmanager
+    def hold(self, start: datetime, duration_minutes: int, buffer_minutes: int = BUFFER_MINUTES) -> Iterator[bool]:
+        """Забронировать сеанс с буфером после него. Отдаёт False, если время занято событием или чужой бронью."""
+        end = start + timedelta(minutes=duration_minutes + buffer_minutes)
+        with self._lock:
+            if self._conflicts(start, end) or not self._is_free(start, duration_minutes, buffer_minutes):
+                acquired = None
+            else:
+                acquired = next(self._ids)
+                self._holds.setdefault(start.date(), {})[acquired] = (start, end)
+        try:
+            yield acquired is not None
+        finally:
+            if acquired is not None:
+                with self._lock:
+                    day_holds = self._holds.get(start.date(), {})
+                    day_holds.pop(acquired, None)
+                    if not day_holds:
+                        self._holds.pop(start.date(), None)
+
+
+_reservations: Dict[str, SlotReservations] = {}
+_reservations_lock = threading.Lock()
+
+
+def get_reservations(calendar_id: Optional[str] = None) -> SlotReservations:
+    """Брони календаря (по умолчанию основного) поверх его индекса слотов."""
+    from availability import get_index
+    from event_store import get_store
+
+    # Ключ — настоящий id календаря, чтобы None и CALENDAR_ID делили одни брони
+    calendar_id = get_store(calendar_id).calendar_id
+    index = get_index(calendar_id)
+    with _reservations_lock:
+        reservations = _reservations.get(calendar_id)
+        if reservations is None:
+            reservations = _reservations[calendar_id] = SlotReservations(index.is_free)
+    return reservations
@@ -0,0 +1,214 @@
+"""Работа при медленном или недоступном Google Calendar.
+
+Три механизма:
+
+- **Предохранитель** (``CircuitBreaker``) на каждом вызове Calendar API:
+  после ``GOOGLE_BREAKER_FAILURES`` сбоев подряд (таймаут, обрыв, 5xx)
+  вызовы ``GOOGLE_BREAKER_OPEN_SECONDS`` секунд сразу отклоняются
+  ``CircuitOpenError``, не дожидаясь таймаута. Затем один пробный вызов
+  решает, закрыть предохранитель или открыть снова.
+- **Срок ответа** (``call_with_timeout``): чтение на пути запроса ждёт
+  Google не дольше ``CALENDAR_READ_TIMEOUT`` секунд и отвечает 503 с
+  ``Retry-After`` вместо зависания. Начатая синхронизация доходит до конца
+  в фоне, и её результат достаётся следующим запросам.
+- **Устаревшие данные** (``Freshness``): локальные копии календарей и кэш
+  FreeBusy продолжают отдаваться, пока Google недоступен, а фоновые потоки
+  пытаются их обновить. Ответ с такими данными помечается заголовками
+  ``X-Calendar-Stale`` и ``X-Calendar-Age`` (секунды с последнего удачного
+  обновления).
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import metrics
+import rate_limit
+from metrics import google_call
+
+logger = logging.getLogger(__name__)
+
+FAILURE_THRESHOLD = int(os.getenv("GOOGLE_BREAKER_FAILURES", "5"))
+OPEN_SECONDS = float(os.getenv("GOOGLE_BREAKER_OPEN_SECONDS", "30"))
+READ_TIMEOUT = float(os.getenv("CALENDAR_READ_TIMEOUT", "3"))
+DEADLINE_WORKERS = 8
+
+REJECTED = metrics.counter("google_circuit_rejected_total",
+                           "Calendar API calls rejected without a request while the circuit breaker is open.")
+
+
+class CalendarUnavailable(Exception):
+    """Google не ответил вовремя или недоступен; ответить клиенту 503."""
+
+    def __init__(self, message: str, retry_after: float = OPEN_SECONDS):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(CalendarUnavailable):
+    pass
+
+
+# Таймаут сокета, обрыв соединения, ошибка DNS (TimeoutError и ConnectionError — подклассы OSError),
+# а также сетевые ошибки httplib2 и обновления токена google-auth
+NETWORK_ERRORS: Tuple[Type[BaseException], ...] = (OSError,)
+try:
+    from httplib2 import HttpLib2Error
+    NETWORK_ERRORS += (HttpLib2Error,)
+except ImportError:  # fake-режим без google-библиотек
+    pass
+try:
+    from google.auth.exceptions import TransportError
+    NETWORK_ERRORS += (TransportError,)
+except ImportError:
+    pass
+
+
+def is_failure(error: BaseException) -> bool:
+    """Сбой Google: сеть или ответ 5xx. Ответы 4xx и ошибки в нашем коде сбоем не считаются."""
+    if isinstance(error, (CalendarUnavailable, *NETWORK_ERRORS)):
+        return True
+    status = getattr(getattr(error, "resp", None), "status", None)
+    # Превышение квоты (429/403) — Google работает; им занимается rate_limit
+    return status is not None and int(status) >= 500
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, open_seconds: float = OPEN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.open_seconds - time.monotonic()
+            if remaining <= 0 and not self._probing:
+                # Пропускаем один пробный вызов; остальные ждут его результата за предохранителем
+                self.state = self.HALF_OPEN
+                self._probing = True
+                return
+        REJECTED.inc()
+        raise CircuitOpenError("Google Calendar недоступен", retry_after=max(1.0, remaining))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Google Calendar снова отвечает, предохранитель закрыт")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning("Google Calendar не отвечает, предохранитель открыт",
+                                   extra={"failures": self.failures, "open_seconds": self.open_seconds})
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+BREAKER = CircuitBreaker()
+
+
+@contextmanager
+def calendar_call(method: Optional[str], tokens: float = 1.0):
+    """Один HTTP-запрос к Calendar API: предохранитель, квота ``rate_limit`` и метрики ``google_call``."""
+    BREAKER.before_call()
+    rate_limit.take(tokens)
+    try:
+        with google_call(method):
+            yield
+    except Exception as e:
+        if is_failure(e):
+            BREAKER.record_failure()
+        else:
+            BREAKER.record_success()
+        raise
+    BREAKER.record_success()
+
+
+_deadline_pool = ThreadPoolExecutor(max_workers=DEADLINE_WORKERS, thread_name_prefix="calendar-deadline")
+
+
+def call_with_timeout(func: Callable[..., Any], *args, timeout: float = READ_TIMEOUT, **kwargs) -> Any:
+    """Выполнить чтение, ожидая не дольше ``timeout``; сбои Google превращаются в ``CalendarUnavailable``."""
+    future = _deadline_pool.submit(contextvars.copy_context().run, func, *args, **kwargs)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        raise CalendarUnavailable(f"Google Calendar не ответил за {timeout:g} с", retry_after=timeout) from None
+    except CalendarUnavailable:
+        raise
+    except Exception as e:
+        if is_failure(e):
+            raise CalendarUnavailable(f"Google Calendar недоступен: {e}") from e
+        raise
+
+
+class Freshness:
+    """Когда данные источника последний раз удалось обновить и не падает ли обновление сейчас."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.updated_at: Optional[float] = None
+        self.failing_since: Optional[float] = None
+        with _sources_lock:
+            _sources.append(self)
+
+    def ok(self):
+        self.updated_at = time.time()
+        self.failing_since = None
+
+    def failed(self):
+        if self.failing_since is None:
+            self.failing_since = time.time()
+
+    def stale_for(self) -> Optional[float]:
+        """Возраст данных, если последнее обновление не удалось, иначе None."""
+        failing_since = self.failing_since
+        if failing_since is None:
+            return None
+        return time.time() - (self.updated_at or failing_since)
+
+
+_sources: List[Freshness] = []
+_sources_lock = threading.Lock()
+
+
+def stale_for() -> Optional[float]:
+    """Возраст самых старых данных среди источников, которые сейчас не обновляются."""
+    with _sources_lock:
+        ages = [age for age in (source.stale_for() for source in _sources) if age is not None]
+    return max(ages) if ages else None
+
+
+def stale_headers() -> Dict[str, str]:
+    age = stale_for()
+    if age is None:
+        return {}
+    return {"X-Calendar-Stale": "true", "X-Calendar-Age": str(int(age)), "Cache-Control": "no-cache"}
+
+
+def get_stats() -> Dict[str, object]:
+    with _sources_lock:
+        stale = {source.name: round(age) for source in _sources if (age := source.stale_for()) is not None}
+    return {"breaker": BREAKER.state, "consecutiveFailures": BREAKER.failures, "stale": stale}
+
+
+metrics.add_collector("google_circuit_open", "gauge", "1 while the Calendar API circuit breaker is open or probing.",
+                      lambda: [({}, 0 if BREAKER.state == CircuitBreaker.CLOSED else 1)])
@@ -0,0 +1,201 @@
+"""Правила расписания мастера и их скомпилированный шаблон.
+
+Правила (часы работы по дням недели, перерывы, выходные даты, сетка
+слотов, буфер после сеанса — общий и по типам массажа, минимальное время до
+записи, горизонт) читаются один раз из JSON-файла ``SCHEDULE_RULES_FILE``
+(по умолчанию ``schedule_rules.json`` рядом с модулем; без файла действуют
+прежние значения: ежедневно 10:00–21:00, сетка и буфер по 20 минут)::
+
+    {
+      "default_hours": ["10:00-21:00"],
+      "hours": {"sat": ["11:00-18:00"], "sun": []},
+      "breaks": {"*": ["14:00-14:40"]},
+      "days_off": ["2025-01-01"],
+      "slot_step": 20,
+      "buffer_minutes": 20,
+      "type_buffers": {"stone": 30},
+      "lead_time_hours": 4,
+      "horizon_days": 14
+    }
+
+``ScheduleTemplate`` компилирует правила в битовую маску рабочих минут
+для каждого дня недели и, для каждой пары (длительность, буфер), в готовый
+список допустимых начал с масками — индекс слотов только накладывает его
+на маску занятости дня, без перебора часов и минут при каждом запросе.
+"""
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+WEEKDAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+WEEKDAY_NAMES = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+RULES_FILE = os.getenv("SCHEDULE_RULES_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           "schedule_rules.json"))
+
+Range = Tuple[int, int]
+
+
+def _minute(value: str) -> int:
+    hours, minutes = value.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _ranges(values: Iterable[str]) -> Tuple[Range, ...]:
+    ranges = []
+    for value in values:
+        start, end = value.split("-")
+        start_minute, end_minute = _minute(start), _minute(end)
+        if not 0 <= start_minute < end_minute <= 24 * 60:
+            raise ValueError(f"Некорректный интервал расписания: {value!r}")
+        ranges.append((start_minute, end_minute))
+    return tuple(sorted(ranges))
+
+
+def _per_weekday(spec: Dict[str, List[str]], default: Tuple[Range, ...]) -> Tuple[Tuple[Range, ...], ...]:
+    unknown = set(spec) - set(WEEKDAYS) - {"*"}
+    if unknown:
+        raise ValueError(f"Неизвестные дни недели в расписании: {sorted(unknown)}")
+    common = _ranges(spec["*"]) if "*" in spec else default
+    return tuple(_ranges(spec[name]) if name in spec else common for name in WEEKDAYS)
+
+
+def _hhmm(minute: int) -> str:
+    return f"{minute // 60}:{minute % 60:02d}"
+
+
+def _range_mask(start: int, length: int) -> int:
+    return ((1 << length) - 1) << start
+
+
+@dataclass(frozen=True)
+class ScheduleRules:
+    hours: Tuple[Tuple[Range, ...], ...] = ((((10 * 60, 21 * 60),),) * 7)
+    breaks: Tuple[Tuple[Range, ...], ...] = (((),) * 7)
+    days_off: FrozenSet[date] = frozenset()
+    slot_step: int = 20
+    buffer_minutes: int = 20
+    type_buffers: Dict[str, int] = field(default_factory=dict)
+    lead_time: timedelta = timedelta(hours=4)
+    horizon_days: int = 14
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ScheduleRules":
+        default_hours = _ranges(data.get("default_hours", ["10:00-21:00"]))
+        return cls(
+            hours=_per_weekday(data.get("hours", {}), default_hours),
+            breaks=_per_weekday(data.get("breaks", {}), ()),
+            days_off=frozenset(date.fromisoformat(value) for value in data.get("days_off", [])),
+            slot_step=int(data.get("slot_step", 20)),
+            buffer_minutes=int(data.get("buffer_minutes", 20)),
+            type_buffers={key: int(value) for key, value in data.get("type_buffers", {}).items()},
+            lead_time=timedelta(hours=float(data.get("lead_time_hours", 4))),
+            horizon_days=int(data.get("horizon_days", 14)),
+        )
+
+    def buffer_for(self, massage_type: Optional[str] = None) -> int:
+        """Перерыв после сеанса этого типа, минут."""
+        return self.type_buffers.get(massage_type or "", self.buffer_minutes)
+
+    def describe(self) -> List[str]:
+        """Правила человеческим языком (для настроек в боте)."""
+        lines = []
+        for weekday, name in enumerate(WEEKDAY_NAMES):
+            hours = ", ".join(f"{_hhmm(start)} - {_hhmm(end)}" for start, end in self.hours[weekday]) or "выходной"
+            breaks = ", ".join(f"{_hhmm(start)} - {_hhmm(end)}" for start, end in self.breaks[weekday])
+            lines.append(f"{name}: {hours}" + (f" (перерыв {breaks})" if breaks and self.hours[weekday] else ""))
+        return lines
+
+
+class ScheduleTemplate:
+    """Правила, скомпилированные в маски рабочих минут и списки начал по дням недели."""
+
+    def __init__(self, rules: ScheduleRules):
+        self.rules = rules
+        self._open: List[int] = []
+        for weekday in range(7):
+            mask = 0
+            for start, end in rules.hours[weekday]:
+                mask |= _range_mask(start, end - start)
+            for start, end in rules.breaks[weekday]:
+                mask &= ~_range_mask(start, end - start)
+            self._open.append(mask)
+        self._candidates: Dict[Tuple[int, int, int], Tuple[Tuple[int, int], ...]] = {}
+        self._grids: Dict[int, Tuple[int, ...]] = {}
+        self._lock = threading.Lock()
+
+    def open_mask(self, day: date) -> int:
+        """Рабочие минуты дня (0 — выходной)."""
+        if day in self.rules.days_off:
+            return 0
+        return self._open[day.weekday()]
+
+    def grid(self, day: date) -> Tuple[int, ...]:
+        """Все минуты сетки дня, с которых может начаться сеанс любой длительности."""
+        if day in self.rules.days_off:
+            return ()
+        weekday = day.weekday()
+        grid = self._grids.get(weekday)
+        if grid is None:
+            grid = tuple(sorted({minute for start, end in self.rules.hours[weekday]
+                                 for minute in range(start, end, self.rules.slot_step)}))
+            with self._lock:
+                self._grids[weekday] = grid
+        return grid
+
+    def candidates(self, day: date, duration_minutes: int, buffer_minutes: int = 0) -> Tuple[Tuple[int, int], ...]:
+        """Допустимые начала сеанса в этот день: пары (минута, маска сеанса вместе с буфером после него)."""
+        if day in self.rules.days_off:
+            return ()
+        key = (day.weekday(), duration_minutes, buffer_minutes)
+        starts = self._candidates.get(key)
+        if starts is None:
+            starts = self._compile(*key)
+            with self._lock:
+                self._candidates[key] = starts
+        return starts
+
+    def _compile(self, weekday: int, duration_minutes: int, buffer_minutes: int) -> Tuple[Tuple[int, int], ...]:
+        # Сетка отсчитывается от начала каждого рабочего интервала; сеанс не должен задевать перерыв,
+        # а буфер после него может выходить за рабочее время, но не на чужой сеанс
+        open_mask = self._open[weekday]
+        starts = []
+        for start, end in self.rules.hours[weekday]:
+            for minute in range(start, end - duration_minutes + 1, self.rules.slot_step):
+                session = _range_mask(minute, duration_minutes)
+                if open_mask & session == session:
+                    starts.append((minute, _range_mask(minute, min(duration_minutes + buffer_minutes, 24 * 60 - minute))))
+        return tuple(starts)
+
+
+def load_rules(path: str = RULES_FILE) -> ScheduleRules:
+    if not os.path.exists(path):
+        return ScheduleRules()
+    with open(path, encoding="utf-8") as f:
+        return ScheduleRules.from_dict(json.load(f))
+
+
+_rules: Optional[ScheduleRules] = None
+_template: Optional[ScheduleTemplate] = None
+_rules_lock = threading.Lock()
+
+
+def get_rules() -> ScheduleRules:
+    global _rules
+    if _rules is None:
+        with _rules_lock:
+            if _rules is None:
+                _rules = load_rules()
+    return _rules
+
+
+def get_template() -> ScheduleTemplate:
+    global _template
+    if _template is None:
+        rules = get_rules()
+        with _rules_lock:
+            if _template is None:
+                _template = ScheduleTemplate(rules)
+    return _template
@@ -0,0 +1,58 @@
+"""Объединение одинаковых параллельных чтений (single-flight).
+
+Когда WebApp открывают сразу многие клиенты (например, после рассылки),
+десятки одинаковых запросов приходят одновременно. Раньше каждый из них
+сам шёл за данными: на холодном старте все ждали замок синхронизации и
+потом по очереди повторяли ``events().list()``, промах индекса слотов
+по одному дню считался (и запрашивал занятость) столько раз, сколько
+пришло запросов. ``SingleFlight.do`` выполняет вызов с данным ключом один
+раз, а все, кто пришёл, пока он идёт, ждут и получают тот же результат
+или то же исключение. Ничего не кэшируется: следующий вызов после
+завершения снова идёт за свежими данными.
+"""
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import metrics
+
+CALLS = metrics.counter("singleflight_calls_total",
+                        "Reads by coalescing group: leader did the work, shared joined an in-flight call.")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def do(self, key: Hashable, func: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            CALLS.inc(name=self.name, result="shared")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        CALLS.inc(name=self.name, result="leader")
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -0,0 +1,111 @@
+"""Периодическое удаление прошедших записей из календаря.
+
+Раньше на каждую запись ставилась отдельная ETA-задача Celery: такие задачи
+копятся в памяти воркера неделями, а задача отменённой записи всё равно
+срабатывала и ходила в Google. Теперь фоновый поток раз в
+``SWEEP_INTERVAL`` секунд берёт из ``EventStore`` записи, время которых уже
+наступило, и удаляет их пакетными запросами (``calendar_bulk``). Отменённые события в
+хранилище уже отсутствуют, поэтому лишних запросов нет; ответы 404/410
+считаются «уже удалено».
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from calendar_bulk import bulk_delete
+from rate_limit import CLEANUP, priority
+from event_store import LOOKBACK_DAYS, MOSCOW_TZ, EventStore, booking_metadata
+import masters
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL = float(os.getenv("SWEEP_INTERVAL", "300"))
+
+SWEEP_STATS: Dict[str, Optional[float]] = {
+    "runs": 0,
+    "swept_total": 0,
+    "already_gone_total": 0,
+    "failed_total": 0,
+    "last_run_at": None,
+    "last_swept": 0,
+    "last_duration_ms": None,
+}
+_stats_lock = threading.Lock()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def is_app_booking(event: dict) -> bool:
+    """Событие создано этим приложением (а не добавлено мастером вручную)."""
+    return bool(booking_metadata(event).get("massageType")) or event.get("colorId") == "2"
+
+
+def expired_bookings(store: EventStore, now: Optional[datetime] = None) -> List[dict]:
+    now = now or datetime.now(MOSCOW_TZ).replace(tzinfo=None)
+    return [
+        event for start, _end, event in store.events_between(now - timedelta(days=LOOKBACK_DAYS), now)
+        if start <= now and is_app_booking(event)
+    ]
+
+
+@priority(CLEANUP)
+def sweep_expired_bookings(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Удалить наступившие записи пакетными запросами. Возвращает статистику прогона."""
+    started = time.perf_counter()
+    masters.sync()
+    result = {"swept": 0, "already_gone": 0, "failed": 0}
+    expired_total = 0
+    for master in masters.get_masters():
+        store = master.store
+        expired = expired_bookings(store, now)
+        if not expired:
+            continue
+        expired_total += len(expired)
+        for event_id, item in bulk_delete([event["id"] for event in expired], store.calendar_id).items():
+            if not item["ok"]:
+                result["failed"] += 1
+                logger.warning("Не удалось удалить событие %s: %s", event_id, item["error"])
+                continue
+            result["swept" if item["status"] == 200 else "already_gone"] += 1
+            store.remove(event_id)
+
+    with _stats_lock:
+        SWEEP_STATS["runs"] += 1
+        SWEEP_STATS["swept_total"] += result["swept"]
+        SWEEP_STATS["already_gone_total"] += result["already_gone"]
+        SWEEP_STATS["failed_total"] += result["failed"]
+        SWEEP_STATS["last_run_at"] = time.time()
+        SWEEP_STATS["last_swept"] = result["swept"]
+        SWEEP_STATS["last_duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if expired_total:
+        logger.info("Очистка прошедших записей: %s", result)
+    return result
+
+
+def get_stats() -> Dict[str, Optional[float]]:
+    with _stats_lock:
+        return dict(SWEEP_STATS)
+
+
+def start(interval: float = SWEEP_INTERVAL):
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, args=(interval,), name="expired-sweeper", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
+
+
+def _loop(interval: float):
+    while not _stop.wait(interval):
+        try:
+            sweep_expired_bookings()
+        except Exception:
+            logger.exception("Ошибка очистки прошедших записей")
@@ -1,6 +1,14 @@
-from .celery_app import celery_app
+from celery_app import celery_app
+from rate_limit import CLEANUP, priority
 
 @celery_app.task
 def delete_booking_task(event_id):
-    from .google_calendar import delete_event
-    delete_event(event_id) 
\ No newline at end of file
+    # Новые записи больше не ставят ETA-задачи (их заменил sweeper в API).
+    # Задача оставлена, чтобы доработали уже поставленные в очередь.
+    return bulk_cancel_task([event_id])
+
+@celery_app.task
+def bulk_cancel_task(event_ids):
+    from calendar_bulk import bulk_delete, summarize
+    with priority(CLEANUP):
+        return summarize(bulk_delete(event_ids))
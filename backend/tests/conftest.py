@@ -0,0 +1,85 @@
+"""Окружение тестов: поддельный календарь, свой журнал и приёмник уведомлений.
+
+Переменные окружения выставляются до импорта модулей backend — они читают
+их при импорте. Календарь, журнал и индексы — общие на процесс, поэтому
+каждый тест берёт свой день (фикстура ``day``) и не видит записей соседей.
+"""
+import itertools
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="massage-tests-")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+PORT = _free_port()
+os.environ.update({
+    "CALENDAR_BACKEND": "fake",
+    "CALENDAR_ID": "tests@fake",
+    "LEDGER_PATH": os.path.join(WORKDIR, "ledger.db"),
+    "MASTERS_FILE": os.path.join(WORKDIR, "masters.json"),
+    "SCHEDULE_RULES_FILE": os.path.join(WORKDIR, "schedule_rules.json"),
+    "TELEGRAM_API_URL": "http://127.0.0.1:9",
+    "WATCH_WEBHOOK_URL": f"http://127.0.0.1:{PORT}/api/calendar/notifications",
+    "WATCH_TOKEN": "tests-token",
+    "LOG_LEVEL": "ERROR",
+})
+# Прежние часы и буфер, но у стоун-терапии свой перерыв — как в примере из schedule_rules
+with open(os.environ["SCHEDULE_RULES_FILE"], "w", encoding="utf-8") as f:
+    json.dump({"type_buffers": {"stone": 30}}, f)
+sys.path.insert(0, BACKEND_DIR)
+# main.py монтирует ./static
+os.makedirs(os.path.join(WORKDIR, "static"))
+os.chdir(WORKDIR)
+
+_days = itertools.count(2)
+
+
+@pytest.fixture
+def day() -> datetime:
+    """10:00 отдельного будущего дня: тесты не пересекаются по занятости."""
+    return (datetime.now() + timedelta(days=next(_days))).replace(hour=10, minute=0, second=0, microsecond=0)
+
+
+@pytest.fixture(scope="session")
+def app_url() -> str:
+    """Приложение на настоящем порту, чтобы до него доходили POST поддельного календаря.
+
+    Без lifespan: фоновые потоки (mirror, опрос, каналы) не запускаются, тесты вызывают их шаги сами.
+    """
+    import uvicorn
+
+    import main
+
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=PORT, lifespan="off", log_level="error"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.02)
+    yield f"http://127.0.0.1:{PORT}"
+    server.should_exit = True
+    thread.join(timeout=5)
+
+
+def wait_for(predicate, timeout: float = 5.0):
+    """Дождаться, пока ``predicate()`` вернёт истину (уведомления доставляются фоном)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        result = predicate()
+        if result or time.monotonic() >= deadline:
+            return result
+        time.sleep(0.02)
@@ -0,0 +1,45 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+
+def _get(url: str):
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, None
+
+
+@pytest.mark.parametrize("query", ["duration=-30", "duration=0", "duration=100000"])
+def test_slots_reject_invalid_duration(app_url, day, query):
+    status, _ = _get(f"{app_url}/api/slots?day={day:%Y-%m-%d}&{query}")
+    assert status == 422
+    status, _ = _get(f"{app_url}/api/slots/range?from={day:%Y-%m-%d}&to={day:%Y-%m-%d}&{query}")
+    assert status == 422
+
+
+def test_slots_for_valid_duration(app_url, day):
+    status, slots = _get(f"{app_url}/api/slots?day={day:%Y-%m-%d}&duration=60")
+    assert status == 200
+    assert slots and slots[0].startswith(f"{day:%Y-%m-%d}T10:00")
+
+
+def test_slots_range_uses_massage_type_buffer(app_url, day):
+    from datetime import timedelta
+
+    from booking import book_slot
+    from schedule_rules import get_rules
+
+    # Сеанс 12:00-13:00: после него у классического массажа 20 минут перерыва, у стоун-терапии 30
+    assert get_rules().buffer_for("stone") == 30
+    assert book_slot("Анна", (day + timedelta(hours=2)).isoformat(), "classic", 60)[0]
+    query = f"from={day:%Y-%m-%d}&to={day:%Y-%m-%d}&duration=60"
+    for massage_type in ("classic", "stone"):
+        _, single = _get(f"{app_url}/api/slots?day={day:%Y-%m-%d}&duration=60&massageType={massage_type}")
+        _, ranged = _get(f"{app_url}/api/slots/range?{query}&massageType={massage_type}")
+        assert ranged["slots"][f"{day:%Y-%m-%d}"]["60"] == [slot[11:16] for slot in single]
+    # 10:40 + 60 мин + 30 мин перерыва задевает сеанс в 12:00
+    assert "10:40" not in ranged["slots"][f"{day:%Y-%m-%d}"]["60"]
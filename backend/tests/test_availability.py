@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+
+import availability
+from availability import BUFFER_MINUTES, AvailabilityIndex
+from busy_provider import StoreBusySource
+from event_store import EventStore
+from fake_calendar import FakeCalendarService
+from schedule_rules import ScheduleRules, ScheduleTemplate, get_template
+
+CALENDAR = "index@fake"
+
+
+def _index(service):
+    store = EventStore(CALENDAR, service_factory=lambda: service)
+    store.sync()
+    return store, AvailabilityIndex(StoreBusySource(store))
+
+
+def _minute(dt: datetime) -> int:
+    return dt.hour * 60 + dt.minute
+
+
+def test_free_starts_match_direct_check(day):
+    service = FakeCalendarService()
+    busy = [(day + timedelta(minutes=60), day + timedelta(minutes=140)),
+            (day + timedelta(hours=5), day + timedelta(hours=6))]
+    for start, end in busy:
+        service.add_event(CALENDAR, start, end)
+    _, index = _index(service)
+    template = get_template()
+
+    for duration, buffer_minutes in ((30, 20), (60, 20), (90, 30)):
+        expected = []
+        for minute in template.grid(day.date()):
+            start = day.replace(hour=0, minute=0) + timedelta(minutes=minute)
+            end = start + timedelta(minutes=duration + buffer_minutes + BUFFER_MINUTES)
+            fits = template.open_mask(day.date()) >> minute & ((1 << duration) - 1) == (1 << duration) - 1
+            if fits and all(end <= s or start >= e + timedelta(minutes=BUFFER_MINUTES) for s, e in busy):
+                expected.append(minute)
+        assert 0 < len(expected) < len(template.grid(day.date()))
+        assert index.free_starts(day.date(), duration, buffer_minutes) == expected
+        assert all(index.is_free(day.replace(hour=0, minute=0) + timedelta(minutes=minute), duration, buffer_minutes)
+                   for minute in expected)
+
+
+def test_calendar_change_invalidates_only_its_day(day):
+    service = FakeCalendarService()
+    store, index = _index(service)
+    next_day = (day + timedelta(days=1)).date()
+    assert _minute(day) in index.free_starts(day.date(), 60)
+    index.free_starts(next_day, 60)
+
+    event = service.add_event(CALENDAR, day, day + timedelta(minutes=60))
+    store.sync()
+    misses = index.misses
+    # Соседний день остался в кэше, изменившийся пересчитан
+    index.free_starts(next_day, 60)
+    assert index.misses == misses
+    assert _minute(day) not in index.free_starts(day.date(), 60)
+    assert index.misses == misses + 1
+
+    # Отмена освобождает слот так же сразу
+    store.remove(event["id"])
+    assert _minute(day) in index.free_starts(day.date(), 60)
+
+
+def test_time_bucket_follows_interval_aligned_grid(monkeypatch):
+    # Сетка от 10:10, а не от полуночи: слоты 10:10, 10:30, 10:50, ...
+    template = ScheduleTemplate(ScheduleRules.from_dict({"default_hours": ["10:10-21:00"], "slot_step": 20}))
+    monkeypatch.setattr(availability, "get_template", lambda: template)
+    monkeypatch.setattr(availability, "LEAD_TIME", timedelta(hours=4))
+
+    def bucket(hh_mm: str):
+        return availability.time_bucket(datetime.fromisoformat(f"2025-01-15T{hh_mm}") - timedelta(hours=4))
+
+    # Граница переходит через начало 10:10 — список слотов меняется, ключ тоже
+    assert bucket("10:09") != bucket("10:10")
+    # Между началами 10:10 и 10:30 список тот же — и ключ тот же, хотя граница прошла 10:20
+    assert bucket("10:10") == bucket("10:25")
+    assert bucket("10:29") != bucket("10:30")
@@ -0,0 +1,17 @@
+from datetime import timedelta
+
+from availability import AvailabilityIndex
+from busy_provider import FreeBusySource
+from fake_calendar import get_fake_service
+
+from conftest import wait_for
+
+
+def test_freebusy_ttl_bounds_index_staleness(day):
+    calendar_id = "freebusy-ttl@fake"
+    index = AvailabilityIndex(FreeBusySource(calendar_id, ttl=0.05))
+    assert 600 in index.free_starts(day.date(), 60)
+
+    # Правка прямо в Google: локальных уведомлений нет, индекс держит посчитанный день
+    get_fake_service().add_event(calendar_id, day, day + timedelta(minutes=60))
+    assert wait_for(lambda: 600 not in index.free_starts(day.date(), 60), timeout=2)
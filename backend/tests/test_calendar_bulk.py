@@ -0,0 +1,40 @@
+import calendar_bulk
+from fake_calendar import FakeHttpError
+
+
+class BrokenBatchService:
+    """Первый batch: одна операция получает 503, затем соединение рвётся; дальше всё успешно."""
+
+    def __init__(self):
+        self.sent = []
+
+    def new_batch_http_request(self, callback):
+        service = self
+
+        class Batch:
+            def __init__(self):
+                self.ops = []
+
+            def add(self, request, request_id):
+                self.ops.append(request_id)
+
+            def execute(self):
+                service.sent.append(list(self.ops))
+                if len(service.sent) == 1:
+                    callback(self.ops[0], None, FakeHttpError(503, "backendError"))
+                    raise ConnectionResetError("connection reset")
+                for op_id in self.ops:
+                    callback(op_id, {"id": op_id}, None)
+
+        return Batch()
+
+
+def test_failed_batch_does_not_duplicate_retried_operations(monkeypatch):
+    service = BrokenBatchService()
+    monkeypatch.setattr(calendar_bulk, "get_service", lambda: service)
+    monkeypatch.setattr(calendar_bulk, "BACKOFF_BASE", 0)
+
+    results = calendar_bulk.execute_bulk([(op_id, lambda svc: None) for op_id in ("a", "b", "c")])
+
+    assert sorted(service.sent[1]) == ["a", "b", "c"]
+    assert all(item["ok"] for item in results.values()) and len(results) == 3
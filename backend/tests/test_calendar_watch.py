@@ -0,0 +1,90 @@
+import threading
+import urllib.error
+import urllib.request
+from datetime import timedelta
+
+import pytest
+
+import calendar_watch
+import masters
+import mirror
+from availability import BUFFER_MINUTES
+from booking import book_slot
+from calendar_client import CALENDAR_ID
+from fake_calendar import get_fake_service
+from ledger import get_ledger
+
+from conftest import wait_for
+
+
+@pytest.fixture
+def watch(app_url):
+    manager = calendar_watch.get_manager()
+    masters.sync()
+    manager.renew_due()
+    # Уведомления от изменений прошлых тестов доставляются фоном — дожидаемся их и сбрасываем
+    wait_for(lambda: not any(thread.name == "fake-push" for thread in threading.enumerate()))
+    manager.sync_dirty()
+    yield manager
+    manager.stop()
+
+
+def _sync_when_notified(manager):
+    return wait_for(lambda: manager.sync_dirty())
+
+
+def test_manual_event_reaches_index(watch, day):
+    index = masters.get_master(masters.get_masters()[0].id).index
+    assert index.is_free(day, 60)
+
+    get_fake_service().add_event(CALENDAR_ID, day, day + timedelta(minutes=60), "Личное")
+    assert _sync_when_notified(watch) == 1
+    assert not index.is_free(day, 60)
+
+
+def test_manual_move_reaches_ledger(watch, day):
+    success, booking_id = book_slot("Анна", day.isoformat(), "classic", 60)
+    mirror.push_pending()
+    # Уведомление о собственной записи: дельта без изменений для журнала
+    _sync_when_notified(watch)
+    event_id = get_ledger().get(booking_id)["event_id"]
+
+    moved = day + timedelta(hours=3)
+    get_fake_service().events().patch(calendarId=CALENDAR_ID, eventId=event_id, body={
+        "start": {"dateTime": moved.isoformat(), "timeZone": "Europe/Moscow"},
+        "end": {"dateTime": (moved + timedelta(minutes=60)).isoformat(), "timeZone": "Europe/Moscow"},
+    }).execute()
+    assert _sync_when_notified(watch) == 1
+    mirror.reconcile(sync=False)
+    booking = get_ledger().get(booking_id)
+    assert booking["start"] == moved.isoformat()
+    assert booking["busy_end"] == (moved + timedelta(minutes=60 + BUFFER_MINUTES)).isoformat()
+
+
+def test_foreign_token_is_rejected(watch, app_url):
+    [channel] = watch.channels()
+    request = urllib.request.Request(f"{app_url}/api/calendar/notifications", data=b"", method="POST", headers={
+        "X-Goog-Channel-ID": channel.id,
+        "X-Goog-Resource-ID": channel.resource_id,
+        "X-Goog-Resource-State": "exists",
+        "X-Goog-Channel-Token": "wrong",
+    })
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(request, timeout=5)
+    assert error.value.code == 403
+    assert watch.sync_dirty() == 0
+
+
+def test_expiring_channel_is_replaced(watch, day):
+    [old] = watch.channels()
+    watch.renew_due(now=old.expiration - calendar_watch.RENEW_BEFORE - 60)
+    assert watch.channels() == [old]
+
+    watch.renew_due(now=old.expiration - calendar_watch.RENEW_BEFORE + 60)
+    [new] = watch.channels()
+    assert new.id != old.id
+    # Закрытый канал больше не отмечает календарь, изменения приходят по новому
+    assert watch.handle(old.id, old.resource_id, "exists", calendar_watch.WATCH_TOKEN)
+    assert watch.sync_dirty() == 0
+    get_fake_service().add_event(CALENDAR_ID, day, day + timedelta(minutes=60), "Личное")
+    assert _sync_when_notified(watch) == 1
@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from event_store import EventStore
+from fake_calendar import FakeCalendarService
+
+CALENDAR = "store@fake"
+
+
+def _store(service):
+    store = EventStore(CALENDAR, service_factory=lambda: service)
+    changes = []
+    store.add_listener(changes.append)
+    return store, changes
+
+
+def test_incremental_sync_fetches_only_changes(day):
+    service = FakeCalendarService()
+    first = service.add_event(CALENDAR, day, day + timedelta(minutes=60))
+    store, changes = _store(service)
+
+    assert store.sync() == 1
+    assert store.is_ready and store.get(first["id"]) is not None
+
+    second = service.add_event(CALENDAR, day + timedelta(days=1), day + timedelta(days=1, minutes=60))
+    # По syncToken приходит только новое событие, а подписчики узнают только его день
+    assert store.sync() == 1
+    assert changes[-1] == {(day + timedelta(days=1)).date()}
+    assert {event["id"] for _, _, event in store.events_between(day, day + timedelta(days=2))} == {
+        first["id"], second["id"]}
+    assert store.sync() == 0
+
+
+def test_incremental_sync_drops_deleted_events(day):
+    service = FakeCalendarService()
+    event = service.add_event(CALENDAR, day, day + timedelta(minutes=60), "Классический массаж - Анна")
+    store, changes = _store(service)
+    store.sync()
+    assert store.events_for_user("Анна")
+
+    service.events().delete(calendarId=CALENDAR, eventId=event["id"]).execute()
+    assert store.sync() == 1
+    assert store.get(event["id"]) is None
+    assert store.events_on(day.date()) == [] and store.events_for_user("Анна") == []
+    assert changes[-1] == {day.date()}
+
+
+def test_expired_sync_token_falls_back_to_full_sync(day):
+    service = FakeCalendarService()
+    store, _ = _store(service)
+    store.sync()
+
+    event = service.add_event(CALENDAR, day, day + timedelta(minutes=60))
+    service.invalidate_sync_tokens(CALENDAR)
+    # 410 Gone на старый токен — хранилище перечитывает календарь целиком и продолжает работать
+    store.sync()
+    assert store.get(event["id"]) is not None
+    calls = service.calls["events.list"]
+    assert store.sync() == 0
+    assert service.calls["events.list"] == calls + 1
@@ -0,0 +1,160 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import booking
+import masters
+import mirror
+from availability import BUFFER_MINUTES
+from booking import book_slot, cancel_slot
+from calendar_client import CALENDAR_ID
+from event_store import parse_event_times
+from fake_calendar import get_fake_service
+from ledger import get_ledger
+from resilience import BREAKER
+
+from conftest import wait_for
+
+
+def _push_all():
+    while mirror.push_pending()["created"] or get_ledger().due():
+        pass
+
+
+def _events_on(day):
+    return [event for event in get_fake_service().all_events(CALENDAR_ID)
+            if parse_event_times(event)[0].date() == day.date()]
+
+
+def test_book_is_local_until_mirrored(day):
+    success, booking_id = book_slot("Анна", day.isoformat(), "classic", 60, user_id="1")
+    assert success
+
+    booking = get_ledger().get(booking_id)
+    assert booking["status"] == "active" and booking["sync_state"] == "pending_create"
+    assert _events_on(day) == []
+    # До переноса в Google время уже занято
+    assert not book_slot("Борис", (day + timedelta(minutes=30)).isoformat(), "classic", 60)[0]
+
+    _push_all()
+    booking = get_ledger().get(booking_id)
+    assert booking["sync_state"] == "synced"
+    [event] = _events_on(day)
+    assert event["id"] == booking["event_id"]
+    assert event["extendedProperties"]["private"]["ledgerId"] == booking_id
+
+
+def test_booking_survives_google_outage(day, monkeypatch):
+    service = get_fake_service()
+    # Копия календаря загружена до сбоя, как после старта приложения
+    masters.sync()
+    monkeypatch.setattr(service, "outage", True)
+    success, booking_id = book_slot("Анна", day.isoformat(), "classic", 60)
+    assert success
+
+    # Google отвечает 503: запись остаётся в журнале и ждёт повтора с задержкой
+    assert mirror.push_pending()["failed"] >= 1
+    booking = get_ledger().get(booking_id)
+    assert booking["sync_state"] == "pending_create" and booking["attempts"] == 1 and booking["last_error"]
+    assert not book_slot("Борис", day.isoformat(), "classic", 60)[0]
+
+    monkeypatch.setattr(service, "outage", False)
+    BREAKER.record_success()
+    assert wait_for(lambda: mirror.push_pending()["created"] or get_ledger().get(booking_id)["event_id"])
+    assert get_ledger().get(booking_id)["sync_state"] == "synced"
+    assert len(_events_on(day)) == 1
+
+
+def test_cancel_round_trip(day):
+    success, booking_id = book_slot("Анна", day.isoformat(), "classic", 60)
+    _push_all()
+    event_id = get_ledger().get(booking_id)["event_id"]
+
+    assert cancel_slot(booking_id)
+    booking = get_ledger().get(booking_id)
+    assert booking["status"] == "cancelled" and booking["sync_state"] == "pending_delete"
+    # Слот свободен сразу, ещё до удаления события в Google
+    assert book_slot("Борис", day.isoformat(), "classic", 60)[0]
+
+    _push_all()
+    assert get_ledger().get(booking_id)["sync_state"] == "synced"
+    assert event_id not in {event["id"] for event in get_fake_service().all_events(CALENDAR_ID)}
+
+
+def test_cancel_before_mirror_skips_google(day):
+    success, booking_id = book_slot("Анна", day.isoformat(), "classic", 60)
+    assert cancel_slot(booking_id)
+    _push_all()
+    assert get_ledger().get(booking_id)["event_id"] is None
+    assert _events_on(day) == []
+
+
+def test_concurrent_cancels_succeed_once(day, monkeypatch):
+    notified = []
+    monkeypatch.setattr(booking, "notify_admin_cancel", lambda *args: notified.append(args))
+    success, booking_id = book_slot("Анна", day.isoformat(), "classic", 60)
+    ledger, get = get_ledger(), get_ledger().get
+
+    def slow_get(booking_id):
+        # Все отмены успевают прочитать активную запись до того, как какая-то из них её изменит
+        row = get(booking_id)
+        time.sleep(0.05)
+        return row
+
+    monkeypatch.setattr(ledger, "get", slow_get)
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        results = list(pool.map(lambda _: cancel_slot(booking_id), range(10)))
+    assert results.count(True) == 1
+    assert len(notified) == 1
+
+
+def test_reconcile_imports_and_removes_manual_changes(day):
+    service = get_fake_service()
+    # Запись прошлой версии бота: без метаданных, узнаётся по цвету
+    event = service.add_event(CALENDAR_ID, day, day + timedelta(minutes=60), "Массаж - Вера", colorId="2")
+    masters.sync()
+    mirror.reconcile(sync=False)
+    booking = get_ledger().get(event["id"])
+    assert booking is not None and booking["user_name"] == "Вера"
+    # Занятость — сеанс и перерыв, а не конец события, поставленный вручную
+    assert booking["busy_end"] == (day + timedelta(minutes=60 + BUFFER_MINUTES)).isoformat()
+
+    service.events().delete(calendarId=CALENDAR_ID, eventId=event["id"]).execute()
+    mirror.reconcile()
+    assert get_ledger().get(event["id"])["status"] == "cancelled"
+
+
+def test_pending_booking_keeps_type_buffer(day):
+    # Стоун-терапия: перерыв 30 минут, поверх него общий буфер индекса
+    assert book_slot("Анна", day.isoformat(), "stone", 60)[0]
+    gap_end = day + timedelta(minutes=60 + 30 + BUFFER_MINUTES)
+    # Пока запись не в Google, её перерыв занят так же, как после переноса
+    assert not book_slot("Борис", (gap_end - timedelta(minutes=20)).isoformat(), "classic", 60)[0]
+    assert book_slot("Борис", gap_end.isoformat(), "classic", 60)[0]
+
+    _push_all()
+    first, second = sorted(parse_event_times(event) for event in _events_on(day))
+    assert first[1] == day + timedelta(minutes=90)
+    assert second[0] >= first[1] + timedelta(minutes=BUFFER_MINUTES)
+
+
+def test_concurrent_bookings_never_overlap(day):
+    starts = [day + timedelta(minutes=20 * step) for step in range(9)]
+    jobs = [(f"Клиент {i}", starts[i % len(starts)].isoformat(), ("classic", "stone")[i % 2], (30, 60, 90)[i % 3])
+            for i in range(90)]
+    with ThreadPoolExecutor(max_workers=30) as pool:
+        results = list(pool.map(lambda job: book_slot(job[0], job[1], job[2], job[3]), jobs))
+    assert any(success for success, _ in results)
+
+    # Между записями — перерыв типа (он в busy_end) и общий буфер индекса
+    gap = timedelta(minutes=BUFFER_MINUTES).total_seconds()
+    rows = sorted(get_ledger().active_on(CALENDAR_ID, day.date()), key=lambda row: row["start"])
+    assert len(rows) == sum(1 for success, _ in results if success)
+    for prev, nxt in zip(rows, rows[1:]):
+        assert (datetime.fromisoformat(nxt["start"]) - datetime.fromisoformat(prev["busy_end"])).total_seconds() >= gap
+
+    _push_all()
+    intervals = sorted(parse_event_times(event) for event in _events_on(day))
+    assert len(intervals) == len(rows)
+    for prev, nxt in zip(intervals, intervals[1:]):
+        assert (nxt[0] - prev[1]).total_seconds() >= gap
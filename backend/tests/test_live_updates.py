@@ -0,0 +1,52 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import live_updates
+from event_store import MOSCOW_TZ
+from live_updates import SlotFeed
+from resilience import CalendarUnavailable
+
+
+class FlakyIndex:
+    """Индекс, который сначала недоступен, как при старте во время сбоя Google."""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.busy = set()
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def free_starts(self, day: date, duration: int, buffer_minutes: int):
+        if self.failures:
+            self.failures -= 1
+            raise CalendarUnavailable("Google Calendar недоступен")
+        return [minute for minute in (600, 660, 720) if (day, minute) not in self.busy]
+
+
+def test_feed_survives_failed_start(monkeypatch):
+    monkeypatch.setattr(live_updates, "RETRY_INTERVAL", 0.01)
+    index = FlakyIndex(failures=2)
+    day = datetime.now(MOSCOW_TZ).date() + timedelta(days=1)
+
+    async def scenario():
+        feed = SlotFeed(index, variants=((60, 20),))
+        queue = feed.subscribe()
+        feed.start()
+        for _ in range(200):
+            if feed._snapshot:
+                break
+            await asyncio.sleep(0.01)
+        assert feed._snapshot, "лента не сняла исходный снимок после сбоя"
+        index.busy.add((day, 660))
+        for listener in index.listeners:
+            listener({day})
+        try:
+            return await asyncio.wait_for(queue.get(), timeout=2)
+        finally:
+            feed.stop()
+
+    delta = asyncio.run(scenario())
+    assert delta["day"] == day.isoformat()
+    assert delta["removed"] == ["11:00"]
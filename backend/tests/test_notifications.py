@@ -0,0 +1,29 @@
+import notifications
+from notifications import _compose
+
+
+def test_single_notification_is_sent_as_is():
+    assert _compose(["📅 <b>Новая запись</b>\n👤 Анна"]) == ["📅 <b>Новая запись</b>\n👤 Анна"]
+
+
+def test_long_digest_is_split_at_line_boundaries(monkeypatch):
+    monkeypatch.setattr(notifications, "TELEGRAM_MESSAGE_LIMIT", 200)
+    batch = [f"📅 <b>Новая запись</b>\n👤 Клиент &lt;{i}&gt;\n🕒 2025-01-15T10:00" for i in range(20)]
+    messages = _compose(batch)
+
+    assert len(messages) > 1
+    for message in messages:
+        assert len(message) <= 200
+        assert message.count("<b>") == message.count("</b>")
+    # Ни одна строка не потеряна и не разрезана
+    lines = [line for message in messages for line in message.split("\n") if line]
+    expected = [line for line in ("\n\n".join(batch)).split("\n") if line]
+    assert lines[1:] == expected
+
+
+def test_client_text_is_escaped(monkeypatch):
+    queued = []
+    monkeypatch.setattr(notifications, "_enqueue", queued.append)
+    notifications.notify_admin("<b>Вера & Co", "2025-01-15T10:00")
+    assert queued == ["📅 <b>Новая запись</b>\n👤 &lt;b&gt;Вера &amp; Co\n🕒 2025-01-15T10:00"]
+
@@ -0,0 +1,48 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from availability import BUFFER_MINUTES
+from reservations import SlotReservations
+
+
+def _hold_concurrently(reservations, starts, duration=60):
+    """Держать все брони одновременно: каждая ждёт, пока остальные попробуют встать."""
+    barrier = threading.Barrier(len(starts))
+
+    def attempt(start):
+        with reservations.hold(start, duration) as held:
+            barrier.wait(timeout=5)
+            return held
+
+    with ThreadPoolExecutor(max_workers=len(starts)) as pool:
+        return list(pool.map(attempt, starts))
+
+
+def test_same_slot_is_held_once(day):
+    reservations = SlotReservations(lambda *args: True)
+    assert _hold_concurrently(reservations, [day] * 10).count(True) == 1
+
+
+def test_holds_keep_buffer_in_both_directions(day):
+    reservations = SlotReservations(lambda *args: True)
+    gap = timedelta(minutes=60 + 2 * BUFFER_MINUTES)
+    # Вплотную к чужому сеансу с его перерывом и общим буфером нельзя — ни после, ни перед ним
+    for first, second in ((day, day + gap - timedelta(minutes=1)), (day + gap - timedelta(minutes=1), day)):
+        with reservations.hold(first, 60) as held, reservations.hold(second, 60) as conflicting:
+            assert held and not conflicting
+    assert _hold_concurrently(reservations, [day, day + gap, day + 2 * gap]) == [True, True, True]
+
+
+def test_hold_is_released_after_block(day):
+    reservations = SlotReservations(lambda *args: True)
+    with reservations.hold(day, 60) as held:
+        assert held
+    with reservations.hold(day, 60) as held:
+        assert held
+
+
+def test_busy_calendar_refuses_hold(day):
+    reservations = SlotReservations(lambda start, duration, buffer_minutes: start != day)
+    with reservations.hold(day, 60) as held:
+        assert not held
@@ -0,0 +1,35 @@
+import socket
+
+import pytest
+
+from fake_calendar import FakeHttpError
+from resilience import CalendarUnavailable, call_with_timeout, is_failure
+
+
+@pytest.mark.parametrize("error, failure", [
+    (socket.timeout("timed out"), True),
+    (ConnectionResetError(), True),
+    (FakeHttpError(503, "backendError"), True),
+    (FakeHttpError(404, "notFound"), False),
+    (FakeHttpError(429, "rateLimitExceeded"), False),
+    (ValueError("negative shift count"), False),
+    (KeyError("slot"), False),
+])
+def test_is_failure(error, failure):
+    assert is_failure(error) is failure
+
+
+def test_bugs_are_not_reported_as_outage():
+    def broken():
+        raise ValueError("negative shift count")
+
+    with pytest.raises(ValueError):
+        call_with_timeout(broken)
+
+
+def test_network_errors_become_unavailable():
+    def unreachable():
+        raise ConnectionRefusedError()
+
+    with pytest.raises(CalendarUnavailable):
+        call_with_timeout(unreachable)
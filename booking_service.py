@@ -0,0 +1,86 @@
+"""Записи для бота через API бэкенда, без блокировки цикла aiogram.
+
+Раньше бот сам создавал событие в Google синхронным вызовом прямо в
+обработчике: пока Google отвечал, бот не обрабатывал сообщения других
+пользователей, а проверки пересечений, которую делает ``booking.book_slot``,
+не было вовсе. Теперь запись и чтение идут асинхронными HTTP-запросами к
+тому же бэкенду, что обслуживает WebApp: проверка занятости, журнал записей,
+перенос в календарь и уведомления — в одном процессе и в одном месте.
+
+Адрес бэкенда — ``BACKEND_URL`` (по умолчанию ``http://localhost:8000``).
+"""
+import os
+from datetime import date, datetime
+from typing import List, Optional
+from urllib.parse import quote
+
+import aiohttp
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000").rstrip("/")
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "10"))
+
+
+class BookingError(Exception):
+    """Бэкенд не смог записать клиента (текст ошибки можно показать пользователю)."""
+
+
+class SlotTaken(BookingError):
+    pass
+
+
+class BookingService:
+    def __init__(self, base_url: str = BACKEND_URL, timeout: float = BACKEND_TIMEOUT):
+        self.base_url = base_url
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Одна сессия (пул keep-alive соединений) на процесс, создаётся внутри работающего цикла
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(base_url=self.base_url, timeout=self._timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def book(self, name: str, slot: datetime, massage_type: str, duration: int,
+                   user_id: Optional[str] = None) -> str:
+        """Записать клиента; возвращает id записи. ``SlotTaken`` — время уже занято."""
+        payload = {"name": name, "slot": slot.isoformat(), "massageType": massage_type,
+                   "duration": duration, "userId": user_id}
+        try:
+            async with self._get_session().post("/api/book", json=payload) as response:
+                body = await response.json(content_type=None)
+                if response.status == 409:
+                    raise SlotTaken(body.get("detail") or "Слот уже занят")
+                if response.status != 200:
+                    raise BookingError(body.get("detail") or f"HTTP {response.status}")
+                return body["eventId"]
+        except (aiohttp.ClientError, TimeoutError) as e:
+            raise BookingError(f"Бэкенд недоступен: {e}") from e
+
+    async def user_bookings(self, name: str, user_id: Optional[str] = None) -> List[dict]:
+        params = {"userId": user_id} if user_id else None
+        async with self._get_session().get(f"/api/user-bookings/{quote(name, safe='')}", params=params) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def find_booking(self, name: str, user_id: Optional[str], slot: datetime,
+                           booking_id: Optional[str] = None) -> Optional[dict]:
+        """Запись клиента по id или на это время (если WebApp уже записал его сам)."""
+        for booking in await self.user_bookings(name, user_id):
+            if booking_id and booking["eventId"] == booking_id:
+                return booking
+            if datetime.fromisoformat(booking["slot"]).replace(tzinfo=None) == slot.replace(tzinfo=None):
+                return booking
+        return None
+
+    async def day_bookings(self, day: date) -> List[dict]:
+        """Все записи дня (включая прошедшие) по возрастанию времени."""
+        async with self._get_session().get("/api/records", params={"day": day.isoformat()}) as response:
+            response.raise_for_status()
+            return await response.json()
+
+
+booking_service = BookingService()
@@ -176,6 +176,27 @@ const App = () => {
     enabled: !isAdmin && !!selectedDate && dayjs.isDayjs(selectedDate) && !!selectedMassageType && !!selectedDuration,
   });
 
+  // Живое обновление слотов: сервер присылает изменения по дням, перезапрашиваем только выбранный день
+  useEffect(() => {
+    if (isAdmin || !selectedDate || !window.EventSource) return;
+    const day = selectedDate.format("YYYY-MM-DD");
+    // Только дельты для выбранной услуги: перерыв после сеанса у типов массажа разный
+    const params = new URLSearchParams();
+    if (selectedMassageType && selectedDuration) {
+      params.append('massageType', selectedMassageType.id);
+      params.append('duration', selectedDuration.time.toString());
+    }
+    const source = new EventSource(`${API_BASE}/slots/stream?${params}`);
+    source.addEventListener("slots", (event) => {
+      const delta = JSON.parse(event.data);
+      if (delta.day === day) {
+        refetchSlots();
+      }
+    });
+    source.addEventListener("resync", () => refetchSlots());
+    return () => source.close();
+  }, [isAdmin, selectedDate, selectedMassageType, selectedDuration, refetchSlots]);
+
   // Получение записей пользователя с сервера
   const {
     data: serverBookings = [],
@@ -305,7 +326,10 @@ const App = () => {
               name: userNameForBooking,
               massageType: selectedMassageType.id,
               massageName: selectedMassageType.name,
-              price: selectedDuration.price
+              duration: selectedDuration.time,
+              price: selectedDuration.price,
+              // Запись уже создана — бот только подтверждает её, а не записывает второй раз
+              eventId: data.eventId
             });
             tg.sendData(dataToSend);
           } catch (err) {
@@ -61,7 +61,7 @@ export const useBooking = (tg, userName, refetchSlots) => {
 
         if (tg?.sendData) {
           try {
-            const dataToSend = JSON.stringify({ slot: selectedSlot, name: userNameForBooking });
+            const dataToSend = JSON.stringify({ slot: selectedSlot, name: userNameForBooking, eventId: data.eventId });
             tg.sendData(dataToSend);
           } catch (err) {
             console.error("Ошибка отправки данных в Telegram:", err);